@@ -0,0 +1,425 @@
+"""
+Creators catalog module
+Process-wide, in-memory copy of the creators list shared by every MediaFetcher
+"""
+
+import os
+import re
+import time
+import heapq
+import json
+import logging
+import asyncio
+import threading
+from array import array
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional
+
+from app.smart_search import FuzzyIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+# On-disk snapshot (Railway volume): the last downloaded creators list as JSON.
+SNAPSHOT_VERSION = 1
+
+
+def default_snapshot_path() -> Optional[str]:
+    """CATALOG_SNAPSHOT_PATH, or <DATA_DIR>/creators_catalog.json when the volume exists."""
+    env_path = os.getenv("CATALOG_SNAPSHOT_PATH")
+    if env_path is not None:
+        return env_path or None  # empty value disables the snapshot
+    data_dir = os.getenv("DATA_DIR", "/data")
+    if os.path.isdir(data_dir):
+        return os.path.join(data_dir, "creators_catalog.json")
+    return None
+
+
+def write_snapshot_file(path: str, creators: List[Dict[str, Any]], saved_at: float):
+    """Persist creators as JSON (atomic replace)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": SNAPSHOT_VERSION, "saved_at": saved_at, "creators": creators}, f,
+                  separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def read_snapshot_file(path: str) -> Optional[tuple]:
+    """Return (creators, saved_at) or None if the file is missing/incompatible."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if not isinstance(obj, dict) or obj.get("version") != SNAPSHOT_VERSION:
+        logger.info("Ignoring catalog snapshot written in another format")
+        return None
+    return obj["creators"], float(obj["saved_at"])
+
+
+@dataclass
+class CatalogStats:
+    """Counters for the shared catalog (exposed for production observability)."""
+
+    loads: int = 0
+    refresh_errors: int = 0
+    served: int = 0
+    last_load_seconds: float = 0.0
+    last_refresh_at: float = 0.0
+    # Startup-to-ready: seconds from start() (or first use) to the first usable snapshot.
+    ready_seconds: Optional[float] = None
+    ready_source: str = ""  # "disk" or "upstream"
+    snapshot_load_seconds: float = 0.0
+    snapshot_save_errors: int = 0
+
+
+_NORMALIZE_RE = re.compile(r'[\s_-]+')
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Lowercase and drop spaces, underscores and dashes ("Belle_Delphine" -> "belledelphine")."""
+    return _NORMALIZE_RE.sub('', (name or '').lower().strip())
+
+
+class NameIndex:
+    """Substring index over normalized creator names.
+
+    A creator matches a query when the normalized query and the normalized name are
+    equal or one contains the other. Instead of normalizing and scanning every name
+    per query, this keeps (built once per snapshot):
+      - normalized names
+      - trigram -> creator positions, to find names CONTAINING the query
+      - normalized name -> creator positions, to find names CONTAINED IN the query
+    """
+
+    def __init__(self, creators: List[Dict[str, Any]]):
+        self.creators = creators
+        self.normalized = [normalize_name(c.get('name')) for c in creators]
+        self.name_lengths = [len(c.get('name') or '') for c in creators]
+        self.by_name: Dict[str, List[int]] = {}
+        self.trigrams: Dict[str, array] = {}
+        self.max_len = 0
+
+        for i, n in enumerate(self.normalized):
+            self.by_name.setdefault(n, []).append(i)
+            if len(n) > self.max_len:
+                self.max_len = len(n)
+            for gram in {n[j:j + 3] for j in range(len(n) - 2)}:
+                postings = self.trigrams.get(gram)
+                if postings is None:
+                    postings = self.trigrams[gram] = array('i')
+                postings.append(i)
+
+    def _containing(self, q: str):
+        """Positions of names that contain q."""
+        if len(q) < 3:
+            # Too short for trigrams: the scan is still cheap on pre-normalized names.
+            return (i for i, n in enumerate(self.normalized) if q in n)
+        grams = {q[j:j + 3] for j in range(len(q) - 2)}
+        postings = [self.trigrams.get(g) for g in grams]
+        if any(p is None for p in postings):
+            return ()
+        rarest = min(postings, key=len)
+        normalized = self.normalized
+        return (i for i in rarest if q in normalized[i])
+
+    def _contained_in(self, q: str):
+        """Positions of names that are a substring of q (including empty names)."""
+        found = []
+        seen = set()
+        for start in range(len(q) + 1):
+            for end in range(start, min(len(q), start + self.max_len) + 1):
+                sub = q[start:end]
+                if sub in seen:
+                    continue
+                seen.add(sub)
+                hits = self.by_name.get(sub)
+                if hits:
+                    found.extend(hits)
+        return found
+
+    def find(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Matching creators, shortest names first (ties keep catalog order).
+
+        Returns copies: callers annotate them (e.g. 'source'), the snapshot stays untouched.
+        """
+        q = normalize_name(query)
+        positions = set(self._containing(q))
+        positions.update(self._contained_in(q))
+        lengths = self.name_lengths
+        best = heapq.nsmallest(limit, positions, key=lambda i: (lengths[i], i))
+        return [self.creators[i].copy() for i in best]
+
+
+class CatalogSnapshot:
+    """Immutable view of one successful catalog download.
+
+    Derived lookup structures are built once per snapshot, on first use (or ahead of
+    time by the catalog, in a worker thread).
+    """
+
+    def __init__(self, creators: List[Dict[str, Any]], loaded_at: Optional[float] = None):
+        self.creators = creators
+        self.loaded_at = loaded_at if loaded_at is not None else time.time()
+        self._build_lock = threading.Lock()
+        self._name_index: Optional[NameIndex] = None
+        self._fuzzy_index: Optional[FuzzyIndex] = None
+        self._by_key: Optional[Dict[tuple, Dict[str, Any]]] = None
+
+    def __len__(self) -> int:
+        return len(self.creators)
+
+    def age(self) -> float:
+        return time.time() - self.loaded_at
+
+    @property
+    def name_index(self) -> NameIndex:
+        if self._name_index is None:
+            with self._build_lock:
+                if self._name_index is None:
+                    started = time.monotonic()
+                    self._name_index = NameIndex(self.creators)
+                    logger.info("Catalog name index built in %.2fs", time.monotonic() - started)
+        return self._name_index
+
+    @property
+    def fuzzy_index(self) -> FuzzyIndex:
+        if self._fuzzy_index is None:
+            with self._build_lock:
+                if self._fuzzy_index is None:
+                    started = time.monotonic()
+                    self._fuzzy_index = FuzzyIndex(self.creators)
+                    logger.info("Catalog fuzzy index built in %.2fs", time.monotonic() - started)
+        return self._fuzzy_index
+
+    @property
+    def by_key(self) -> Dict[tuple, Dict[str, Any]]:
+        """(service, str(id)) -> creator; first occurrence wins, like the old linear scan."""
+        if self._by_key is None:
+            with self._build_lock:
+                if self._by_key is None:
+                    by_key: Dict[tuple, Dict[str, Any]] = {}
+                    for c in self.creators:
+                        by_key.setdefault((str(c.get("service")), str(c.get("id"))), c)
+                    self._by_key = by_key
+        return self._by_key
+
+    def get_creator(self, service: str, creator_id: Any) -> Optional[Dict[str, Any]]:
+        return self.by_key.get((str(service), str(creator_id)))
+
+    def build_indexes(self):
+        """Build every derived index (blocking; run it in a worker thread)."""
+        _ = self.by_key
+        _ = self.fuzzy_index
+        _ = self.name_index
+
+
+class CreatorCatalog:
+    """Loads the creators list once per process and keeps it fresh.
+
+    - The first caller waits for the initial download; concurrent callers share it.
+    - After that, every caller is answered from memory.
+    - A background task refreshes the list every CATALOG_TTL_SECONDS.
+    - While a refresh runs (or if it fails) the previous snapshot keeps being served.
+    - Every good download is saved to the data volume; on restart that file is loaded
+      first (milliseconds) and revalidated against upstream in the background.
+    """
+
+    def __init__(self, ttl_seconds: Optional[float] = None, snapshot_path: Optional[str] = "auto"):
+        self.ttl = ttl_seconds if ttl_seconds is not None else _env_float("CATALOG_TTL_SECONDS", 1800)
+        # After a failed refresh, retry sooner than the full TTL.
+        self.retry_seconds = min(self.ttl, _env_float("CATALOG_RETRY_SECONDS", 60))
+        self.snapshot_path = default_snapshot_path() if snapshot_path == "auto" else snapshot_path
+        self.stats = CatalogStats()
+        self._started_at = time.monotonic()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._background_task: Optional[asyncio.Task] = None
+        self._index_tasks: set = set()
+
+    @property
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        return self._snapshot
+
+    async def get_snapshot(self) -> Optional[CatalogSnapshot]:
+        """Return the current snapshot, loading it on first use."""
+        snap = self._snapshot
+        if snap is None:
+            if not await self.load_snapshot_file():
+                await self.refresh()
+            snap = self._snapshot
+        elif snap.age() > self.ttl:
+            # Stale: serve it anyway and revalidate in the background.
+            self._schedule_refresh()
+        if snap is not None:
+            self.stats.served += 1
+        return snap
+
+    async def get_creators(self) -> List[Dict[str, Any]]:
+        snap = await self.get_snapshot()
+        return snap.creators if snap else []
+
+    async def refresh(self) -> bool:
+        """Download the creators list and swap the snapshot. Single-flight."""
+        if self._lock.locked():
+            # Someone is already refreshing: wait for that result instead of downloading again.
+            async with self._lock:
+                return self._snapshot is not None
+
+        async with self._lock:
+            started = time.monotonic()
+            self.stats.last_refresh_at = time.time()
+            try:
+                creators = await self._download()
+            except Exception as e:
+                creators = None
+                logger.error(f"Error syncing database: {e}")
+
+            if not creators:
+                self.stats.refresh_errors += 1
+                if self._snapshot is not None:
+                    logger.warning("Catalog refresh failed; keeping previous snapshot")
+                return False
+
+            self._snapshot = CatalogSnapshot(creators)
+            self._schedule_index_build(self._snapshot)
+            self.stats.loads += 1
+            self.stats.last_load_seconds = time.monotonic() - started
+            self._mark_ready("upstream")
+            logger.info(
+                "Catalog loaded: %s creators in %.2fs", len(creators), self.stats.last_load_seconds
+            )
+
+        await self._save_snapshot_file(self._snapshot)
+        return True
+
+    async def load_snapshot_file(self) -> bool:
+        """Load the on-disk snapshot if nothing is in memory yet."""
+        if not self.snapshot_path:
+            return False
+        async with self._lock:
+            if self._snapshot is not None:
+                return True
+            started = time.monotonic()
+            try:
+                result = await asyncio.to_thread(read_snapshot_file, self.snapshot_path)
+            except Exception as e:
+                logger.warning(f"Could not read catalog snapshot: {e}")
+                return False
+            if not result or not result[0]:
+                return False
+
+            creators, saved_at = result
+            self._snapshot = CatalogSnapshot(creators, loaded_at=saved_at)
+            self._schedule_index_build(self._snapshot)
+            self.stats.snapshot_load_seconds = time.monotonic() - started
+            self._mark_ready("disk")
+            logger.info(
+                "Catalog snapshot loaded from disk: %s creators in %.3fs (age %.0fs)",
+                len(creators),
+                self.stats.snapshot_load_seconds,
+                self._snapshot.age(),
+            )
+            return True
+
+    async def _save_snapshot_file(self, snap: Optional[CatalogSnapshot]):
+        if not self.snapshot_path or snap is None:
+            return
+        try:
+            await asyncio.to_thread(write_snapshot_file, self.snapshot_path, snap.creators, snap.loaded_at)
+        except Exception as e:
+            self.stats.snapshot_save_errors += 1
+            logger.warning(f"Could not save catalog snapshot: {e}")
+
+    def _mark_ready(self, source: str):
+        if self.stats.ready_seconds is None:
+            self.stats.ready_seconds = time.monotonic() - self._started_at
+            self.stats.ready_source = source
+            logger.info("Catalog ready for searches %.3fs after startup (source=%s)", self.stats.ready_seconds, source)
+
+    async def _download(self) -> Optional[List[Dict[str, Any]]]:
+        # Imported lazily: app.fetcher depends on this module.
+        from app.fetcher import MediaFetcher
+
+        async with MediaFetcher() as fetcher:
+            data = await fetcher._download_creators_list()
+        return data if isinstance(data, list) else None
+
+    async def find_matching(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Creators whose normalized name equals, contains or is contained in the query."""
+        snap = await self.get_snapshot()
+        if not snap:
+            return []
+        return await asyncio.to_thread(snap.name_index.find, query, limit)
+
+    async def get_creator(self, service: str, creator_id: Any) -> Optional[Dict[str, Any]]:
+        """Resolve a creator from callback data (service, id) in O(1)."""
+        snap = await self.get_snapshot()
+        if not snap:
+            return None
+        if snap._by_key is None:
+            # First lookup right after a load: build off the event loop.
+            await asyncio.to_thread(lambda: snap.by_key)
+        return snap.get_creator(service, creator_id)
+
+    def _schedule_index_build(self, snap: CatalogSnapshot):
+        """Build lookup indexes off the event loop so searches find them ready."""
+        task = asyncio.create_task(asyncio.to_thread(snap.build_indexes))
+        self._index_tasks.add(task)
+        task.add_done_callback(self._index_tasks.discard)
+
+    def _schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self.refresh())
+
+    # -------------------------
+    # Background lifecycle
+    # -------------------------
+    def start(self):
+        """Start the background warm-up + refresh loop (call from a running event loop)."""
+        if self._background_task and not self._background_task.done():
+            return
+        if self._snapshot is None:
+            self._started_at = time.monotonic()
+        self._background_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._background_task, self._refresh_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._background_task = None
+        self._refresh_task = None
+
+    async def _refresh_loop(self):
+        # Warm start from disk, then always revalidate once against upstream.
+        if await self.load_snapshot_file():
+            await self.refresh()
+        while True:
+            ok = True
+            snap = self._snapshot
+            if snap is None or snap.age() >= self.ttl:
+                ok = await self.refresh()
+            snap = self._snapshot
+            if not ok or snap is None:
+                delay = self.retry_seconds
+            else:
+                delay = max(1.0, self.ttl - snap.age())
+            await asyncio.sleep(delay)
+
+
+# Global instance
+creator_catalog = CreatorCatalog()
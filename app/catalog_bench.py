@@ -0,0 +1,188 @@
+"""Offline benchmark for the creators catalog.
+
+Uses a synthetic catalog (no network) shaped like /api/v1/creators.
+
+  startup: time until the first search can be answered
+           - before: parse the upstream JSON payload (network time not included)
+           - after:  load the on-disk snapshot written by app.catalog
+  search:  per-query time of find_all_matching_creators
+           - before: normalize + scan every creator per query
+           - after:  app.catalog.NameIndex (built once per snapshot)
+  fuzzy:   p50/p99 latency of the fuzzy search used by the text search flow
+           - before: SmartSearch.find_similar over the full creators list
+           - after:  app.smart_search.FuzzyIndex (built once per snapshot)
+
+Run:
+  python app/catalog_bench.py [startup|search|fuzzy] [--size 300000]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import string
+import asyncio
+import argparse
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("ADMIN_ID", "123456")
+
+
+def synthetic_creators(size: int, seed: int = 7):
+    rnd = random.Random(seed)
+    services = ["onlyfans", "fansly", "candfans"]
+    creators = []
+    for i in range(size):
+        n = rnd.randint(4, 18)
+        name = "".join(rnd.choice(string.ascii_lowercase + "_- ") for _ in range(n)).strip() or "x"
+        creators.append({
+            "id": str(10_000_000 + i),
+            "name": name,
+            "service": rnd.choice(services),
+            "indexed": 1_600_000_000 + i,
+            "updated": 1_700_000_000 + i,
+            "favorited": rnd.randint(0, 5000),
+        })
+    return creators
+
+
+def bench_startup(creators):
+    from app.catalog import CreatorCatalog
+
+    payload = json.dumps(creators).encode()
+    t0 = time.perf_counter()
+    json.loads(payload)
+    parse_s = time.perf_counter() - t0
+
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        writer = CreatorCatalog(ttl_seconds=3600, snapshot_path=path)
+
+        async def fake_download():
+            return creators
+
+        writer._download = fake_download
+        asyncio.run(writer.refresh())
+
+        reader = CreatorCatalog(ttl_seconds=3600, snapshot_path=path)
+
+        async def first_snapshot():
+            # Timed inside the loop: asyncio.run() also waits for the background index build.
+            t0 = time.perf_counter()
+            await reader.get_snapshot()
+            return time.perf_counter() - t0
+
+        load_s = asyncio.run(first_snapshot())
+        size_mb = os.path.getsize(path) / 1024 / 1024
+    finally:
+        os.remove(path)
+
+    print(f"creators:                    {len(creators)}")
+    print(f"upstream JSON payload:       {len(payload) / 1024 / 1024:.1f} MB")
+    print(f"before: JSON parse only:     {parse_s * 1000:.0f} ms (+ download time)")
+    print(f"after:  disk snapshot load:  {load_s * 1000:.0f} ms ({size_mb:.1f} MB file)")
+
+
+QUERIES = ["belle delphine", "sophie rain", "hannaowo", "abc", "xq", "lorem_ipsum", "k-j m", "zzzzzz"]
+
+
+def _legacy_find(model_name, creators):
+    import re
+    search_normalized = re.sub(r'[\s_-]+', '', model_name.lower().strip())
+    matches = []
+    for creator in creators:
+        name_normalized = re.sub(r'[\s_-]+', '', creator.get('name', '').lower())
+        if (search_normalized == name_normalized or
+                search_normalized in name_normalized or
+                name_normalized in search_normalized):
+            matches.append(creator)
+    matches.sort(key=lambda c: len(c.get('name', '')))
+    return matches[:10]
+
+
+def _per_query_ms(fn, queries, repeat: int = 1):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            fn(q)
+    return (time.perf_counter() - t0) * 1000 / (len(queries) * repeat)
+
+
+def bench_search(creators):
+    from app.catalog import NameIndex
+
+    t0 = time.perf_counter()
+    index = NameIndex(creators)
+    build_s = time.perf_counter() - t0
+
+    for q in QUERIES:
+        assert index.find(q) == _legacy_find(q, creators), q
+
+    before = _per_query_ms(lambda q: _legacy_find(q, creators), QUERIES)
+    after = _per_query_ms(index.find, QUERIES, repeat=20)
+    print(f"creators:                    {len(creators)}")
+    print(f"index build (once/snapshot): {build_s * 1000:.0f} ms")
+    print(f"before: linear scan:         {before:.2f} ms/query")
+    print(f"after:  name index:          {after:.2f} ms/query")
+
+
+def _percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return p50, p99
+
+
+def bench_fuzzy(creators):
+    from app.smart_search import SmartSearch, FuzzyIndex
+
+    t0 = time.perf_counter()
+    index = FuzzyIndex(creators)
+    build_s = time.perf_counter() - t0
+
+    rnd = random.Random(11)
+    queries = QUERIES + [c["name"] for c in rnd.sample(creators, 40)]
+    for q in queries[:10]:
+        assert index.search(q) == SmartSearch.find_similar(q, creators), q
+
+    def timed(fn):
+        samples = []
+        for q in queries:
+            t = time.perf_counter()
+            fn(q)
+            samples.append((time.perf_counter() - t) * 1000)
+        return _percentiles(samples)
+
+    before = timed(lambda q: SmartSearch.find_similar(q, creators))
+    after = timed(index.search)
+    print(f"creators:                    {len(creators)}")
+    print(f"fuzzy index build:           {build_s * 1000:.0f} ms")
+    print(f"before: find_similar:        p50 {before[0]:.1f} ms, p99 {before[1]:.1f} ms")
+    print(f"after:  FuzzyIndex.search:   p50 {after[0]:.1f} ms, p99 {after[1]:.1f} ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", nargs="?", default="startup", choices=["startup", "search", "fuzzy"])
+    parser.add_argument("--size", type=int, default=300_000)
+    args = parser.parse_args()
+
+    creators = synthetic_creators(args.size)
+    if args.mode == "startup":
+        bench_startup(creators)
+    elif args.mode == "search":
+        bench_search(creators)
+    elif args.mode == "fuzzy":
+        bench_fuzzy(creators)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,187 @@
+"""Offline benchmark for UserDB access from the event loop.
+
+Replays a synthetic update load (default 500 updates/s) where every update does
+what a typical handler does: get_user + is_license_active + update_user. A probe
+task sleeps 5 ms in a loop and records how late it wakes up (event-loop lag).
+
+  lag: p50/p99/max event-loop lag and handler latency
+       - before: UserDB called directly from the handlers (blocks the loop)
+       - after:  app.users_db.AsyncUserDB (one DB thread, long-lived connection)
+
+  ops: get_user / update_user throughput on the calling thread
+       - before: new connection per call, rollback journal, synchronous=FULL, no row cache
+       - after:  long-lived connection with WAL, synchronous=NORMAL, cache_size, mmap_size,
+                 plus the LRU user-row cache (get_user hits it after the warm-up)
+
+--io-ms adds a sleep to every SQL statement to emulate a slow network volume
+such as Railway's /data (0 = local disk as is). --db benchmarks a real path instead
+of a temporary file.
+
+Run:
+  python app/db_bench.py [lag|ops] [--rate 500] [--seconds 5] [--io-ms 1] [--db PATH] [--ops 5000]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("ADMIN_ID", "123456")
+
+USERS = 2_000
+
+
+def make_db(path: str, io_ms: float):
+    from app.users_db import UserDB
+
+    class SlowVolumeDB(UserDB):
+        def _get_conn(self):
+            conn = super()._get_conn()
+            if io_ms > 0:
+                conn.set_trace_callback(lambda _sql: time.sleep(io_ms / 1000))
+            return conn
+
+    return SlowVolumeDB(db_path=path)
+
+
+def _percentiles(samples_ms):
+    ordered = sorted(samples_ms) or [0.0]
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return p50, p99, ordered[-1]
+
+
+async def _replay(handle, rate: int, seconds: float):
+    lags = []
+    latencies = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            t = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(max(0.0, (time.perf_counter() - t - 0.005) * 1000))
+
+    async def one(user_id: int):
+        t = time.perf_counter()
+        await handle(user_id)
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    probe_task = asyncio.create_task(probe())
+    tasks = []
+    total = int(rate * seconds)
+    started = time.perf_counter()
+    for i in range(total):
+        # Open-loop arrivals: updates keep coming whether or not the bot keeps up.
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(1_000 + i % USERS)))
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - started
+    done.set()
+    await probe_task
+    return _percentiles(lags), _percentiles(latencies), total / wall
+
+
+def bench_lag(path: str, rate: int, seconds: float, io_ms: float):
+    from app.users_db import AsyncUserDB
+
+    db = make_db(path, io_ms)
+    for uid in range(1_000, 1_000 + USERS):
+        db.get_user(uid)
+
+    async def direct(user_id):
+        db.get_user(user_id)
+        db.is_license_active(user_id)
+        db.update_user(user_id, language="pt")
+
+    async def run_after():
+        adb = AsyncUserDB(db)
+        try:
+            async def facade(user_id):
+                await adb.get_user(user_id)
+                await adb.is_license_active(user_id)
+                await adb.update_user(user_id, language="pt")
+            return await _replay(facade, rate, seconds)
+        finally:
+            await adb.close()
+
+    before = asyncio.run(_replay(direct, rate, seconds))
+    after = asyncio.run(run_after())
+
+    print(f"load:                        {rate} updates/s for {seconds:.0f}s, 3 queries/update, io {io_ms} ms/statement")
+    for label, ((l50, l99, lmax), (h50, h99, _), throughput) in (("before: sync UserDB", before), ("after:  AsyncUserDB", after)):
+        print(f"{label + ':':<29}loop lag p50 {l50:.1f} ms, p99 {l99:.1f} ms, max {lmax:.0f} ms | "
+              f"handler p50 {h50:.1f} ms, p99 {h99:.1f} ms | {throughput:.0f} updates/s")
+
+
+def make_legacy_db(path: str):
+    from app.users_db import UserDB
+
+    class LegacyDB(UserDB):
+        # Previous behaviour: a fresh connection per call, default pragmas, no row cache.
+        def _get_conn(self):
+            return sqlite3.connect(self.db_path)
+
+    db = LegacyDB(db_path=path)
+    db._user_cache_max = 0
+    return db
+
+
+def _ops_per_second(fn, ops: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(ops):
+        fn(1_000 + i % USERS)
+    return ops / (time.perf_counter() - t0)
+
+
+def bench_ops(tmpdir: str, ops: int):
+    results = {}
+    for label, db in (("before", make_legacy_db(os.path.join(tmpdir, "legacy.db"))),
+                      ("after", make_db(os.path.join(tmpdir, "wal.db"), 0.0))):
+        for uid in range(1_000, 1_000 + USERS):
+            db.get_user(uid)
+        results[label] = (
+            _ops_per_second(db.get_user, ops),
+            _ops_per_second(lambda uid: db.update_user(uid, language="pt"), ops),
+        )
+    print(f"users: {USERS}, ops per measurement: {ops}")
+    print(f"before: connect per call:    get_user {results['before'][0]:,.0f}/s, update_user {results['before'][1]:,.0f}/s")
+    print(f"after:  WAL + row cache:     get_user {results['after'][0]:,.0f}/s, update_user {results['after'][1]:,.0f}/s")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", nargs="?", default="lag", choices=["lag", "ops"])
+    parser.add_argument("--rate", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--io-ms", type=float, default=1.0)
+    parser.add_argument("--db", default=None)
+    parser.add_argument("--ops", type=int, default=5_000)
+    args = parser.parse_args()
+
+    if args.mode == "ops":
+        # Use --db's directory to measure on the real volume.
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(args.db)) if args.db else None) as tmpdir:
+            bench_ops(tmpdir, args.ops)
+        return 0
+
+    if args.db:
+        bench_lag(args.db, args.rate, args.seconds, args.io_ms)
+        return 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bench_lag(os.path.join(tmpdir, "bench.db"), args.rate, args.seconds, args.io_ms)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
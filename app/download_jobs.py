@@ -0,0 +1,174 @@
+"""
+Download jobs module
+Persistent queue of download pages (SQLite) consumed by a worker pool; resumes after restarts
+"""
+
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.users_db import async_user_db
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+@dataclass
+class JobStats:
+    submitted: int = 0
+    resumed: int = 0
+    completed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    running: int = 0
+    queue_depth: int = 0
+
+
+# runner(job) -> next offset, or None when the creator has no more pages
+JobRunner = Callable[[Dict[str, Any]], Awaitable[Optional[int]]]
+
+# on_stopped(job, sent_count): a page the user stopped has finished; sent_count is final
+StopNotifier = Callable[[Dict[str, Any], int], Awaitable[Any]]
+
+
+class DownloadJobQueue:
+    """Runs download pages as jobs stored in the download_jobs table.
+
+    - submit() persists the job first, so a redeploy never loses it.
+    - DOWNLOAD_WORKERS workers run jobs concurrently (one page per user at a time:
+      a new submit cancels the user's previous unfinished job).
+    - On start(), jobs left queued/running by the previous process are resumed; the
+      runner skips items already recorded in download_job_items.
+    - stop() leaves running jobs as 'running' in the DB: they resume on the next start.
+    - cancel_user() returns at once; once the stopped page has really finished (the send
+      in flight lands first), on_stopped reports how many items it delivered.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or async_user_db
+        self.stats = JobStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._running: Dict[int, asyncio.Task] = {}  # job_id -> runner task
+        self._runner: Optional[JobRunner] = None
+        self._on_stopped: Optional[StopNotifier] = None
+        self._stop_requested = set()  # running job ids stopped by their user
+        self._resumed = set()
+        self._stopping = False
+
+    async def start(self, runner: JobRunner, workers: int = None, on_stopped: StopNotifier = None):
+        self._runner = runner
+        self._on_stopped = on_stopped
+        self._stopping = False
+        self._queue = asyncio.Queue()
+        for job in await self.db.list_unfinished_download_jobs():
+            await self.db.set_download_job_status(job["id"], "queued")
+            self._queue.put_nowait(job["id"])
+            self._resumed.add(job["id"])
+            self.stats.resumed += 1
+        if self.stats.resumed:
+            logger.info(f"♻️ Resuming {self.stats.resumed} download job(s) from the previous run")
+        count = max(1, workers or _env_int("DOWNLOAD_WORKERS", 4))
+        self._workers = [asyncio.create_task(self._worker(), name=f"download-worker-{i}") for i in range(count)]
+
+    async def submit(self, user_id: int, service: str, creator_id: str, name: str, offset: int,
+                     chat_id: int = None, message_id: int = None) -> int:
+        self._cancel_running(await self.db.cancel_download_jobs(user_id))
+        job_id = await self.db.create_download_job(user_id, service, creator_id, name, offset,
+                                                   chat_id=chat_id, message_id=message_id)
+        self._queue.put_nowait(job_id)
+        self.stats.submitted += 1
+        self.stats.queue_depth = self._queue.qsize()
+        return job_id
+
+    async def cancel_user(self, user_id: int) -> bool:
+        """Cancel the user's unfinished job without waiting for it.
+
+        Returns False if there was nothing to stop. The final sent count goes to on_stopped:
+        right away for a job that was still queued, from the worker for a running one.
+        """
+        ids = await self.db.cancel_download_jobs(user_id)
+        for job_id in ids:
+            task = self._running.get(job_id)
+            if task is not None and not task.done():
+                self._stop_requested.add(job_id)
+                task.cancel()
+            else:
+                await self._report_stopped(job_id)
+        return bool(ids)
+
+    async def _report_stopped(self, job_id: int):
+        if self._on_stopped is None:
+            return
+        job = await self.db.get_download_job(job_id)
+        if not job:
+            return
+        try:
+            await self._on_stopped(job, int(job["sent_count"] or 0))
+        except Exception as e:
+            logger.warning(f"Download job {job_id} stop notification failed: {e}")
+
+    def _cancel_running(self, job_ids) -> List[asyncio.Task]:
+        tasks = []
+        for job_id in job_ids:
+            task = self._running.get(job_id)
+            if task is not None and not task.done():
+                task.cancel()
+                tasks.append(task)
+        return tasks
+
+    async def stop(self):
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self.stats.queue_depth = self._queue.qsize()
+            job = await self.db.get_download_job(job_id)
+            # Superseded or stopped while queued.
+            if not job or not await self.db.set_download_job_status(job_id, "running", only_if=("queued",)):
+                continue
+            # Items already delivered before a restart are skipped by the runner.
+            job["sent_keys"] = await self.db.get_download_job_sent_keys(job_id)
+            job["resumed"] = job_id in self._resumed
+
+            task = asyncio.create_task(self._runner(job))
+            self._running[job_id] = task
+            self.stats.running += 1
+            try:
+                next_offset = await task
+                if await self.db.set_download_job_status(job_id, "done", next_offset=next_offset, only_if=("running",)):
+                    self.stats.completed += 1
+            except asyncio.CancelledError:
+                if self._stopping:
+                    raise  # shutdown: the job stays 'running' and resumes on the next start
+                # Drop checkpoints written by the album that was allowed to finish after the cancel.
+                await self.db.set_download_job_status(job_id, "cancelled")
+                self.stats.cancelled += 1
+                if job_id in self._stop_requested:
+                    self._stop_requested.discard(job_id)
+                    await self._report_stopped(job_id)
+            except Exception as e:
+                logger.error(f"Download job {job_id} failed: {e}", exc_info=True)
+                await self.db.set_download_job_status(job_id, "failed", only_if=("running",))
+                self.stats.failed += 1
+            finally:
+                self.stats.running -= 1
+                self._running.pop(job_id, None)
+
+
+# Global instance
+download_jobs = DownloadJobQueue()
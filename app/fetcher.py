@@ -5,12 +5,17 @@ Handles searching and downloading media from secret archives
 """
 
 import os
+import uuid
 import logging
 import asyncio
 import aiohttp
 import aiofiles
 from typing import List, Dict, Any, Optional
+from urllib.parse import urlparse
 from app.config import Config
+from app.catalog import creator_catalog
+from app.http_pool import http_pool
+from app.ttl_cache import AsyncTTLCache
 config = Config()
 
 logger = logging.getLogger(__name__)
@@ -21,6 +26,21 @@ DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "/tmp/downloads")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+# Raw posts pages shared by every MediaFetcher, keyed by (service, creator_id, offset)
+posts_page_cache = AsyncTTLCache(
+    ttl=_env_float("POSTS_CACHE_TTL_SECONDS", 300),
+    max_entries=int(_env_float("POSTS_CACHE_MAX_ENTRIES", 512)),
+    cacheable=lambda posts: isinstance(posts, list),
+)
+
+
 class MediaItem:
     """Represents a media item"""
     
@@ -31,6 +51,14 @@ class MediaItem:
         self.post_id = post_id
         self.local_path: Optional[str] = None
     
+    @property
+    def source_key(self) -> Optional[str]:
+        """Upstream file path (a content hash): the same bytes for every user and post."""
+        path = urlparse(self.url).path
+        if path.startswith("/data/"):
+            path = path[len("/data"):]
+        return path or None
+
     def __repr__(self):
         return f"MediaItem(url={self.url}, type={self.media_type}, post={self.post_id})"
 
@@ -47,59 +75,60 @@ class MediaFetcher:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': 'text/css',
         }
+        self.timeout = aiohttp.ClientTimeout(total=180)
         self._creators_cache = None
+        self._owns_session = False
     
     async def __aenter__(self):
-        """Async context manager entry"""
-        self.session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=180),
-            headers=self.headers
-        )
+        """Async context manager entry.
+
+        Borrows the process-wide pooled session (app.http_pool) when it is running so
+        keep-alive connections, TLS sessions and DNS results survive between searches.
+        Falls back to a private session (scripts/tests without run_bot).
+        """
+        if http_pool.is_open:
+            self.session = http_pool.session
+            self._owns_session = False
+        else:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+            self._owns_session = True
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit"""
-        if self.session:
+        if self.session and self._owns_session:
             await self.session.close()
 
+    async def _download_creators_list(self) -> Optional[List[Dict]]:
+        """Download the full creators list from upstream (no caching here)."""
+        url = f"{self.BASE_URL}/api/v1/creators"
+        async with self.session.get(url, headers=self.headers, timeout=self.timeout) as response:
+            if response.status != 200:
+                logger.warning(f"Database sync returned HTTP {response.status}")
+                return None
+            logger.info(f"Syncing secret database...")
+            return await response.json(content_type=None)
+
     async def _get_creators_list(self) -> List[Dict]:
-        """Get and cache the full creators list"""
+        """Get the full creators list from the process-wide catalog.
+
+        The list is downloaded once per process (see app.catalog) instead of once per
+        MediaFetcher, and refreshed in the background.
+        """
         if self._creators_cache is not None:
             return self._creators_cache
-        
-        try:
-            url = f"{self.BASE_URL}/api/v1/creators"
-            async with self.session.get(url) as response:
-                if response.status == 200:
-                    self._creators_cache = await response.json(content_type=None)
-                    logger.info(f"Syncing secret database...")
-                    return self._creators_cache
-        except Exception as e:
-            logger.error(f"Error syncing database: {e}")
-        
-        return []
+        creators = await creator_catalog.get_creators()
+        if creators:
+            self._creators_cache = creators
+        return creators
 
     async def find_all_matching_creators(self, model_name: str) -> List[Dict[str, Any]]:
-        """Find all creators matching the search term"""
-        creators = await self._get_creators_list()
-        if not creators:
-            return []
-        
-        import re
-        search_normalized = re.sub(r'[\s_-]+', '', model_name.lower().strip())
-        matches = []
-        
-        for creator in creators:
-            name = creator.get('name', '').lower()
-            name_normalized = re.sub(r'[\s_-]+', '', name)
-            
-            if (search_normalized == name_normalized or 
-                search_normalized in name_normalized or
-                name_normalized in search_normalized):
-                matches.append(creator)
-        
-        matches.sort(key=lambda c: len(c.get('name', '')))
-        return matches[:10]
+        """Find all creators matching the search term (top 10, shortest names first).
+
+        Uses the catalog's precomputed normalized-name index instead of normalizing
+        and scanning every creator per query.
+        """
+        return await creator_catalog.find_matching(model_name, limit=10)
 
     async def fetch_posts_page(self, creator: Dict[str, Any], offset: int = 0) -> Dict[str, Any]:
         """Fetch a single *posts* page.
@@ -112,8 +141,6 @@ class MediaFetcher:
           - posts: raw posts list
           - media_items: flattened List[MediaItem]
         """
-        media_items: List[MediaItem] = []
-        posts: List[Dict[str, Any]] = []
         service = creator.get('service')
         creator_id = creator.get('id')
         
@@ -121,39 +148,53 @@ class MediaFetcher:
             return {"posts": [], "media_items": []}
         
         try:
-            posts_url = f"{self.BASE_URL}/api/v1/{service}/user/{creator_id}/posts?o={offset}"
-            async with self.session.get(posts_url) as response:
-                if response.status != 200:
-                    return {"posts": [], "media_items": []}
-                
-                posts = await response.json(content_type=None)
-                if not isinstance(posts, list):
-                    return {"posts": [], "media_items": []}
-                
-                for post in posts:
-                    post_id = post.get('id')
-                    file_info = post.get('file', {})
-                    if file_info and file_info.get('path'):
-                        path = file_info['path']
-                        media_url = f"{self.BASE_URL}/data{path}"
-                        filename = file_info.get('name') or f"{post_id}_main"
-                        ext = path.lower().split('.')[-1] if '.' in path else ''
-                        media_type = "video" if ext in ['mp4', 'm4v', 'mov', 'webm', 'avi'] else "photo"
-                        media_items.append(MediaItem(media_url, filename, media_type, str(post_id)))
-                    
-                    for i, attachment in enumerate(post.get('attachments', [])):
-                        if attachment.get('path'):
-                            path = attachment['path']
-                            media_url = f"{self.BASE_URL}/data{path}"
-                            filename = attachment.get('name') or f"{post_id}_att{i}"
-                            ext = path.lower().split('.')[-1] if '.' in path else ''
-                            media_type = "video" if ext in ['mp4', 'm4v', 'mov', 'webm', 'avi'] else "photo"
-                            media_items.append(MediaItem(media_url, filename, media_type, str(post_id)))
+            # Shared across users: one upstream request per (service, id, offset) per TTL window,
+            # and concurrent identical requests (sel: preview + dlpage:0) share a single call.
+            posts = await posts_page_cache.get_or_load(
+                (str(service), str(creator_id), int(offset)),
+                lambda: self._download_posts_page(service, creator_id, offset),
+            )
         except Exception:
             # keep the fetcher silent; the caller handles empty pages
             return {"posts": [], "media_items": []}
 
-        return {"posts": posts, "media_items": media_items}
+        if not posts:
+            return {"posts": [], "media_items": []}
+
+        # MediaItems are mutable (local_path), so each caller gets fresh ones from the cached posts.
+        return {"posts": posts, "media_items": self._media_items_from_posts(posts)}
+
+    async def _download_posts_page(self, service: str, creator_id: str, offset: int) -> Optional[List[Dict[str, Any]]]:
+        """Fetch one raw posts page from upstream. None on any non-success (never cached)."""
+        posts_url = f"{self.BASE_URL}/api/v1/{service}/user/{creator_id}/posts?o={offset}"
+        async with self.session.get(posts_url, headers=self.headers, timeout=self.timeout) as response:
+            if response.status != 200:
+                return None
+            posts = await response.json(content_type=None)
+            return posts if isinstance(posts, list) else None
+
+    def _media_items_from_posts(self, posts: List[Dict[str, Any]]) -> List[MediaItem]:
+        media_items: List[MediaItem] = []
+        for post in posts:
+            post_id = post.get('id')
+            file_info = post.get('file', {})
+            if file_info and file_info.get('path'):
+                path = file_info['path']
+                media_url = f"{self.BASE_URL}/data{path}"
+                filename = file_info.get('name') or f"{post_id}_main"
+                ext = path.lower().split('.')[-1] if '.' in path else ''
+                media_type = "video" if ext in ['mp4', 'm4v', 'mov', 'webm', 'avi'] else "photo"
+                media_items.append(MediaItem(media_url, filename, media_type, str(post_id)))
+            
+            for i, attachment in enumerate(post.get('attachments', [])):
+                if attachment.get('path'):
+                    path = attachment['path']
+                    media_url = f"{self.BASE_URL}/data{path}"
+                    filename = attachment.get('name') or f"{post_id}_att{i}"
+                    ext = path.lower().split('.')[-1] if '.' in path else ''
+                    media_type = "video" if ext in ['mp4', 'm4v', 'mov', 'webm', 'avi'] else "photo"
+                    media_items.append(MediaItem(media_url, filename, media_type, str(post_id)))
+        return media_items
 
     async def fetch_posts_paged(self, creator: Dict[str, Any], offset: int = 0) -> List[MediaItem]:
         """Backward-compatible wrapper that returns only the flattened media list."""
@@ -172,7 +213,10 @@ class MediaFetcher:
             return False
             
         ext = item.url.split('.')[-1].split('?')[0]
-        local_filename = f"{item.post_id}_{item.filename}"
+        # Unique per download: a post often lists its main file again as an attachment, the
+        # pipeline downloads several items at once, and DOWNLOAD_WORKERS jobs of different users
+        # may fetch the same creator page; none of them may share (or delete) another's path.
+        local_filename = f"{item.post_id}_{uuid.uuid4().hex[:12]}_{item.filename}"
         if not local_filename.endswith(f".{ext}"):
             local_filename += f".{ext}"
             
@@ -188,7 +232,7 @@ class MediaFetcher:
         try:
             # Separate connect/read timeouts to fail fast on bad/slow links
             timeout = aiohttp.ClientTimeout(total=180, sock_connect=15, sock_read=30)
-            async with self.session.get(item.url, timeout=timeout) as response:
+            async with self.session.get(item.url, headers=self.headers, timeout=timeout) as response:
                 if response.status != 200:
                     return False
 
@@ -231,6 +275,14 @@ class MediaFetcher:
                 item.local_path = local_path
                 return True
 
+        except asyncio.CancelledError:
+            # Cancelled mid-stream (prefetch dropped / user stopped): never leave partial files
+            try:
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+            except Exception:
+                pass
+            raise
         except asyncio.TimeoutError:
             logger.warning("Download timed out; skipping item")
             try:
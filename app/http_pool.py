@@ -0,0 +1,107 @@
+"""
+HTTP pool module
+One long-lived aiohttp ClientSession per process (keep-alive, DNS cache, TLS reuse)
+"""
+
+import os
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+@dataclass
+class PoolStats:
+    """Connection-level counters collected through aiohttp tracing."""
+
+    requests: int = 0
+    connections_created: int = 0
+    connections_reused: int = 0
+    dns_cache_hits: int = 0
+    dns_cache_misses: int = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.connections_created + self.connections_reused
+        return (self.connections_reused / total) if total else 0.0
+
+
+class HttpPool:
+    """Owns the shared ClientSession.
+
+    Created once in run_bot (inside the running loop) and closed on shutdown.
+    Everything that talks HTTP (MediaFetcher, the catalog, payment clients) borrows
+    `http_pool.session` instead of opening its own.
+    """
+
+    def __init__(self):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.stats = PoolStats()
+
+    @property
+    def is_open(self) -> bool:
+        return self.session is not None and not self.session.closed
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        stats = self.stats
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(_session, _ctx, _params):
+            stats.requests += 1
+
+        async def on_connection_create_end(_session, _ctx, _params):
+            stats.connections_created += 1
+
+        async def on_connection_reuseconn(_session, _ctx, _params):
+            stats.connections_reused += 1
+
+        async def on_dns_cache_hit(_session, _ctx, _params):
+            stats.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(_session, _ctx, _params):
+            stats.dns_cache_misses += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+
+    async def start(self) -> aiohttp.ClientSession:
+        if self.is_open:
+            return self.session
+
+        connector = aiohttp.TCPConnector(
+            limit=_env_int("HTTP_POOL_LIMIT", 100),
+            limit_per_host=_env_int("HTTP_POOL_LIMIT_PER_HOST", 20),
+            ttl_dns_cache=_env_int("HTTP_DNS_CACHE_TTL", 300),
+            keepalive_timeout=_env_int("HTTP_KEEPALIVE_SECONDS", 30),
+        )
+        # No default headers/timeouts: each client passes its own per request.
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=15),
+            trace_configs=[self._trace_config()],
+        )
+        logger.info("🌐 Shared HTTP pool started")
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+
+# Global instance
+http_pool = HttpPool()
@@ -11,7 +11,11 @@ import sys
 import random
 import re
 import json
+import signal
+import time
+from dataclasses import asdict
 from datetime import datetime
+from typing import Optional
 import fcntl
 
 # Configure logging
@@ -26,10 +30,19 @@ async def run_bot():
     try:
         # Package imports
         from app.config import Config
-        from app.fetcher import MediaFetcher
+        from app.fetcher import MediaFetcher, posts_page_cache
+        from app.catalog import creator_catalog
+        from app.http_pool import http_pool
+        from app.prefetch import prefetcher
+        from app.download_jobs import download_jobs
+        from app.reconciler import payment_reconciler
+        from app.webhook_inbox import webhook_inbox
+        from app.telegram_webhook import WEBHOOK_PATH, telegram_webhook
+        from app.pipeline import run_ordered_pipeline
+        from app.rate_limiter import Priority, telegram_limiter
         from app.uploader import TelegramUploader
         from app.languages import get_text
-        from app.users_db import user_db
+        from app.users_db import user_db, async_user_db
         from app.smart_search import smart_search
         from app.payments import (
             create_payment_for_user,
@@ -41,7 +54,7 @@ async def run_bot():
             nowpayments_allowed_for_plan,
             is_stripe_no_payment_methods_error,
         )
-        from app.payments import AsaasClient, NowPaymentsClient
+        from app.payments import NowPaymentsClient, payment_providers
 
         
         # Telegram Libraries
@@ -70,10 +83,10 @@ async def run_bot():
                 # Secret models for visual impact
                 self.big_three = ["hannaowo", "belledelphine", "sophierain"]
 
-            def get_main_keyboard(self, user_id, lang):
+            async def get_main_keyboard(self, user_id, lang):
                 """Generate the main persistent GUI keyboard"""
                 is_admin = (user_id == config.ADMIN_ID)
-                u_data = user_db.get_user(user_id)
+                u_data = await async_user_db.get_user(user_id)
                 
                 keyboard = [
                     [KeyboardButton(get_text("btn_search", lang)), KeyboardButton(get_text("btn_vip", lang))],
@@ -101,19 +114,26 @@ async def run_bot():
                 """Safely edit a callback message; fallback to sending a new message.
 
                 This prevents UI/callback crashes (BadRequest) from killing the handler.
+                Both calls go ahead of bulk downloads in the rate limiter (Priority.UI).
                 """
+                chat_id = query.message.chat_id if query.message else query.from_user.id
                 try:
-                    await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+                    await telegram_limiter.send(
+                        lambda: query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode),
+                        chat_id=chat_id,
+                    )
                     return True
                 except BadRequest as e:
                     logger.warning(f"UI edit failed (BadRequest): {e}")
                     try:
-                        chat_id = query.message.chat_id if query.message else query.from_user.id
-                        await self.app.bot.send_message(
+                        await telegram_limiter.send(
+                            lambda: self.app.bot.send_message(
+                                chat_id=chat_id,
+                                text=text,
+                                reply_markup=reply_markup,
+                                parse_mode=parse_mode,
+                            ),
                             chat_id=chat_id,
-                            text=text,
-                            reply_markup=reply_markup,
-                            parse_mode=parse_mode,
                         )
                         return False
                     except Exception as e2:
@@ -124,27 +144,216 @@ async def run_bot():
             async def safe_edit(self, query, text, reply_markup=None, parse_mode=None):
                 return await self.safe_edit_or_send(query, text, reply_markup=reply_markup, parse_mode=parse_mode)
 
+            async def edit_job_message(self, job, text, reply_markup=None, parse_mode=None):
+                """Update a download job's status message (the one the user pressed); fallback to a new message.
+
+                Jobs run outside the callback (and across restarts), so there is no query to edit.
+                """
+                chat_id = job.get("chat_id") or job["user_id"]
+                if job.get("message_id"):
+                    try:
+                        await telegram_limiter.send(
+                            lambda: self.app.bot.edit_message_text(
+                                chat_id=chat_id,
+                                message_id=job["message_id"],
+                                text=text,
+                                reply_markup=reply_markup,
+                                parse_mode=parse_mode,
+                            ),
+                            chat_id=chat_id,
+                        )
+                        return True
+                    except BadRequest as e:
+                        logger.warning(f"Job message edit failed (BadRequest): {e}")
+                try:
+                    await telegram_limiter.send(
+                        lambda: self.app.bot.send_message(
+                            chat_id=chat_id,
+                            text=text,
+                            reply_markup=reply_markup,
+                            parse_mode=parse_mode,
+                        ),
+                        chat_id=chat_id,
+                    )
+                except Exception as e:
+                    logger.error(f"Job message send failed: {e}")
+                return False
+
+            async def on_download_stopped(self, job, sent: int):
+                await self.edit_job_message(
+                    job,
+                    f"⛔ Download interrompido.\n\nEnviados nesta página: {sent}",
+                    parse_mode=ParseMode.MARKDOWN,
+                )
+
+            async def run_download_job(self, job) -> Optional[int]:
+                """Send one page of a creator (runner for download_jobs).
+
+                Returns the next page offset, or None when the creator has no more pages.
+                Items listed in job["sent_keys"] were delivered before a restart and are skipped.
+                """
+                user_id = job["user_id"]
+                service = job["service"]
+                c_id = job["creator_id"]
+                name = job.get("name") or ""
+                offset = int(job.get("page_offset") or 0)
+                sent_keys = job.get("sent_keys") or set()
+
+                if job.get("resumed"):
+                    await self.edit_job_message(
+                        job,
+                        f"♻️ Retomando download: **{self._esc_md(name)}**",
+                        parse_mode=ParseMode.MARKDOWN,
+                    )
+
+                # Limit media per page to avoid flooding, but compute next_offset from POSTS count.
+                PAGE_MEDIA_LIMIT = int(os.getenv("PAGE_MEDIA_LIMIT", "120"))
+
+                def item_key(item):
+                    return item.source_key or item.url
+
+                async with MediaFetcher() as fetcher:
+                    creator = {"service": service, "id": c_id, "name": name}
+                    page = await fetcher.fetch_posts_page(creator, offset=offset)
+                    posts = page.get("posts", [])
+                    items_all = page.get("media_items", [])
+
+                    posts_count = len(posts) if isinstance(posts, list) else 0
+                    if posts_count == 0 or not items_all:
+                        await self.edit_job_message(
+                            job,
+                            f"✅ Download completo: **{self._esc_md(name)}**\n\nNão há mais páginas.",
+                            parse_mode=ParseMode.MARKDOWN,
+                        )
+                        prefetcher.cancel(user_id)
+                        return None
+
+                    items = [item for item in items_all[:PAGE_MEDIA_LIMIT] if item_key(item) not in sent_keys]
+                    next_offset = offset + max(1, posts_count)
+
+                    # The user almost always asks for the next page: warm it while this one is sent.
+                    prefetcher.schedule(user_id, creator, next_offset)
+
+                    # Per-page transfer stats
+                    sent = len(items_all[:PAGE_MEDIA_LIMIT]) - len(items)  # delivered before a restart
+                    skipped_empty = 0
+                    skipped_large = 0
+                    errors = 0
+
+                    async def download_item(item):
+                        # Files Telegram already has (file_id cache) are resent without downloading.
+                        return (
+                            await prefetcher.take(user_id, item, offset)
+                            or await self.uploader.cached_file_id(item) is not None
+                            or await fetcher.download_media(item)
+                        )
+
+                    async def checkpoint(delivered):
+                        # After a restart the job resumes after these items; dlstop reports this count.
+                        nonlocal sent
+                        await async_user_db.mark_download_job_items_sent(job["id"], [item_key(item) for item in delivered])
+                        sent += len(delivered)
+
+                    async def settle(coro):
+                        # dlstop cancels the job between items; a Telegram send already in flight is
+                        # allowed to land (and be counted) so the reported total stays exact.
+                        task = asyncio.ensure_future(coro)
+                        try:
+                            return await asyncio.shield(task)
+                        except asyncio.CancelledError:
+                            await asyncio.wait([task])
+                            raise
+
+                    async def send_album(group, caption):
+                        results = await self.uploader.upload_group_and_cleanup(group, user_id, caption=caption)
+                        await checkpoint([item for item, msg_id in zip(group, results) if msg_id is not None])
+                        return results
+
+                    async def send_single(item, caption):
+                        ok = await self.uploader.upload_and_cleanup(item, user_id, caption=caption)
+                        if ok:
+                            await checkpoint([item])
+                        return ok
+
+                    async def upload_album(group):
+                        # Downloads keep running while this sends; albums of up to 10 stay in page order.
+                        nonlocal skipped_empty, skipped_large, errors
+                        caption = f"✅ {name} - VIP"
+                        try:
+                            before = (self.uploader.stats.skipped_empty, self.uploader.stats.skipped_large, self.uploader.stats.errors)
+                            results = await settle(send_album(group, caption))
+                            delivered = sum(1 for msg_id in results if msg_id is not None)
+                            for item, msg_id in zip(group, results):
+                                if msg_id is None and await self.uploader.cached_file_id(item) is None and not item.local_path:
+                                    # Was sent by a cached file_id that Telegram rejected: upload the real file once.
+                                    if await fetcher.download_media(item) and await settle(send_single(item, caption)):
+                                        delivered += 1
+                            after = (self.uploader.stats.skipped_empty, self.uploader.stats.skipped_large, self.uploader.stats.errors)
+                            skipped_empty += max(0, after[0] - before[0])
+                            skipped_large += max(0, after[1] - before[1])
+                            errors += max(0, after[2] - before[2])
+                            return delivered
+                        except Exception as e:
+                            errors += 1
+                            logger.warning(f"Upload loop error: {e}")
+                            return 0
+
+                    result = await run_ordered_pipeline(items, download_item, upload_album, batch_size=10)
+
+                    logger.info(
+                        "Page done job=%s user=%s creator=%s posts=%s media=%s sent=%s skipped_empty=%s skipped_large=%s errors=%s download_failed=%s wall=%.1fs",
+                        job["id"],
+                        user_id,
+                        c_id,
+                        posts_count,
+                        len(items_all),
+                        sent,
+                        skipped_empty,
+                        skipped_large,
+                        errors,
+                        result.download_failed,
+                        result.wall_seconds,
+                    )
+
+                    kb = [
+                        [InlineKeyboardButton("▶️ Baixar próxima página", callback_data=f"dlnext:{service}:{c_id}:{next_offset}")],
+                        [InlineKeyboardButton("⛔ Parar", callback_data=f"dlstop:{service}:{c_id}")],
+                    ]
+
+                    await self.edit_job_message(
+                        job,
+                        f"✅ Página concluída: **{self._esc_md(name)}**\n\nEnviados: {sent}\nPulados (vazio): {skipped_empty}\nPulados (grande): {skipped_large}\nErros: {errors}\nTempo: {result.wall_seconds:.0f}s\n\nQuer continuar?",
+                        reply_markup=InlineKeyboardMarkup(kb),
+                        parse_mode=ParseMode.MARKDOWN,
+                    )
+                    return next_offset
+
+
 
 
 
             async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
                 user = update.effective_user
-                u_data = user_db.get_user(user.id)
+                u_data = await async_user_db.get_user(user.id)
+                user_db.touch_user(user.id)  # in memory; last_seen is flushed in batches
                 msg = update.effective_message
                 
                 # Handle Referral
                 if context.args and context.args[0].startswith('ref'):
                     try:
                         referrer_id = int(context.args[0].replace('ref', ''))
-                        if referrer_id != user.id:
-                            user_db.process_referral(user.id, referrer_id)
+                        # Notify the referrer only when the reward was actually granted.
+                        if referrer_id != user.id and await async_user_db.process_referral(user.id, referrer_id):
                             try:
-                                ref_data = user_db.get_user(referrer_id)
+                                ref_data = await async_user_db.get_user(referrer_id)
                                 ref_lang = ref_data.get('language', 'pt')
-                                await self.app.bot.send_message(
+                                await telegram_limiter.send(
+                                    lambda: self.app.bot.send_message(
+                                        chat_id=referrer_id,
+                                        text=get_text("referral_reward_msg", ref_lang),
+                                        parse_mode=ParseMode.MARKDOWN
+                                    ),
                                     chat_id=referrer_id,
-                                    text=get_text("referral_reward_msg", ref_lang),
-                                    parse_mode=ParseMode.MARKDOWN
                                 )
                             except: pass
                     except: pass
@@ -191,7 +400,8 @@ async def run_bot():
                                             await self.uploader.upload_and_cleanup(
                                                 pick, user.id, 
                                                 caption=f"{welcome_title}\n\n{welcome_copy}",
-                                                reply_markup=self.get_main_keyboard(user.id, lang)
+                                                reply_markup=await self.get_main_keyboard(user.id, lang),
+                                                priority=Priority.UI,
                                             )
                                             return
                     except Exception as e:
@@ -201,13 +411,13 @@ async def run_bot():
                     try:
                         await status_msg.edit_text(
                             f"{welcome_title}\n\n{welcome_copy}",
-                            reply_markup=self.get_main_keyboard(user.id, lang),
+                            reply_markup=await self.get_main_keyboard(user.id, lang),
                             parse_mode=ParseMode.MARKDOWN
                         )
                     except:
                         await msg.reply_text(
                             f"{welcome_title}\n\n{welcome_copy}",
-                            reply_markup=self.get_main_keyboard(user.id, lang),
+                            reply_markup=await self.get_main_keyboard(user.id, lang),
                             parse_mode=ParseMode.MARKDOWN
                         )
 
@@ -215,8 +425,9 @@ async def run_bot():
                 user_id = update.effective_user.id
                 text = update.message.text
                 if not text: return
+                user_db.touch_user(user_id)
                 
-                u_data = user_db.get_user(user_id)
+                u_data = await async_user_db.get_user(user_id)
                 lang = u_data.get('language', 'pt')
 
                 # A2 manual Asaas confirmation flow: user pastes payment id.
@@ -245,12 +456,12 @@ async def run_bot():
                     expected_amount = float(context.user_data.get("asaas_expected_amount") or 0.0)
 
                     try:
-                        existing = user_db.get_payment_by_external_id("asaas", payment_id)
+                        existing = await async_user_db.get_payment_by_external_id("asaas", payment_id)
                         if existing and int(existing.get("user_id")) != user_id:
                             await update.message.reply_text(get_text("payment_already_used", lang))
                             return
 
-                        if user_db.is_payment_already_paid("asaas", payment_id):
+                        if await async_user_db.is_payment_already_paid("asaas", payment_id):
                             await update.message.reply_text(get_text("payment_confirmed", lang))
                             # Clear state
                             context.user_data.pop("state", None)
@@ -258,8 +469,8 @@ async def run_bot():
                             context.user_data.pop("asaas_expected_amount", None)
                             return
 
-                        client = AsaasClient()
-                        details = client.get_payment_details(payment_id)
+                        client = payment_providers.asaas()
+                        details = await client.get_payment_details(payment_id)
                         status = str(details.get("status") or "").upper()
                         value = float(details.get("value") or 0.0)
                         billing_type = str(details.get("billingType") or "").upper()
@@ -278,17 +489,20 @@ async def run_bot():
                             return
 
                         raw_payload = json.dumps(details)[:4000]
-                        user_db.create_pending_payment(
-                            user_id=user_id,
-                            provider="asaas",
-                            external_id=payment_id,
-                            amount=value or expected_amount,
-                            currency="BRL",
-                            plan_type=expected_plan,
-                            raw_payload=raw_payload,
-                        )
-                        user_db.mark_payment_paid("asaas", payment_id, raw_payload=raw_payload)
-                        user_db.activate_license(user_id, expected_plan)
+                        if not existing:
+                            # Never over an existing row: INSERT OR REPLACE would turn a paid one back to pending.
+                            await async_user_db.create_pending_payment(
+                                user_id=user_id,
+                                provider="asaas",
+                                external_id=payment_id,
+                                amount=value or expected_amount,
+                                currency="BRL",
+                                plan_type=expected_plan,
+                                raw_payload=raw_payload,
+                            )
+                        # Same path as webhooks and the reconciler: whoever flips pending -> paid activates,
+                        # in one transaction. None means one of them already did (and notified).
+                        await async_user_db.settle_pending_payment("asaas", payment_id, raw_payload=raw_payload)
 
                         # Clear state
                         context.user_data.pop("state", None)
@@ -320,7 +534,7 @@ async def run_bot():
                     )
                 
                 elif text == get_text("btn_stats", lang):
-                    is_vip = "✅ VIP" if user_db.is_license_active(user_id) else "❌ FREE"
+                    is_vip = "✅ VIP" if await async_user_db.is_license_active(user_id) else "❌ FREE"
                     stats = f"👤 **{update.effective_user.first_name}**\n\n"
                     stats += f"Status: {is_vip}\n"
                     stats += f"Créditos: {u_data.get('credits', 0)}\n"
@@ -337,11 +551,11 @@ async def run_bot():
                 elif text.startswith("⚡ MODO GOD") and user_id == config.ADMIN_ID:
                     current_status = int(u_data.get('is_god_mode', 0))
                     new_status = 0 if current_status == 1 else 1
-                    user_db.update_user(user_id, is_god_mode=new_status)
+                    await async_user_db.update_user(user_id, is_god_mode=new_status)
                     mode_text = get_text("god_mode_off" if new_status == 0 else "god_mode_on", lang)
                     await update.message.reply_text(
                         get_text("god_mode_msg", lang, mode=mode_text),
-                        reply_markup=self.get_main_keyboard(user_id, lang),
+                        reply_markup=await self.get_main_keyboard(user_id, lang),
                         parse_mode=ParseMode.MARKDOWN
                     )
                 
@@ -349,21 +563,21 @@ async def run_bot():
                     model_name = text
                     status_msg = await update.message.reply_text(get_text("searching", lang, name=model_name))
                     try:
-                        async with MediaFetcher() as fetcher:
-                            creators = await fetcher._get_creators_list()
-                            matches = smart_search.find_similar(model_name, creators)
-                            if not matches:
-                                await status_msg.edit_text(get_text("no_media_found", lang, name=model_name))
-                                return
-                            # Keep callback_data short and safe: do not include creator name (may contain special chars).
-                            keyboard = [[InlineKeyboardButton(m['name'], callback_data=f"sel:{m['service']}:{m['id']}")] for m in matches[:8]]
-                            await status_msg.edit_text(get_text("select_model", lang), reply_markup=InlineKeyboardMarkup(keyboard))
-                            context.user_data['state'] = None
+                        # Served from the shared catalog snapshot; fuzzy scoring runs off the event loop.
+                        snapshot = await creator_catalog.get_snapshot()
+                        matches = await smart_search.find_similar_async(model_name, snapshot)
+                        if not matches:
+                            await status_msg.edit_text(get_text("no_media_found", lang, name=model_name))
+                            return
+                        # Keep callback_data short and safe: do not include creator name (may contain special chars).
+                        keyboard = [[InlineKeyboardButton(m['name'], callback_data=f"sel:{m['service']}:{m['id']}")] for m in matches[:8]]
+                        await status_msg.edit_text(get_text("select_model", lang), reply_markup=InlineKeyboardMarkup(keyboard))
+                        context.user_data['state'] = None
                     except:
                         await status_msg.edit_text(get_text("error_occurred", lang, error="Timeout"))
 
             async def show_payment_popup(self, update: Update, user_id: int, lang: str, is_downsell: bool = False):
-                pricing = user_db.get_pricing(lang)
+                pricing = await async_user_db.get_pricing(lang)
                 title = get_text("downsell_title" if is_downsell else "vip_offer_title", lang)
                 copy = get_text("downsell_copy" if is_downsell else "vip_offer_copy", lang)
                 
@@ -383,13 +597,14 @@ async def run_bot():
                 query = update.callback_query
                 await query.answer()
                 user_id = update.effective_user.id
+                user_db.touch_user(user_id)
                 data = query.data
-                u_data = user_db.get_user(user_id)
+                u_data = await async_user_db.get_user(user_id)
                 lang = u_data.get('language', 'pt')
 
                 if data.startswith("setlang:"):
                     new_lang = data.split(":")[1]
-                    user_db.update_user(user_id, language=new_lang)
+                    await async_user_db.update_user(user_id, language=new_lang)
                     try:
                         await query.message.delete()
                     except: pass
@@ -405,13 +620,11 @@ async def run_bot():
 
                     async with MediaFetcher() as fetcher:
                         if not name:
-                            # Resolve creator name from the creators list (avoids callback_data length issues)
+                            # Resolve creator name from the catalog index (avoids callback_data length issues)
                             try:
-                                creators = await fetcher._get_creators_list()
-                                for c in creators:
-                                    if str(c.get("id")) == str(c_id) and str(c.get("service")) == str(service):
-                                        name = c.get("name") or name
-                                        break
+                                found = await creator_catalog.get_creator(service, c_id)
+                                if found:
+                                    name = found.get("name") or name
                             except Exception:
                                 pass
                         if not hasattr(self, "_creator_sessions"):
@@ -431,13 +644,12 @@ async def run_bot():
                             await self.safe_edit_or_send(query, get_text("nothing_found", lang))
                             return
 
-                        has_access = user_db.is_license_active(user_id)
+                        has_access = await async_user_db.is_license_active(user_id)
                         used_credit = False
 
                         if not has_access and int(u_data.get('credits', 0)) > 0:
-                            user_db.use_credit(user_id)
-                            has_access = True
-                            used_credit = True
+                            # u_data may be stale: only a credit actually taken grants access.
+                            has_access = used_credit = await async_user_db.use_credit(user_id)
 
                         if has_access:
                             if used_credit:
@@ -455,16 +667,14 @@ async def run_bot():
                                 parse_mode=ParseMode.MARKDOWN,
                             )
                         else:
-                            if not user_db.check_preview_limit(user_id):
+                            # Check and count in one UPDATE: concurrent taps cannot pass the daily limit.
+                            if not await async_user_db.use_preview(user_id):
                                 await self.show_payment_popup(update, user_id, lang)
                                 return
-                            user_db.increment_previews(user_id)
                             await self.safe_edit_or_send(query, get_text("sending_previews", lang, name=name))
                             for item in items[:3]:
-                                if await fetcher.download_media(item):
-                                    ok = await self.uploader.upload_and_cleanup(item, user_id, caption=f"🔥 Preview: {name}")
-                                    if ok:
-                                        await asyncio.sleep(1.2)
+                                if await self.uploader.cached_file_id(item) is not None or await fetcher.download_media(item):
+                                    await self.uploader.upload_and_cleanup(item, user_id, caption=f"🔥 Preview: {name}", priority=Priority.BULK)
                             await self.show_payment_popup(update, user_id, lang)
 
                 elif data.startswith("dlall:") or data.startswith("dlpage:") or data.startswith("dlnext:") or data.startswith("dlstop"):
@@ -497,6 +707,15 @@ async def run_bot():
                         elif action in ("dlall", "dlstop") and len(parts) >= 4:
                             name = parts[3]
 
+                    # No session (e.g. after a restart): resolve from the catalog index
+                    if not name and not action.startswith("dlstop"):
+                        try:
+                            found = await creator_catalog.get_creator(service, c_id)
+                            if found:
+                                name = found.get("name") or ""
+                        except Exception:
+                            pass
+
                     # Parse offset
                     offset = 0
                     if action in ("dlpage", "dlnext"):
@@ -506,116 +725,44 @@ async def run_bot():
                             offset = 0
 
                     if action.startswith("dlstop"):
-                        try:
-                            if hasattr(self, "_dl_sessions"):
-                                self._dl_sessions.pop(user_id, None)
-                        except Exception:
-                            pass
-                        await query.answer("✅ Parado.", show_alert=False)
-                        await self.safe_edit_or_send(query, "⛔ Download interrompido.", parse_mode=ParseMode.MARKDOWN)
+                        # The query was answered above (a second answer is rejected). cancel_user returns
+                        # at once; on_download_stopped edits the message with the final count once the
+                        # running page has stopped (after the send in flight).
+                        stopped = await download_jobs.cancel_user(user_id)
+                        prefetcher.cancel(user_id)
+                        if not stopped:
+                            await self.safe_edit_or_send(query, "⛔ Download interrompido.", parse_mode=ParseMode.MARKDOWN)
                         return
 
-                    # Session continuation: for dlnext prefer stored offset (prevents wrong offsets)
-                    if action == "dlnext" and hasattr(self, "_dl_sessions") and user_id in self._dl_sessions:
-                        try:
-                            offset = int(self._dl_sessions[user_id].get("offset", offset))
-                        except Exception:
-                            pass
+                    # Session continuation: for dlnext prefer the offset stored with the last job
+                    # (prevents wrong offsets, and survives restarts).
+                    if action == "dlnext":
+                        last = await async_user_db.get_last_download_job(user_id)
+                        if (last and last.get("next_offset") is not None
+                                and str(last.get("service")) == str(service) and str(last.get("creator_id")) == str(c_id)):
+                            offset = int(last["next_offset"])
 
-                    if not hasattr(self, "_dl_sessions"):
-                        self._dl_sessions = {}
                     if action == "dlall":
                         offset = 0
 
-                    self._dl_sessions[user_id] = {"service": service, "c_id": c_id, "name": name, "offset": offset}
-
                     await self.safe_edit_or_send(
                         query,
                         get_text("downloading", lang, name=self._esc_md(name)),
+                        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⛔ Parar", callback_data=f"dlstop:{service}:{c_id}")]]),
                         parse_mode=ParseMode.MARKDOWN,
                     )
 
-                    # Limit media per page to avoid flooding, but compute next_offset from POSTS count.
-                    PAGE_MEDIA_LIMIT = int(os.getenv("PAGE_MEDIA_LIMIT", "120"))
-
-                    async with MediaFetcher() as fetcher:
-                        creator = {"service": service, "id": c_id, "name": name}
-                        page = await fetcher.fetch_posts_page(creator, offset=offset)
-                        posts = page.get("posts", [])
-                        items_all = page.get("media_items", [])
-
-                        posts_count = len(posts) if isinstance(posts, list) else 0
-                        if posts_count == 0 or not items_all:
-                            await self.safe_edit_or_send(
-                                query,
-                                f"✅ Download completo: **{self._esc_md(name)}**\n\nNão há mais páginas.",
-                                parse_mode=ParseMode.MARKDOWN,
-                            )
-                            try:
-                                self._dl_sessions.pop(user_id, None)
-                            except Exception:
-                                pass
-                            return
-
-                        items = items_all[:PAGE_MEDIA_LIMIT]
-
-                        # Per-page transfer stats
-                        sent_any = False
-                        sent = 0
-                        skipped_empty = 0
-                        skipped_large = 0
-                        errors = 0
-
-                        for i in range(0, len(items), 10):
-                            batch = items[i:i+10]
-                            for item in batch:
-                                try:
-                                    if await fetcher.download_media(item):
-                                        before = (self.uploader.stats.sent, self.uploader.stats.skipped_empty, self.uploader.stats.skipped_large, self.uploader.stats.errors)
-                                        ok = await self.uploader.upload_and_cleanup(item, user_id, caption=f"✅ {name} - VIP")
-                                        after = (self.uploader.stats.sent, self.uploader.stats.skipped_empty, self.uploader.stats.skipped_large, self.uploader.stats.errors)
-                                        sent += max(0, after[0] - before[0])
-                                        skipped_empty += max(0, after[1] - before[1])
-                                        skipped_large += max(0, after[2] - before[2])
-                                        errors += max(0, after[3] - before[3])
-                                        if ok:
-                                            sent_any = True
-                                            await asyncio.sleep(0.6)
-                                    else:
-                                        # download failed; skip quickly
-                                        continue
-                                except Exception as e:
-                                    errors += 1
-                                    logger.warning(f"Upload loop error: {e}")
-                            if sent_any:
-                                await asyncio.sleep(1.0)
-
-                        next_offset = offset + max(1, posts_count)
-                        self._dl_sessions[user_id]["offset"] = next_offset
-
-                        logger.info(
-                            "Page done user=%s creator=%s posts=%s media=%s sent=%s skipped_empty=%s skipped_large=%s errors=%s",
-                            user_id,
-                            c_id,
-                            posts_count,
-                            len(items_all),
-                            sent,
-                            skipped_empty,
-                            skipped_large,
-                            errors,
-                        )
-
-                        kb = [
-                            [InlineKeyboardButton("▶️ Baixar próxima página", callback_data=f"dlnext:{service}:{c_id}:{next_offset}")],
-                            [InlineKeyboardButton("⛔ Parar", callback_data=f"dlstop:{service}:{c_id}")],
-                        ]
-
-                        await self.safe_edit_or_send(
-                            query,
-                            f"✅ Página concluída: **{self._esc_md(name)}**\n\nEnviados: {sent}\nPulados (vazio): {skipped_empty}\nPulados (grande): {skipped_large}\nErros: {errors}\n\nQuer continuar?",
-                            reply_markup=InlineKeyboardMarkup(kb),
-                            parse_mode=ParseMode.MARKDOWN,
-                        )
+                    # The page runs as a persistent job on the worker pool: the handler returns now,
+                    # and a redeploy resumes it instead of losing it.
+                    await download_jobs.submit(
+                        user_id,
+                        service,
+                        c_id,
+                        name,
+                        offset,
+                        chat_id=query.message.chat_id if query.message else user_id,
+                        message_id=query.message.message_id if query.message else None,
+                    )
 
                 elif data.startswith("asaas_confirm:"):
                     # A2 flow: prompt the user to paste the Asaas payment id after paying via link.
@@ -625,7 +772,7 @@ async def run_bot():
                         await query.answer()
                         return
 
-                    pricing = user_db.get_pricing(lang).get(plan, {})
+                    pricing = (await async_user_db.get_pricing(lang)).get(plan, {})
                     expected_amount = float(pricing.get("price") or 0.0)
 
                     context.user_data["state"] = "awaiting_asaas_payment_id"
@@ -642,37 +789,18 @@ async def run_bot():
 
 
                 elif data.startswith("checkpay:"):
-                    # Manual status check (useful when PUBLIC_URL/webhook is not configured)
+                    # Manual status check (useful when PUBLIC_URL/webhook is not configured).
+                    # The reconciler notifies the user as soon as the gateway reports it paid.
                     _, provider, external_id = data.split(":", 2)
                     try:
-                        if user_db.is_payment_already_paid(provider, external_id):
+                        if await async_user_db.is_payment_already_paid(provider, external_id):
                             await self.safe_edit(query, get_text("payment_confirmed", lang))
                             return
 
-                        paid = False
-                        raw = None
-                        if provider == "asaas":
-                            client = AsaasClient()
-                            status = client.get_payment_status(external_id).upper()
-                            raw = {"status": status}
-                            paid = status in ("RECEIVED", "CONFIRMED", "RECEIVED_IN_CASH")
-                        elif provider == "nowpayments":
-                            client = NowPaymentsClient()
-                            raw = client.get_payment(external_id)
-                            status = str(raw.get("payment_status") or raw.get("paymentstatus") or "").lower()
-                            paid = NowPaymentsClient.is_paid_status(status)
-                        else:
-                            await query.answer()
-                            return
-
-                        if paid:
-                            rec = user_db.get_payment_by_external_id(provider, external_id)
-                            if rec:
-                                user_db.mark_payment_paid(provider, external_id, raw_payload=str(raw))
-                                user_db.activate_license(int(rec["user_id"]), rec["plan_type"])
-                            await self.safe_edit(query, get_text("payment_confirmed", lang))
-                        else:
-                            await self.safe_edit(query, get_text("payment_pending", lang))
+                        # The gateway is polled by the payment reconciler; this only reads the DB
+                        # and moves the payment to the front of the next (immediate) pass.
+                        payment_reconciler.nudge(provider, external_id)
+                        await self.safe_edit(query, get_text("payment_pending", lang))
 
                     except Exception:
                         logger.exception("Payment status check failed")
@@ -753,14 +881,14 @@ async def run_bot():
                             parse_mode=ParseMode.MARKDOWN,
                         )
                         return
-                    pricing = user_db.get_pricing(lang)[plan]
+                    pricing = (await async_user_db.get_pricing(lang))[plan]
                     price = pricing['price'] * 0.7 if "_ds" in plan_raw else pricing['price']
                     currency = pricing['currency']
                     base_url = os.getenv("PUBLIC_URL") or os.getenv("RAILWAY_PUBLIC_URL") or ""
 
                     try:
                         # Explicit payment method creation.
-                        payment = create_payment_explicit(
+                        payment = await create_payment_explicit(
                             provider=provider,
                             user_id=user_id,
                             plan=plan,
@@ -769,7 +897,7 @@ async def run_bot():
                             currency=currency,
                             base_url=base_url,
                         )
-                        user_db.create_pending_payment(
+                        await async_user_db.create_pending_payment(
                             user_id=user_id,
                             provider=payment.provider,
                             external_id=payment.external_id,
@@ -866,12 +994,95 @@ async def run_bot():
             async def healthz(_request):
                 return web.json_response({"ok": True})
 
+            async def metrics(_request):
+                # Lightweight production counters (no secrets, no user data).
+                return web.json_response({
+                    "http_pool": {**asdict(http_pool.stats), "reuse_ratio": round(http_pool.stats.reuse_ratio, 3)},
+                    "catalog": asdict(creator_catalog.stats),
+                    "posts_cache": {**asdict(posts_page_cache.stats), "entries": len(posts_page_cache)},
+                    "prefetch": asdict(prefetcher.stats),
+                    "download_jobs": asdict(download_jobs.stats),
+                    "user_cache": asdict(user_db.user_cache_stats),
+                    "user_activity": asdict(user_db.activity_stats),
+                    "payment_reconciler": asdict(payment_reconciler.stats),
+                    "payment_providers": payment_providers.snapshot(),
+                    "telegram_webhook": asdict(telegram_webhook.stats),
+                    "webhook_inbox": {**asdict(webhook_inbox.stats), "duplicate_rate": round(webhook_inbox.stats.duplicate_rate, 3)},
+                    "telegram_limiter": {**asdict(telegram_limiter.stats), "avg_wait_seconds": round(telegram_limiter.stats.avg_wait_seconds, 3)},
+                    "uploader": asdict(uploader.stats),
+                })
+
             async def stripe_success(_request):
                 return web.Response(text="OK. You can return to Telegram.")
 
             async def stripe_cancel(_request):
                 return web.Response(text="Payment canceled. You can return to Telegram.")
 
+            async def settle_paid(provider, external_id, raw, default_lang="pt"):
+                # Only the caller that flips pending -> paid notifies (the reconciler and the
+                # "check payment" button race with webhooks). The flip and the activation are one
+                # transaction: if it fails, the payment stays pending and the inbox retry settles it.
+                rec = await async_user_db.settle_pending_payment(provider, external_id, raw_payload=str(raw))
+                if not rec:
+                    return
+                user_id_ = rec["user_id"]
+                try:
+                    lang_ = (await async_user_db.get_user(user_id_)).get("language", default_lang)
+                    await telegram_limiter.send(
+                        lambda: tg_bot.send_message(chat_id=user_id_, text=get_text("payment_confirmed", lang_)),
+                        chat_id=user_id_,
+                    )
+                except Exception as e:
+                    # The license is active; retrying the event would not notify again anyway.
+                    logger.warning(f"Payment notification failed for user {user_id_}: {e}")
+
+            async def apply_stripe(event):
+                if event.get("type") != "checkout.session.completed":
+                    return
+                session = event["data"]["object"]
+                external_id = str(session.get("id") or "")
+                if not external_id:
+                    return
+                # Try DB mapping first (preferred), then metadata fallback.
+                if not await async_user_db.get_payment_by_external_id("stripe", external_id):
+                    metadata = session.get("metadata") or {}
+                    user_id_ = int(metadata.get("user_id", "0"))
+                    if not user_id_:
+                        return
+                    await async_user_db.create_pending_payment(
+                        user_id=user_id_,
+                        provider="stripe",
+                        external_id=external_id,
+                        amount=float(session.get("amount_total", 0)) / 100.0,
+                        currency=(session.get("currency") or "usd").upper(),
+                        plan_type=metadata.get("plan", "monthly"),
+                        raw_payload=str(session),
+                    )
+                await settle_paid("stripe", external_id, session)
+
+            async def apply_asaas(data):
+                payment_obj = data.get("payment") or {}
+                external_id = str(payment_obj.get("id") or data.get("paymentId") or "")
+                if external_id:
+                    await settle_paid("asaas", external_id, data)
+
+            async def apply_nowpayments(data):
+                await settle_paid("nowpayments", str(data.get("payment_id") or ""), data, default_lang="en")
+
+            webhook_inbox.register("stripe", apply_stripe)
+            webhook_inbox.register("asaas", apply_asaas)
+            webhook_inbox.register("nowpayments", apply_nowpayments)
+
+            # Webhooks only verify and store the event (webhook_events inbox), then answer;
+            # webhook_inbox applies it in the background. A redelivery is acknowledged as-is.
+            async def enqueue(provider, event_id, payload):
+                try:
+                    new = await webhook_inbox.receive(provider, event_id, payload)
+                except Exception as e:
+                    logger.exception(f"{provider} webhook could not be stored: {e}")
+                    return web.Response(status=500, text="Storage error")  # the gateway retries
+                return web.Response(text="OK" if new else "Already received")
+
             async def stripe_webhook(request):
                 payload = await request.read()
                 sig_header = request.headers.get("Stripe-Signature", "")
@@ -887,50 +1098,14 @@ async def run_bot():
                     logger.warning(f"Stripe webhook signature/parse error: {e}")
                     return web.Response(status=400, text="Invalid payload")
 
-                if event.get("type") == "checkout.session.completed":
-                    session = event["data"]["object"]
-                    external_id = session.get("id")
-                    metadata = session.get("metadata") or {}
-                    # Try DB mapping first (preferred), then metadata fallback.
-                    rec = user_db.get_payment_by_external_id("stripe", str(external_id)) if external_id else None
-                    if rec and rec.get("status") == "paid":
-                        return web.Response(text="Already processed")
-                    try:
-                        if rec:
-                            user_id_ = int(rec["user_id"])
-                            plan_type = rec["plan_type"]
-                            user_db.mark_payment_paid("stripe", str(external_id), raw_payload=str(session))
-                            user_db.activate_license(user_id_, plan_type)
-                            lang_ = user_db.get_user(user_id_).get("language", "pt")
-                            await tg_bot.send_message(chat_id=user_id_, text=get_text("payment_confirmed", lang_))
-                        else:
-                            # fallback: metadata
-                            user_id_ = int(metadata.get("user_id", "0"))
-                            plan_type = metadata.get("plan", "monthly")
-                            if user_id_:
-                                user_db.create_pending_payment(
-                                    user_id=user_id_,
-                                    provider="stripe",
-                                    external_id=str(external_id),
-                                    amount=float(session.get("amount_total", 0)) / 100.0,
-                                    currency=(session.get("currency") or "usd").upper(),
-                                    plan_type=plan_type,
-                                    raw_payload=str(session),
-                                )
-                                user_db.mark_payment_paid("stripe", str(external_id), raw_payload=str(session))
-                                user_db.activate_license(user_id_, plan_type)
-                                lang_ = user_db.get_user(user_id_).get("language", "pt")
-                                await tg_bot.send_message(chat_id=user_id_, text=get_text("payment_confirmed", lang_))
-                    except Exception as e:
-                        logger.exception(f"Stripe webhook processing error: {e}")
-                        return web.Response(status=500, text="Processing error")
-
-                return web.Response(text="OK")
+                if event.get("type") != "checkout.session.completed":
+                    return web.Response(text="OK")
+                return await enqueue("stripe", str(event["id"]), payload.decode("utf-8"))
 
             async def asaas_webhook(request):
                 # Optional token check (recommended). Supports query token or header token.
                 try:
-                    client = AsaasClient()
+                    client = payment_providers.asaas()
                 except Exception as e:
                     logger.exception(f"Asaas client init failed: {e}")
                     return web.Response(status=500, text="Asaas not configured")
@@ -947,26 +1122,16 @@ async def run_bot():
                 payment_obj = data.get("payment") or {}
                 external_id = str(payment_obj.get("id") or data.get("paymentId") or "")
 
-                if event in ("PAYMENT_RECEIVED", "PAYMENT_CONFIRMED", "PAYMENT_RECEIVED_IN_CASH"):
-                    try:
-                        rec = user_db.get_payment_by_external_id("asaas", external_id)
-                        if rec:
-                            user_id_ = int(rec["user_id"])
-                            plan_type = rec["plan_type"]
-                            user_db.mark_payment_paid("asaas", external_id, raw_payload=str(data))
-                            user_db.activate_license(user_id_, plan_type)
-                            lang_ = user_db.get_user(user_id_).get("language", "pt")
-                            await tg_bot.send_message(chat_id=user_id_, text=get_text("payment_confirmed", lang_))
-                    except Exception as e:
-                        logger.exception(f"Asaas webhook processing error: {e}")
-                        return web.Response(status=500, text="Processing error")
-
-                return web.Response(text="OK")
+                if event not in ("PAYMENT_RECEIVED", "PAYMENT_CONFIRMED", "PAYMENT_RECEIVED_IN_CASH") or not external_id:
+                    return web.Response(text="OK")
+                # Asaas sends an event id ("evt_..."); older payloads only identify the payment.
+                event_id = str(data.get("id") or f"{event}:{external_id}")
+                return await enqueue("asaas", event_id, json.dumps(data))
 
             async def nowpayments_webhook(request):
                 # Validate IPN signature (HMAC SHA-512) using NOWPAYMENTS_IPN_SECRET
                 try:
-                    client = NowPaymentsClient()
+                    client = payment_providers.nowpayments()
                 except Exception as e:
                     logger.exception(f"NOWPayments client init failed: {e}")
                     return web.Response(status=500, text="NOWPayments not configured")
@@ -983,29 +1148,32 @@ async def run_bot():
                 payment_id = str(data.get("payment_id") or "")
                 status = str(data.get("payment_status") or "").lower()
 
-                if payment_id and NowPaymentsClient.is_paid_status(status):
-                    try:
-                        rec = user_db.get_payment_by_external_id("nowpayments", payment_id)
-                        if rec:
-                            user_id_ = int(rec["user_id"])
-                            plan_type = rec["plan_type"]
-                            user_db.mark_payment_paid("nowpayments", payment_id, raw_payload=str(data))
-                            user_db.activate_license(user_id_, plan_type)
-                            lang_ = user_db.get_user(user_id_).get("language", "en")
-                            await tg_bot.send_message(chat_id=user_id_, text=get_text("payment_confirmed", lang_))
-                    except Exception as e:
-                        logger.exception(f"NOWPayments webhook processing error: {e}")
-                        return web.Response(status=500, text="Processing error")
-
-                return web.Response(text="OK")
+                if not payment_id or not NowPaymentsClient.is_paid_status(status):
+                    return web.Response(text="OK")
+                # IPNs carry no event id: one event per payment status transition.
+                return await enqueue("nowpayments", f"{payment_id}:{status}", json.dumps(data))
+
+            @web.middleware
+            async def webhook_timing(request, handler):
+                # Response time of the gateway callbacks, reported as webhook_inbox.ack_p50/p99_ms.
+                if not request.path.startswith("/webhooks/"):
+                    return await handler(request)
+                started = time.perf_counter()
+                try:
+                    return await handler(request)
+                finally:
+                    webhook_inbox.record_ack((time.perf_counter() - started) * 1000)
 
             async def pushinpay_webhook(request):
                 # Legacy endpoint kept to avoid stray calls after migration.
                 return web.Response(status=410, text="PushinPay disabled (migrated)")
-            web_app = web.Application()
+            web_app = web.Application(middlewares=[webhook_timing])
+            if telegram_webhook.enabled:
+                web_app.add_routes([web.post(WEBHOOK_PATH, telegram_webhook.handle)])
             web_app.add_routes(
                 [
                     web.get("/healthz", healthz),
+                    web.get("/metrics", metrics),
                     web.post("/webhooks/stripe", stripe_webhook),
                     web.post("/webhooks/asaas", asaas_webhook),
                     web.post("/webhooks/nowpayments", nowpayments_webhook),
@@ -1036,9 +1204,18 @@ async def run_bot():
             logger.warning(f"Could not acquire bot lock ({e}). Continuing without lock.")
         # --------------------------------------------------------------
 
+        # Shared pooled HTTP session (upstream media API + catalog). Closed on shutdown.
+        await http_pool.start()
+
         # Initialize Application
-        app = Application.builder().token(config.BOT_TOKEN).build()
-        uploader = TelegramUploader(app.bot)
+        builder = Application.builder().token(config.BOT_TOKEN)
+        # Local Bot API server (or a fake one for app/telegram_bench.py).
+        api_base = (os.getenv("TELEGRAM_API_BASE_URL") or "").rstrip("/")
+        if api_base:
+            builder = builder.base_url(f"{api_base}/bot").base_file_url(f"{api_base}/file/bot")
+        app = builder.build()
+        uploader = TelegramUploader(app.bot, file_cache=async_user_db, limiter=telegram_limiter)
+        prefetcher.file_cache = async_user_db
         bot_logic = VIPBotUltra(app, uploader)
 
         # Register Handlers
@@ -1051,7 +1228,7 @@ async def run_bot():
         app.add_error_handler(_on_error)
 
         
-        logger.info("✅ Bot Handlers registered. Starting polling...")
+        logger.info("✅ Bot Handlers registered. Starting...")
         await app.initialize()
         await app.start()
 
@@ -1059,15 +1236,89 @@ async def run_bot():
         # Important: start it AFTER Application.initialize()/start() so the Bot's
         # internal HTTP session is ready when we need to send Telegram messages
         # from webhook callbacks.
+        webhook_runner = None
         try:
-            await start_webhook_server(app.bot)
+            webhook_runner = await start_webhook_server(app.bot)
         except Exception as e:
             logger.warning(f"Webhook server failed to start (payments will require manual check): {e}")
 
-        await app.updater.start_polling(drop_pending_updates=True)
+        # Warm the shared creators catalog in the background so the first search
+        # does not pay for the full download, and keep it fresh afterwards.
+        creator_catalog.start()
+
+        # Idle prefetch sweep (also clears prefetch files left by the previous process).
+        prefetcher.start()
+
+        # Settle pending payments in the background (webhooks may never arrive).
+        async def _notify_payment_paid(user_id_, _plan_type, _provider):
+            lang_ = (await async_user_db.get_user(user_id_)).get("language", "pt")
+            await telegram_limiter.send(
+                lambda: app.bot.send_message(chat_id=user_id_, text=get_text("payment_confirmed", lang_)),
+                chat_id=user_id_,
+            )
+
+        payment_reconciler.start(_notify_payment_paid)
+
+        # Apply stored webhook events (including those received before the last restart).
+        webhook_inbox.start()
+
+        # Batched last_seen writes (every ACTIVITY_FLUSH_SECONDS; the last batch at shutdown).
+        async_user_db.start()
+
+        # Download pages run on a worker pool, off the update handlers; jobs interrupted
+        # by the last restart are resumed here.
+        await download_jobs.start(bot_logic.run_download_job, on_stopped=bot_logic.on_download_stopped)
+
+        # Updates: Telegram webhook on the same server when enabled, polling otherwise.
+        use_webhook = False
+        if telegram_webhook.enabled:
+            if webhook_runner is None or not telegram_webhook.public_url:
+                logger.warning("TELEGRAM_WEBHOOK needs PUBLIC_URL and the web server; falling back to polling")
+            else:
+                telegram_webhook.attach(app)
+                try:
+                    await telegram_webhook.register(app.bot)
+                    use_webhook = True
+                except Exception as e:
+                    await telegram_webhook.stop()
+                    logger.warning(f"setWebhook failed ({e}); falling back to polling")
+        if not use_webhook:
+            # start_polling deletes a webhook left by a previous deploy.
+            await app.updater.start_polling(drop_pending_updates=True)
         
         stop_event = asyncio.Event()
-        await stop_event.wait()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        try:
+            await stop_event.wait()
+        finally:
+            logger.info("🛑 Shutting down...")
+            shutdown_steps = [
+                telegram_webhook.stop if use_webhook else app.updater.stop,
+                # Before the Bot session closes; interrupted jobs stay 'running' and resume on the next start.
+                download_jobs.stop,
+                payment_reconciler.stop,
+                webhook_inbox.stop,
+                app.stop,
+                app.shutdown,
+                prefetcher.stop,
+                creator_catalog.stop,
+                http_pool.close,
+                payment_providers.close,
+                async_user_db.close,
+            ]
+            if webhook_runner is not None:
+                shutdown_steps.insert(6, webhook_runner.cleanup)
+            for step in shutdown_steps:
+                try:
+                    await step()
+                except Exception as e:
+                    logger.warning(f"Shutdown step failed: {e}")
 
     except Exception as e:
         logger.critical(f"💥 CRITICAL CRASH: {e}", exc_info=True)
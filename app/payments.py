@@ -12,26 +12,78 @@ Public API
 
 The bot runs Telegram polling. To auto-activate VIP after payment, the bot also
 runs an embedded aiohttp web server (see app.main) for webhooks.
+
+Gateway calls never block the event loop: Asaas and NOWPayments use the shared
+aiohttp pool (app.http_pool) with a per-call deadline (PAYMENT_API_TIMEOUT_SECONDS),
+and the Stripe SDK (blocking) runs on a worker thread.
+
+Clients are built once by the `payment_providers` registry, which also keeps
+per-provider call/latency/health stats.
 """
 
 from __future__ import annotations
 
+import asyncio
 import base64
 import logging
 import os
 import json
 import hashlib
 import hmac
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import time
-from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
 
-import requests
+import aiohttp
+
+from app.http_pool import http_pool
 
 logger = logging.getLogger(__name__)
 
 
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+async def _request_json(provider: str, method: str, url: str, headers: Dict[str, str],
+                        payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """One gateway call on the shared pool, bounded by PAYMENT_API_TIMEOUT_SECONDS.
+
+    Raises RuntimeError on HTTP errors and on timeouts (same contract as before).
+    """
+    session = http_pool.session if http_pool.is_open else await http_pool.start()
+    timeout = aiohttp.ClientTimeout(total=max(1.0, _env_float("PAYMENT_API_TIMEOUT_SECONDS", 15.0)))
+    started = time.perf_counter()
+    try:
+        async with session.request(method, url, json=payload, headers=headers, timeout=timeout) as r:
+            text = await r.text()
+            if r.status >= 400:
+                raise RuntimeError(f"{provider} API error {r.status}: {text[:300]}")
+            result = json.loads(text) if text else {}
+    except asyncio.TimeoutError as e:
+        payment_providers.record(provider.lower(), started, "timeout")
+        raise RuntimeError(f"{provider} API timed out ({method} {url})") from e
+    except Exception as e:
+        payment_providers.record(provider.lower(), started, str(e)[:200] or type(e).__name__)
+        raise
+    payment_providers.record(provider.lower(), started)
+    return result
+
+
 @dataclass
 class PaymentCreateResult:
     provider: str
@@ -124,6 +176,12 @@ class StripeClient:
         )
 
 
+    def retrieve_checkout_session(self, session_id: str) -> Dict[str, Any]:
+        """Fetch a Checkout Session (blocking; used by the payment reconciler via a thread)."""
+        session = self._stripe.checkout.Session.retrieve(session_id)
+        return dict(session)
+
+
 def is_stripe_no_payment_methods_error(exc: Exception) -> bool:
     """Detect Stripe error for unavailable payment methods.
 
@@ -199,7 +257,39 @@ def nowpayments_available() -> bool:
     return bool(os.getenv("NOWPAYMENTS_API_KEY"))
 
 
-def create_payment_explicit(
+async def _create_stripe_checkout(**kwargs) -> PaymentCreateResult:
+    # The Stripe SDK is blocking (and slow to import the first time): keep it off the loop.
+    return await payment_providers.run_stripe(lambda client: client.create_checkout_session(**kwargs))
+
+
+async def _create_nowpayments_payment(*, user_id: int, plan: str, amount: float, currency: str,
+                                      base_url: str) -> PaymentCreateResult:
+    np = payment_providers.nowpayments()
+    payment = await np.create_payment(
+        user_id=user_id,
+        plan=plan,
+        amount=amount,
+        currency=currency,
+        base_url=base_url,
+        order_description=f"VIP {plan}",
+    )
+    # Enrich best-effort
+    try:
+        raw = await np.get_payment(payment.external_id)
+    except Exception:
+        raw = None
+    if isinstance(raw, dict):
+        payment.crypto_pay_address = raw.get("pay_address") or raw.get("payaddress")
+        try:
+            payment.crypto_pay_amount = float(raw.get("pay_amount") or raw.get("payamount") or 0) or None
+        except Exception:
+            payment.crypto_pay_amount = None
+        payment.crypto_pay_currency = raw.get("pay_currency") or raw.get("paycurrency")
+        payment.raw_provider_payload = raw
+    return payment
+
+
+async def create_payment_explicit(
     *,
     provider: str,
     user_id: int,
@@ -216,8 +306,7 @@ def create_payment_explicit(
     """
     provider = (provider or "").lower().strip()
     if provider == "stripe":
-        client = StripeClient()
-        return client.create_checkout_session(
+        return await _create_stripe_checkout(
             user_id=user_id,
             plan=plan,
             amount=amount,
@@ -244,29 +333,9 @@ def create_payment_explicit(
         )
 
     if provider in ("nowpayments", "crypto"):
-        np = NowPaymentsClient()
-        payment = np.create_payment(
-            user_id=user_id,
-            plan=plan,
-            amount=amount,
-            currency=currency,
-            base_url=base_url,
-            order_description=f"VIP {plan}",
+        return await _create_nowpayments_payment(
+            user_id=user_id, plan=plan, amount=amount, currency=currency, base_url=base_url,
         )
-        # Enrich best-effort
-        try:
-            raw = np.get_payment(payment.external_id)
-        except Exception:
-            raw = None
-        if isinstance(raw, dict):
-            payment.crypto_pay_address = raw.get("pay_address") or raw.get("payaddress")
-            try:
-                payment.crypto_pay_amount = float(raw.get("pay_amount") or raw.get("payamount") or 0) or None
-            except Exception:
-                payment.crypto_pay_amount = None
-            payment.crypto_pay_currency = raw.get("pay_currency") or raw.get("paycurrency")
-            payment.raw_provider_payload = raw
-        return payment
 
     raise ValueError(f"Unknown payment provider: {provider}")
 
@@ -290,39 +359,30 @@ class AsaasClient:
         if not self.access_token:
             raise ValueError("ASAAS_ACCESS_TOKEN is not set")
 
-        self._session = requests.Session()
-        self._session.headers.update({
+        self._headers = {
             "access_token": self.access_token,
             "Content-Type": "application/json",
             "Accept": "application/json",
             "User-Agent": "viponlybot/1.0",
-        })
-
-    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        url = f"{self.base_url}{path}"
-        r = self._session.post(url, json=payload, timeout=30)
-        if r.status_code >= 400:
-            raise RuntimeError(f"Asaas API error {r.status_code}: {r.text[:300]}")
-        return r.json()
-
-    def _get(self, path: str) -> Dict[str, Any]:
-        url = f"{self.base_url}{path}"
-        r = self._session.get(url, timeout=30)
-        if r.status_code >= 400:
-            raise RuntimeError(f"Asaas API error {r.status_code}: {r.text[:300]}")
-        return r.json()
-
-    def create_customer(self, *, user_id: int, name: str, email: Optional[str] = None) -> str:
+        }
+
+    async def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await _request_json("Asaas", "POST", f"{self.base_url}{path}", self._headers, payload)
+
+    async def _get(self, path: str) -> Dict[str, Any]:
+        return await _request_json("Asaas", "GET", f"{self.base_url}{path}", self._headers)
+
+    async def create_customer(self, *, user_id: int, name: str, email: Optional[str] = None) -> str:
         payload: Dict[str, Any] = {"name": name}
         if email:
             payload["email"] = email
-        data = self._post("/v3/customers", payload)
+        data = await self._post("/v3/customers", payload)
         cust_id = str(data.get("id") or "")
         if not cust_id:
             raise RuntimeError("Asaas returned no customer id")
         return cust_id
 
-    def create_pix_charge(
+    async def create_pix_charge(
         self,
         *,
         user_id: int,
@@ -346,11 +406,11 @@ class AsaasClient:
             "description": description,
             "externalReference": f"tg:{user_id}:{plan}",
         }
-        payment = self._post("/v3/payments", payload)
+        payment = await self._post("/v3/payments", payload)
         external_id = str(payment.get("id") or "")
         invoice_url = payment.get("invoiceUrl")
 
-        pix = self._get(f"/v3/payments/{external_id}/pixQrCode")
+        pix = await self._get(f"/v3/payments/{external_id}/pixQrCode")
         # Fields observed in docs: payload (copy/paste), encodedImage (base64 PNG)
         pix_payload = pix.get("payload") or pix.get("qrCode") or pix.get("copyPaste") or ""
         encoded = pix.get("encodedImage") or pix.get("image") or ""
@@ -371,16 +431,16 @@ class AsaasClient:
             pix_qr_code_png_bytes=png_bytes,
         )
 
-    def get_payment_status(self, external_id: str) -> str:
-        data = self._get(f"/v3/payments/{external_id}")
+    async def get_payment_status(self, external_id: str) -> str:
+        data = await self._get(f"/v3/payments/{external_id}")
         return str(data.get("status") or "")
 
-    def get_payment_details(self, payment_id: str) -> Dict[str, Any]:
+    async def get_payment_details(self, payment_id: str) -> Dict[str, Any]:
         """Fetch full payment details from Asaas.
 
         Useful for manual confirmation (A2). Returns the JSON dict.
         """
-        data = self._get(f"/v3/payments/{payment_id}")
+        data = await self._get(f"/v3/payments/{payment_id}")
         if not isinstance(data, dict):
             raise RuntimeError("Asaas returned unexpected payload")
         return data
@@ -412,15 +472,14 @@ class NowPaymentsClient:
         if not self.api_key:
             raise ValueError("NOWPAYMENTS_API_KEY is not set")
 
-        self._session = requests.Session()
-        self._session.headers.update({
+        self._headers = {
             "x-api-key": self.api_key,
             "Content-Type": "application/json",
             "Accept": "application/json",
             "User-Agent": "viponlybot/1.0",
-        })
+        }
 
-    def create_payment(
+    async def create_payment(
         self,
         *,
         user_id: int,
@@ -440,11 +499,7 @@ class NowPaymentsClient:
             "order_description": order_description,
             "ipn_callback_url": ipn_url,
         }
-        url = f"{self.base_url}/v1/payment"
-        r = self._session.post(url, json=payload, timeout=30)
-        if r.status_code >= 400:
-            raise RuntimeError(f"NOWPayments API error {r.status_code}: {r.text[:300]}")
-        data = r.json()
+        data = await _request_json("NOWPayments", "POST", f"{self.base_url}/v1/payment", self._headers, payload)
         payment_id = str(data.get("payment_id") or data.get("paymentid") or "")
         checkout_url = data.get("invoice_url") or None
 
@@ -457,12 +512,8 @@ class NowPaymentsClient:
             checkout_url=checkout_url,
         )
 
-    def get_payment(self, payment_id: str) -> Dict[str, Any]:
-        url = f"{self.base_url}/v1/payment/{payment_id}"
-        r = self._session.get(url, timeout=30)
-        if r.status_code >= 400:
-            raise RuntimeError(f"NOWPayments API error {r.status_code}: {r.text[:300]}")
-        return r.json()
+    async def get_payment(self, payment_id: str) -> Dict[str, Any]:
+        return await _request_json("NOWPayments", "GET", f"{self.base_url}/v1/payment/{payment_id}", self._headers)
 
     @staticmethod
     def _stable_json_string(data: Dict[str, Any]) -> str:
@@ -489,6 +540,155 @@ class NowPaymentsClient:
         s = (status or "").lower()
         return s in ("confirmed", "finished", "partially_paid")
 
+@dataclass
+class ProviderStats:
+    clients_built: int = 0
+    calls: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    consecutive_errors: int = 0
+    latency_p50_ms: float = 0.0
+    latency_p99_ms: float = 0.0
+    last_error: str = ""
+
+    @property
+    def healthy(self) -> bool:
+        return self.consecutive_errors < 3
+
+
+class PaymentProviderRegistry:
+    """One client per gateway, built on first use and reused by every handler.
+
+    - A client is rebuilt only when its env configuration changes (tokens, base URLs),
+      so env/SDK setup is paid once instead of on every button press or webhook.
+    - Asaas/NOWPayments share the aiohttp pool; Stripe calls run on a small dedicated
+      executor (STRIPE_THREADS) because the SDK keeps one requests.Session per thread:
+      reusing the same threads keeps those TLS connections warm.
+    - record() feeds per-provider call counts, errors and p50/p99 latency (last 200 calls);
+      a provider with 3 consecutive failures reports healthy=false on /metrics.
+    """
+
+    _ENV = {
+        "stripe": ("STRIPE_SECRET_KEY", "STRIPE_WEBHOOK_SECRET", "STRIPE_SUCCESS_URL", "STRIPE_CANCEL_URL"),
+        "asaas": ("ASAAS_ACCESS_TOKEN", "ASAAS_BASE_URL", "ASAAS_WEBHOOK_TOKEN"),
+        "nowpayments": ("NOWPAYMENTS_API_KEY", "NOWPAYMENTS_IPN_SECRET", "NOWPAYMENTS_PAY_CURRENCY",
+                        "NOWPAYMENTS_DEFAULT_PAY_CURRENCY", "NOWPAYMENTS_BASE_URL"),
+    }
+
+    def __init__(self):
+        self.stats: Dict[str, ProviderStats] = {name: ProviderStats() for name in self._ENV}
+        self._clients: Dict[str, Tuple[Tuple, Any]] = {}
+        self._latencies: Dict[str, deque] = {name: deque(maxlen=200) for name in self._ENV}
+        self._lock = threading.Lock()  # Stripe clients are built on the Stripe threads
+        self._stripe_executor: Optional[ThreadPoolExecutor] = None
+
+    def _client(self, provider: str, factory: Callable[[], Any]):
+        fingerprint = tuple(os.getenv(name) for name in self._ENV[provider])
+        with self._lock:
+            cached = self._clients.get(provider)
+            if cached is not None and cached[0] == fingerprint:
+                return cached[1]
+            client = factory()  # raises ValueError when the provider is not configured
+            self._clients[provider] = (fingerprint, client)
+            self.stats[provider].clients_built += 1
+            return client
+
+    def stripe(self) -> "StripeClient":
+        return self._client("stripe", lambda: StripeClient())
+
+    def asaas(self) -> "AsaasClient":
+        return self._client("asaas", lambda: AsaasClient())
+
+    def nowpayments(self) -> "NowPaymentsClient":
+        return self._client("nowpayments", lambda: NowPaymentsClient())
+
+    async def run_stripe(self, fn: Callable[["StripeClient"], Any]) -> Any:
+        """Run a blocking Stripe SDK call on the Stripe threads, with stats."""
+        if self._stripe_executor is None:
+            self._stripe_executor = ThreadPoolExecutor(max_workers=max(1, _env_int("STRIPE_THREADS", 2)),
+                                                       thread_name_prefix="stripe")
+        loop = asyncio.get_running_loop()
+        # Built on a Stripe thread too (the first one imports the SDK), but outside the timed
+        # call: "Stripe not configured" propagates without counting as a gateway error.
+        client = await loop.run_in_executor(self._stripe_executor, self.stripe)
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._stripe_executor, lambda: fn(client))
+        except Exception as e:
+            self.record("stripe", started, str(e)[:200] or type(e).__name__)
+            raise
+        self.record("stripe", started)
+        return result
+
+    def record(self, provider: str, started: float, error: Optional[str] = None):
+        stats = self.stats.get(provider)
+        if stats is None:
+            return
+        samples = self._latencies[provider]
+        samples.append((time.perf_counter() - started) * 1000)
+        ordered = sorted(samples)
+        stats.latency_p50_ms = round(ordered[len(ordered) // 2], 1)
+        stats.latency_p99_ms = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 1)
+        stats.calls += 1
+        if error is None:
+            stats.consecutive_errors = 0
+            return
+        stats.errors += 1
+        stats.consecutive_errors += 1
+        if error == "timeout":
+            stats.timeouts += 1
+        stats.last_error = error
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {**asdict(stats), "healthy": stats.healthy} for name, stats in self.stats.items()}
+
+    def reset(self):
+        """Drop cached clients (they are rebuilt on next use)."""
+        with self._lock:
+            self._clients.clear()
+
+    async def close(self):
+        if self._stripe_executor is not None:
+            self._stripe_executor.shutdown(wait=False)
+            self._stripe_executor = None
+
+
+# Global instance
+payment_providers = PaymentProviderRegistry()
+
+
+ASAAS_PAID_STATUSES = ("RECEIVED", "CONFIRMED", "RECEIVED_IN_CASH")
+
+
+def payment_status_checkable(provider: str, external_id: str) -> bool:
+    """Whether the gateway can be asked about this payment.
+
+    Asaas payment-link rows (asaaslink:...) have no gateway id until the user pastes it.
+    """
+    if provider == "asaas":
+        return asaas_available() and not str(external_id).startswith("asaaslink:")
+    if provider == "nowpayments":
+        return nowpayments_available()
+    if provider == "stripe":
+        return stripe_available()
+    return False
+
+
+async def fetch_payment_status(provider: str, external_id: str) -> Tuple[bool, Dict[str, Any]]:
+    """Ask the gateway whether a payment is paid. Returns (paid, raw provider payload)."""
+    if provider == "asaas":
+        status = (await payment_providers.asaas().get_payment_status(external_id)).upper()
+        return status in ASAAS_PAID_STATUSES, {"status": status}
+    if provider == "nowpayments":
+        raw = await payment_providers.nowpayments().get_payment(external_id)
+        status = str(raw.get("payment_status") or raw.get("paymentstatus") or "").lower()
+        return NowPaymentsClient.is_paid_status(status), raw
+    if provider == "stripe":
+        raw = await payment_providers.run_stripe(lambda client: client.retrieve_checkout_session(external_id))
+        return str(raw.get("payment_status") or "").lower() == "paid", raw
+    raise ValueError(f"Unknown payment provider: {provider}")
+
+
 def payment_provider_for(lang: str, currency: str) -> str:
     """Routing:
     - Brazil (pt or BRL) -> Asaas PIX
@@ -500,7 +700,7 @@ def payment_provider_for(lang: str, currency: str) -> str:
 
 
 
-def create_payment_for_user(
+async def create_payment_for_user(
     *,
     user_id: int,
     plan: str,
@@ -540,8 +740,7 @@ def create_payment_for_user(
 
     # Stripe (default)
     try:
-        client = StripeClient()
-        return client.create_checkout_session(
+        return await _create_stripe_checkout(
             user_id=user_id,
             plan=plan,
             amount=amount,
@@ -555,29 +754,9 @@ def create_payment_for_user(
         if ("No valid payment method types" in msg) or ("payment methods compatible" in msg):
             # Crypto fallback (optional)
             if os.getenv("NOWPAYMENTS_API_KEY"):
-                np = NowPaymentsClient()
                 # Create crypto payment priced in fiat (currency should be USD/EUR etc)
-                payment = np.create_payment(
-                    user_id=user_id,
-                    plan=plan,
-                    amount=amount,
-                    currency=currency,
-                    base_url=base_url,
-                    order_description=f"VIP {plan}",
+                return await _create_nowpayments_payment(
+                    user_id=user_id, plan=plan, amount=amount, currency=currency, base_url=base_url,
                 )
-                # Enrich with immediate details if present
-                try:
-                    raw = np.get_payment(payment.external_id)
-                except Exception:
-                    raw = None
-                if isinstance(raw, dict):
-                    payment.crypto_pay_address = raw.get("pay_address") or raw.get("payaddress")
-                    try:
-                        payment.crypto_pay_amount = float(raw.get("pay_amount") or raw.get("payamount") or 0) or None
-                    except Exception:
-                        payment.crypto_pay_amount = None
-                    payment.crypto_pay_currency = raw.get("pay_currency") or raw.get("paycurrency")
-                    payment.raw_provider_payload = raw
-                return payment
 
         raise
\ No newline at end of file
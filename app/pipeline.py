@@ -0,0 +1,131 @@
+"""
+Pipeline module
+Overlaps media downloads with Telegram uploads while keeping the page order
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+@dataclass
+class PipelineResult:
+    downloaded: int = 0
+    download_failed: int = 0
+    uploaded: int = 0
+    upload_failed: int = 0
+    wall_seconds: float = 0.0
+
+
+async def run_ordered_pipeline(
+    items: List[Any],
+    download: Callable[[Any], Awaitable[bool]],
+    upload: Callable[[Any], Awaitable[Any]],
+    concurrency: int = None,
+    lookahead: int = None,
+    batch_size: int = 1,
+) -> PipelineResult:
+    """Download up to `concurrency` items at once and upload them in page order.
+
+    - Producer: starts download tasks in order; at most `lookahead` finished-or-running
+      downloads wait for the uploader (bounds disk usage).
+    - Consumer: awaits each task in order and uploads successful ones; pacing between
+      sends is up to `upload`.
+    - batch_size > 1: successful downloads are grouped (in order) and `upload` receives a
+      list of up to batch_size items and returns how many of them were delivered.
+    - If the consumer stops (exception or cancellation), pending downloads are cancelled
+      and files that were downloaded but never uploaded are deleted, including the one
+      the consumer was waiting on.
+    """
+    concurrency = max(1, concurrency or _env_int("DL_CONCURRENCY", 3))
+    lookahead = max(concurrency, lookahead or _env_int("DL_LOOKAHEAD", 6))
+    result = PipelineResult()
+    started = time.monotonic()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    slots = asyncio.Semaphore(lookahead)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def fetch_one(item) -> bool:
+        async with semaphore:
+            try:
+                return bool(await download(item))
+            except Exception as e:
+                logger.warning(f"Pipeline download error: {e}")
+                return False
+
+    async def produce():
+        for item in items:
+            # Take the slot before creating the task, so nothing is orphaned if we are cancelled here.
+            await slots.acquire()
+            queue.put_nowait((item, asyncio.create_task(fetch_one(item))))
+        queue.put_nowait(None)
+
+    batch: List[Any] = []
+    current: List[Any] = []  # item whose download the consumer is awaiting
+
+    async def flush():
+        group = list(batch)
+        batch.clear()
+        delivered = int(await upload(group) or 0)
+        result.uploaded += delivered
+        result.upload_failed += len(group) - delivered
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                break
+            item, task = entry
+            slots.release()
+            current[:] = [item]
+            ok = await task
+            current.clear()
+            if not ok:
+                result.download_failed += 1
+                continue
+            result.downloaded += 1
+            if batch_size > 1:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    await flush()
+            elif await upload(item):
+                result.uploaded += 1
+            else:
+                result.upload_failed += 1
+        if batch:
+            await flush()
+    finally:
+        producer.cancel()
+        leftovers = []
+        while not queue.empty():
+            entry = queue.get_nowait()
+            if entry is not None:
+                leftovers.append(entry)
+        for _, task in leftovers:
+            task.cancel()
+        if leftovers:
+            await asyncio.gather(*(t for _, t in leftovers), return_exceptions=True)
+        for item in current + batch + [item for item, _ in leftovers]:
+            path = getattr(item, "local_path", None)
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+        result.wall_seconds = time.monotonic() - started
+
+    return result
@@ -0,0 +1,259 @@
+"""
+Prefetch module
+Warms the next posts page (and optionally its first media files) while the current page is being sent
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.fetcher import MediaFetcher, MediaItem, DOWNLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+@dataclass
+class PrefetchStats:
+    scheduled: int = 0
+    cancelled: int = 0
+    pages_prefetched: int = 0
+    media_prefetched: int = 0
+    media_used: int = 0
+    media_discarded: int = 0
+    bytes_prefetched: int = 0
+    bytes_held: int = 0  # prefetched files on disk not used yet
+    skipped_over_cap: int = 0
+    expired: int = 0  # users whose prefetch was dropped after PREFETCH_IDLE_SECONDS
+
+
+@dataclass
+class _UserPrefetch:
+    creator_key: Tuple[str, str]
+    tasks: List[asyncio.Task] = field(default_factory=list)
+    # media url -> future resolved with the prefetched local path (or None)
+    media: Dict[str, asyncio.Future] = field(default_factory=dict)
+    # page offset -> future resolved once that page's media futures are registered
+    planned: Dict[int, asyncio.Future] = field(default_factory=dict)
+    last_touch: float = field(default_factory=time.monotonic)
+
+
+class Prefetcher:
+    """Per-user background prefetch for the download pagination flow.
+
+    - The posts page goes into app.fetcher.posts_page_cache, so the next dlnext
+      (or a concurrent fetch of the same page) is served without an upstream call.
+    - Up to PREFETCH_MEDIA_COUNT files of that page are downloaded ahead, within
+      PREFETCH_MEDIA_MAX_MB per page (the last file may overshoot it).
+    - cancel() drops everything for a user: running tasks and unused files.
+    - Users that stop paging are swept after PREFETCH_IDLE_SECONDS, and no new file is
+      prefetched while unused ones hold PREFETCH_TOTAL_MAX_MB on disk (all users).
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("PREFETCH_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+        self.media_count = max(0, int(_env_float("PREFETCH_MEDIA_COUNT", 3)))
+        self.max_bytes = int(_env_float("PREFETCH_MEDIA_MAX_MB", 60) * 1024 * 1024)
+        self.total_max_bytes = int(_env_float("PREFETCH_TOTAL_MAX_MB", 500) * 1024 * 1024)
+        self.idle_seconds = max(1.0, _env_float("PREFETCH_IDLE_SECONDS", 600))
+        self.stats = PrefetchStats()
+        self._users: Dict[int, _UserPrefetch] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._files: Dict[str, int] = {}  # unused prefetched path -> size
+        self._sweeper: Optional[asyncio.Task] = None
+        # Optional file_id cache (async_user_db): files Telegram already has are not prefetched.
+        self.file_cache = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily: it must belong to the running loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, int(_env_float("PREFETCH_MAX_CONCURRENT", 4))))
+        return self._semaphore
+
+    def start(self):
+        """Delete prefetch files left by the previous process and start the idle sweep."""
+        try:
+            for name in os.listdir(DOWNLOAD_DIR):
+                if name.startswith("prefetch_"):
+                    self._remove(os.path.join(DOWNLOAD_DIR, name))
+        except FileNotFoundError:
+            pass
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="prefetch-sweeper")
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_seconds / 2))
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Cancel the prefetch of users idle for PREFETCH_IDLE_SECONDS. Returns how many."""
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [user_id for user_id, state in self._users.items() if state.last_touch < cutoff]
+        for user_id in idle:
+            self.cancel(user_id)
+            self.stats.expired += 1
+        return len(idle)
+
+    def schedule(self, user_id: int, creator: Dict[str, Any], offset: int):
+        """Start prefetching page `offset` of `creator` for this user (fire and forget)."""
+        if not self.enabled:
+            return
+        key = (str(creator.get("service")), str(creator.get("id")))
+        state = self._users.get(user_id)
+        if state is not None and state.creator_key != key:
+            self.cancel(user_id)
+            state = None
+        if state is None:
+            state = self._users[user_id] = _UserPrefetch(creator_key=key)
+
+        state.last_touch = time.monotonic()
+        state.tasks = [t for t in state.tasks if not t.done()]
+        state.planned = {o: f for o, f in state.planned.items() if not f.done()}
+        state.planned[offset] = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self._run(user_id, state, dict(creator), offset))
+        state.tasks.append(task)
+        self.stats.scheduled += 1
+
+    async def take(self, user_id: int, item: MediaItem, offset: Optional[int] = None) -> bool:
+        """Use a prefetched file for `item` if there is one (waits if it is still downloading).
+
+        `offset` is the page the item belongs to; if that page is still being prefetched,
+        wait for its plan so the item is not downloaded twice.
+        """
+        state = self._users.get(user_id)
+        if state is not None:
+            state.last_touch = time.monotonic()
+        planned = state.planned.get(offset) if state and offset is not None else None
+        if planned is not None and not planned.done():
+            await asyncio.shield(planned)
+        fut = state.media.pop(item.url, None) if state else None
+        if fut is None:
+            return False
+        path = await asyncio.shield(fut)
+        self._release(path)
+        if path and os.path.exists(path):
+            item.local_path = path
+            self.stats.media_used += 1
+            return True
+        return False
+
+    def cancel(self, user_id: int):
+        """Stop any prefetch for this user and delete files that were not used."""
+        state = self._users.pop(user_id, None)
+        if state is None:
+            return
+        for task in state.tasks:
+            if not task.done():
+                task.cancel()
+                self.stats.cancelled += 1
+        for fut in state.media.values():
+            if fut.done() and not fut.cancelled() and fut.result():
+                self._remove(fut.result())
+                self.stats.media_discarded += 1
+            elif not fut.done():
+                # Resolved by the task; clean up whatever it produced.
+                fut.add_done_callback(self._discard_when_done)
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        tasks = [t for state in self._users.values() for t in state.tasks if not t.done()]
+        for user_id in list(self._users):
+            self.cancel(user_id)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _discard_when_done(self, fut: asyncio.Future):
+        if not fut.cancelled() and fut.result():
+            self._remove(fut.result())
+            self.stats.media_discarded += 1
+
+    async def _has_file_id(self, item: MediaItem) -> bool:
+        if not self.file_cache or not item.source_key:
+            return False
+        try:
+            return await self.file_cache.get_media_file_id(item.source_key) is not None
+        except Exception:
+            return False
+
+    def _release(self, path: Optional[str]):
+        """The file is no longer held by the prefetcher (used or deleted)."""
+        if path:
+            self.stats.bytes_held -= self._files.pop(path, 0)
+
+    def _remove(self, path: str):
+        self._release(path)
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception:
+            pass
+
+    async def _run(self, user_id: int, state: _UserPrefetch, creator: Dict[str, Any], offset: int):
+        pending: List[Tuple[MediaItem, asyncio.Future]] = []
+        planned = state.planned.get(offset)
+        try:
+            async with MediaFetcher() as fetcher:
+                # Page metadata goes through the shared cache (single-flight), no need to queue it.
+                page = await fetcher.fetch_posts_page(creator, offset=offset)
+                if not page.get("posts"):
+                    return
+                self.stats.pages_prefetched += 1
+
+                loop = asyncio.get_running_loop()
+                for item in page.get("media_items", [])[:self.media_count]:
+                    if await self._has_file_id(item):
+                        continue
+                    if item.url not in state.media:
+                        fut = loop.create_future()
+                        state.media[item.url] = fut
+                        pending.append((item, fut))
+                if planned is not None and not planned.done():
+                    planned.set_result(None)
+
+                async with self._get_semaphore():
+                    budget = self.max_bytes
+                    for item, fut in pending:
+                        if budget <= 0:
+                            fut.set_result(None)
+                            continue
+                        if self.stats.bytes_held >= self.total_max_bytes:
+                            self.stats.skipped_over_cap += 1
+                            fut.set_result(None)
+                            continue
+                        path = None
+                        if await fetcher.download_media(item) and item.local_path:
+                            # Private name: another user's download of the same post must not clobber it.
+                            path = os.path.join(DOWNLOAD_DIR, f"prefetch_{user_id}_{os.path.basename(item.local_path)}")
+                            os.replace(item.local_path, path)
+                            size = os.path.getsize(path)
+                            budget -= size
+                            self._files[path] = size
+                            self.stats.bytes_held += size
+                            self.stats.media_prefetched += 1
+                            self.stats.bytes_prefetched += size
+                        fut.set_result(path)
+        except Exception as e:
+            logger.warning(f"Prefetch failed: {e}")
+        finally:
+            if planned is not None and not planned.done():
+                planned.set_result(None)
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_result(None)
+
+
+# Global instance
+prefetcher = Prefetcher()
@@ -0,0 +1,237 @@
+"""
+Rate limiter module
+Central Telegram send scheduler: global + per-chat token buckets, adapted from RetryAfter
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+class Priority(IntEnum):
+    """Lower value is served first."""
+
+    UI = 0    # button presses, payment confirmations, /start
+    VIP = 1   # VIP download pages
+    BULK = 2  # FREE previews and channel forwards
+
+
+@dataclass
+class LimiterStats:
+    acquired: int = 0
+    waited: int = 0  # acquisitions that had to wait at all
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    retry_after_events: int = 0
+    queue_depth: int = 0  # senders currently waiting for a slot
+    max_queue_depth: int = 0
+    global_rate: float = 0.0  # current (adapted) global messages/second
+    max_wait_by_priority: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def avg_wait_seconds(self) -> float:
+        return (self.total_wait_seconds / self.acquired) if self.acquired else 0.0
+
+
+@dataclass
+class _Waiter:
+    priority: int
+    enqueued: float
+    seq: int
+    cost: float
+    fut: asyncio.Future
+
+
+class _Bucket:
+    """Token bucket with an adaptive rate (AIMD) and a hard pause after RetryAfter.
+
+    Waiters are granted by priority with aging: every `aging` seconds spent waiting
+    count as one priority class, so bulk traffic is delayed but never starved.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._waiters: List[_Waiter] = []
+        self._seq = 0
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        need = min(cost, self.burst) - self.tokens
+        if need > 0:
+            wait = max(wait, need / self.rate)
+        return wait
+
+    def take(self, cost: float):
+        self.tokens -= min(cost, self.burst)
+
+    async def acquire(self, cost: float, priority: int, aging: float):
+        if not self._waiters and self.delay(cost) <= 0:
+            self.take(cost)
+            return
+        self._seq += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(_Waiter(priority, time.monotonic(), self._seq, cost, fut))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch(aging))
+        await fut
+
+    async def _dispatch(self, aging: float):
+        while True:
+            # Cancelled senders just drop out of the queue.
+            self._waiters = [w for w in self._waiters if not w.fut.done()]
+            if not self._waiters:
+                return
+            now = time.monotonic()
+            best = min(self._waiters, key=lambda w: (w.priority - (now - w.enqueued) / aging, w.seq))
+            delay = self.delay(best.cost)
+            if delay > 0:
+                # Re-pick after sleeping: a higher priority sender may have arrived meanwhile.
+                await asyncio.sleep(delay)
+                continue
+            self.take(best.cost)
+            self._waiters.remove(best)
+            best.fut.set_result(None)
+
+    def penalize(self, retry_after: float, factor: float):
+        self.rate = max(self.max_rate * 0.1, self.rate * factor)
+        if retry_after > 0:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.tokens = min(self.tokens, 0.0)
+
+    def recover(self, step: float):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * step)
+
+    @property
+    def idle(self) -> bool:
+        return (
+            not self._waiters
+            and self.rate >= self.max_rate
+            and self.blocked_until <= time.monotonic()
+            and self.delay(self.burst) == 0.0
+        )
+
+
+class TelegramRateLimiter:
+    """Every Bot API send asks for a slot here before it goes out.
+
+    - Global bucket: TG_GLOBAL_RATE msgs/s (Telegram allows ~30/s per bot).
+      An album costs one token per media in it.
+    - Per-chat bucket: TG_CHAT_RATE msgs/s for private chats, TG_GROUP_RATE for
+      groups/channels (negative chat ids). An album is one call in the chat.
+    - RetryAfter pauses the chat for retry_after seconds and halves its rate; the global
+      rate drops a little too. Both recover gradually on successful sends.
+    - Waiting senders are served by Priority (UI > VIP > BULK); each
+      TG_PRIORITY_AGING_SECONDS of waiting promotes a sender by one class.
+    """
+
+    def __init__(self):
+        self.global_bucket = _Bucket(
+            _env_float("TG_GLOBAL_RATE", 30.0),
+            _env_float("TG_GLOBAL_BURST", 30.0),
+        )
+        self.chat_rate = _env_float("TG_CHAT_RATE", 1.0)
+        self.group_rate = _env_float("TG_GROUP_RATE", 20.0 / 60.0)
+        self.chat_burst = _env_float("TG_CHAT_BURST", 3.0)
+        self.aging_seconds = max(0.1, _env_float("TG_PRIORITY_AGING_SECONDS", 5.0))
+        self.stats = LimiterStats(global_rate=self.global_bucket.rate)
+        self._chats: Dict[int, _Bucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                # Drop chats that are back to a full, unpenalized bucket.
+                for cid in [c for c, b in self._chats.items() if b.idle]:
+                    del self._chats[cid]
+            rate = self.group_rate if int(chat_id) < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = _Bucket(rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id: Optional[int] = None, cost: int = 1, priority: Priority = Priority.VIP):
+        """Wait until `cost` messages may be sent (to `chat_id`, if known)."""
+        started = time.monotonic()
+        self.stats.queue_depth += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.stats.queue_depth)
+        try:
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire(1, priority, self.aging_seconds)
+            await self.global_bucket.acquire(cost, priority, self.aging_seconds)
+        finally:
+            self.stats.queue_depth -= 1
+        waited = time.monotonic() - started
+        self.stats.acquired += 1
+        if waited > 0.001:
+            self.stats.waited += 1
+            self.stats.total_wait_seconds += waited
+            self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, waited)
+            name = Priority(priority).name
+            self.stats.max_wait_by_priority[name] = max(self.stats.max_wait_by_priority.get(name, 0.0), waited)
+
+    async def send(self, send_func: Callable[[], Awaitable], chat_id: Optional[int] = None,
+                   priority: Priority = Priority.UI, cost: int = 1):
+        """Run one Bot API call under the limiter (used for UI edits and notifications).
+
+        Retries once after RetryAfter; any other error propagates to the caller's fallback.
+        """
+        for attempt in range(2):
+            await self.acquire(chat_id, cost, priority)
+            try:
+                result = await send_func()
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                self.on_retry_after(chat_id, retry_after + 1)
+                if attempt:
+                    raise
+                continue
+            self.on_success(chat_id)
+            return result
+
+    def on_retry_after(self, chat_id: Optional[int], retry_after: float):
+        self.stats.retry_after_events += 1
+        if chat_id is not None:
+            self._chat_bucket(chat_id).penalize(retry_after, factor=0.5)
+            self.global_bucket.penalize(0.0, factor=0.9)
+        else:
+            self.global_bucket.penalize(retry_after, factor=0.5)
+        self.stats.global_rate = self.global_bucket.rate
+        logger.warning(f"Telegram RetryAfter {retry_after}s (chat={chat_id}); global rate now {self.global_bucket.rate:.1f}/s")
+
+    def on_success(self, chat_id: Optional[int] = None):
+        self.global_bucket.recover(0.02)
+        if chat_id is not None:
+            bucket = self._chats.get(chat_id)
+            if bucket is not None:
+                bucket.recover(0.1)
+        self.stats.global_rate = self.global_bucket.rate
+
+
+# Global instance
+telegram_limiter = TelegramRateLimiter()
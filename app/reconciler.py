@@ -0,0 +1,166 @@
+"""
+Reconciler module
+Background worker that settles pending payments by asking the gateways, so nobody has to press "check payment"
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from app.payments import fetch_payment_status, payment_status_checkable
+from app.users_db import async_user_db
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+@dataclass
+class ReconcilerStats:
+    passes: int = 0
+    checked: int = 0
+    paid: int = 0
+    errors: int = 0
+    over_budget: int = 0  # due payments left for the next pass
+    nudges: int = 0
+
+
+# notify(user_id, plan_type, provider): tell the user their VIP is active
+PaidNotifier = Callable[[int, str, str], Awaitable[Any]]
+
+
+class PaymentReconciler:
+    """Periodically settles pending rows of the payments table.
+
+    - Every RECONCILE_INTERVAL_SECONDS, pending payments younger than
+      RECONCILE_MAX_AGE_HOURS are scanned in one query.
+    - Backoff by age: a payment is re-checked after max(interval, 10% of its age),
+      capped at 30 minutes (fresh checkouts every pass, day-old ones rarely).
+    - At most RECONCILE_BUDGET gateway calls per pass, RECONCILE_CONCURRENCY at a time.
+    - A paid payment is settled with settle_pending_payment (flip to paid and license
+      activation in one transaction), so a webhook or a manual check arriving at the same
+      time never activates or notifies twice, and a failed activation is retried.
+    - nudge() (the "check payment" button) makes a payment due right away, and goes first
+      in the next pass; one outside the scan (older, or past its row limit) is looked up directly.
+    """
+
+    def __init__(self, db=None, check=None, checkable=None):
+        self.db = db or async_user_db
+        self._check = check or fetch_payment_status
+        self._checkable = checkable or payment_status_checkable
+        self.interval = max(1.0, _env_float("RECONCILE_INTERVAL_SECONDS", 30.0))
+        self.max_age_hours = _env_float("RECONCILE_MAX_AGE_HOURS", 48.0)
+        self.budget = max(1, int(_env_float("RECONCILE_BUDGET", 30)))
+        self.concurrency = max(1, int(_env_float("RECONCILE_CONCURRENCY", 4)))
+        self.stats = ReconcilerStats()
+        self._last_checked: Dict[Tuple[str, str], float] = {}
+        self._nudged: Set[Tuple[str, str]] = set()
+        self._notify: Optional[PaidNotifier] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self, notify: PaidNotifier = None):
+        self._notify = notify
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop(), name="payment-reconciler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def nudge(self, provider: str, external_id: str):
+        """Check this payment on the next pass, which starts now (at most every 10s per payment)."""
+        key = (provider, external_id)
+        if time.monotonic() - self._last_checked.get(key, 0.0) < 10.0:
+            return
+        self._last_checked.pop(key, None)
+        self._nudged.add(key)
+        self.stats.nudges += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _due(self, payment: Dict[str, Any], now: float) -> bool:
+        last = self._last_checked.get((payment["provider"], payment["external_id"]))
+        if last is None:
+            return True
+        try:
+            age = (datetime.now() - datetime.fromisoformat(payment["created_at"])).total_seconds()
+        except Exception:
+            age = 0.0
+        return now - last >= max(self.interval, min(age * 0.1, 1800.0))
+
+    async def run_once(self) -> int:
+        """One scan. Returns how many payments were settled as paid."""
+        self.stats.passes += 1
+        pending = await self.db.list_pending_payments(self.max_age_hours)
+        nudged, self._nudged = self._nudged, set()
+        for provider, external_id in nudged - {(p["provider"], p["external_id"]) for p in pending}:
+            payment = await self.db.get_payment_by_external_id(provider, external_id)
+            if payment and payment.get("status") == "pending":
+                pending.append(payment)
+        now = time.monotonic()
+        due = [p for p in pending if self._checkable(p["provider"], p["external_id"]) and self._due(p, now)]
+        # Nudged payments first, then never-checked ones, then newest first.
+        due.sort(key=lambda p: ((p["provider"], p["external_id"]) not in nudged,
+                                (p["provider"], p["external_id"]) in self._last_checked))
+        self.stats.over_budget += max(0, len(due) - self.budget)
+        live = {(p["provider"], p["external_id"]) for p in pending}
+        self._last_checked = {k: v for k, v in self._last_checked.items() if k in live}
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def settle(payment) -> bool:
+            provider, external_id = payment["provider"], payment["external_id"]
+            async with semaphore:
+                self._last_checked[(provider, external_id)] = time.monotonic()
+                self.stats.checked += 1
+                try:
+                    paid, raw = await self._check(provider, external_id)
+                except Exception as e:
+                    self.stats.errors += 1
+                    logger.warning(f"Reconcile check failed ({provider} {external_id}): {e}")
+                    return False
+            if not paid:
+                return False
+            rec = await self.db.settle_pending_payment(provider, external_id, raw_payload=str(raw))
+            if rec is None:
+                return False  # a webhook or manual check got there first
+            self.stats.paid += 1
+            logger.info(f"Reconciled {provider} payment {external_id} for user {rec['user_id']}")
+            if self._notify is not None:
+                try:
+                    await self._notify(rec["user_id"], rec["plan_type"], provider)
+                except Exception as e:
+                    logger.warning(f"Payment notification failed for user {rec['user_id']}: {e}")
+            return True
+
+        results = await asyncio.gather(*(settle(p) for p in due[:self.budget]))
+        return sum(1 for r in results if r)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning(f"Payment reconcile pass failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+# Global instance
+payment_reconciler = PaymentReconciler()
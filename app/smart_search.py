@@ -3,12 +3,78 @@ Smart Search Module
 Implements fuzzy matching for model names
 """
 
+import asyncio
 import logging
-from typing import List, Dict, Any
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Any, Optional
 from rapidfuzz import process, fuzz
 
 logger = logging.getLogger(__name__)
 
+
+def _token_sort(text: str) -> str:
+    """Same preprocessing fuzz.token_sort_ratio applies to each string."""
+    return " ".join(sorted(text.split()))
+
+
+class FuzzyIndex:
+    """Fuzzy search bound to one catalog snapshot.
+
+    token_sort_ratio(q, name) == ratio(token_sort(q), token_sort(name)), so the
+    token-sorted names are computed once here instead of on every query.
+
+    Candidates are also prefiltered by length: ratio() can only reach `threshold`
+    when the two lengths are close enough, so choices are kept sorted by length and
+    only the matching window is scored. The prefilter is exact; results are the same
+    as SmartSearch.find_similar over the full list.
+    """
+
+    def __init__(self, creators: List[Dict[str, Any]]):
+        self.creators = creators
+        sorted_names = {
+            i: _token_sort(c['name']) for i, c in enumerate(creators) if c.get('name') is not None
+        }
+        order = sorted((len(n), i) for i, n in sorted_names.items())
+        self.lengths = [length for length, _ in order]
+        self.positions = [i for _, i in order]
+        self.choices = [sorted_names[i] for i in self.positions]
+
+    @staticmethod
+    def _length_window(query_len: int, threshold: float):
+        # ratio <= 100 * (1 - |a - b| / (a + b)); keep one char of slack for float rounding.
+        d = max(0.0, 1.0 - threshold / 100.0)
+        if d >= 1.0:
+            return 0, None
+        lo = int(query_len * (1 - d) / (1 + d)) - 1
+        hi = int(query_len * (1 + d) / (1 - d)) + 1
+        return max(0, lo), hi
+
+    def search(self, query: str, limit: int = 8, threshold: float = 60.0) -> List[Dict[str, Any]]:
+        q = _token_sort(query)
+        lo, hi = self._length_window(len(q), threshold)
+        start = bisect_left(self.lengths, lo)
+        end = len(self.lengths) if hi is None else bisect_right(self.lengths, hi)
+        if start >= end:
+            return []
+
+        matches = process.extract(
+            q,
+            self.choices[start:end],
+            scorer=fuzz.ratio,
+            limit=None,
+            score_cutoff=threshold
+        )
+        # Same ordering as process.extract over the original list: score desc, then position.
+        ranked = sorted((-score, self.positions[start + idx]) for _, score, idx in matches)
+
+        results = []
+        for neg_score, pos in ranked[:limit]:
+            creator = self.creators[pos].copy()
+            creator['match_score'] = -neg_score
+            results.append(creator)
+        return results
+
+
 class SmartSearch:
     """Handles fuzzy searching for creators"""
     
@@ -50,5 +116,22 @@ class SmartSearch:
             
         return results
 
+    @staticmethod
+    async def find_similar_async(query: str, snapshot: Optional[Any], limit: int = 8, threshold: float = 60.0) -> List[Dict[str, Any]]:
+        """
+        Same results as find_similar, using the snapshot's preprocessed FuzzyIndex.
+
+        Scoring runs in a worker thread so the event loop is never blocked.
+
+        Args:
+            query: User search term
+            snapshot: app.catalog.CatalogSnapshot (None -> no results)
+        """
+        if not snapshot:
+            return []
+        return await asyncio.to_thread(
+            lambda: snapshot.fuzzy_index.search(query, limit=limit, threshold=threshold)
+        )
+
 # Global instance
 smart_search = SmartSearch()
@@ -0,0 +1,235 @@
+"""Offline benchmark: Telegram updates via polling vs webhook.
+
+Starts a local fake Bot API server and a real python-telegram-bot Application
+pointed at it (TELEGRAM_API_BASE_URL style base_url). The fake server injects
+text updates at a fixed rate (open loop) across several chats; the bot answers
+each one with sendMessage. Latency is measured from injection until the reply
+reaches the fake server.
+
+  polling: Updater.start_polling (long-poll getUpdates, as the bot runs today)
+  webhook: app.telegram_webhook.TelegramWebhook on an aiohttp server; the fake
+           server POSTs updates with the secret token (TELEGRAM_WEBHOOK_MAX_CONNECTIONS
+           deliveries in flight, like Telegram)
+
+--rtt-ms emulates the network round trip to Telegram: every request and every
+response leg costs rtt/2 (API calls, getUpdates, webhook deliveries).
+--concurrent-updates > 1 lets the Application run handlers concurrently.
+
+Run:
+  python app/telegram_bench.py [both|polling|webhook] [--updates 2000] [--rate 200] [--chats 50] [--rtt-ms 60]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+os.environ.setdefault("BOT_TOKEN", "TEST_TOKEN")
+os.environ.setdefault("ADMIN_ID", "123456")
+
+TOKEN = "123456:BENCH"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+def _percentiles(samples_ms):
+    ordered = sorted(samples_ms) or [0.0]
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return p50, p99, ordered[-1]
+
+
+class FakeBotAPI:
+    """The subset of the Bot API the benchmark needs, with an emulated network delay."""
+
+    def __init__(self, rtt_ms: float, max_connections: int):
+        self.leg = rtt_ms / 2000.0
+        self.max_connections = max_connections
+        self.updates = []  # pending for getUpdates
+        self.injected = {}  # update_id -> perf_counter at injection
+        self.replied = {}   # update_id -> perf_counter when sendMessage arrived
+        self.api_calls = 0
+        self.webhook_url = None
+        self.webhook_secret = None
+        self._new_updates = asyncio.Event()
+        self._deliveries: asyncio.Queue = asyncio.Queue()
+        self._delivery_tasks = []
+        self._session = None
+        self._runner = None
+        self.base_url = None
+
+    async def start(self):
+        import aiohttp
+        from aiohttp import web
+
+        web_app = web.Application()
+        web_app.add_routes([web.post("/bot{token}/{method}", self.handle)])
+        self._runner = web.AppRunner(web_app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        self._session = aiohttp.ClientSession()
+
+    async def stop(self):
+        for task in self._delivery_tasks:
+            task.cancel()
+        await asyncio.gather(*self._delivery_tasks, return_exceptions=True)
+        await self._session.close()
+        await self._runner.cleanup()
+
+    def inject(self, update_id: int, chat_id: int):
+        update = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "u"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "u"},
+                "text": str(update_id),
+            },
+        }
+        self.injected[update_id] = time.perf_counter()
+        if self.webhook_url:
+            self._deliveries.put_nowait(update)
+        else:
+            self.updates.append(update)
+            self._new_updates.set()
+
+    async def _deliver(self):
+        # One Telegram -> bot connection: the next update goes out once the bot acknowledged.
+        while True:
+            update = await self._deliveries.get()
+            await asyncio.sleep(self.leg)
+            async with self._session.post(self.webhook_url, json=update,
+                                          headers={"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret}) as r:
+                await r.read()
+            await asyncio.sleep(self.leg)
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        self.api_calls += 1
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        await asyncio.sleep(self.leg)  # request leg
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "deleteWebhook":
+            self.webhook_url = None
+            result = True
+        elif method == "setWebhook":
+            self.webhook_url = params["url"]
+            self.webhook_secret = params.get("secret_token", "")
+            self._delivery_tasks = [asyncio.create_task(self._deliver()) for _ in range(self.max_connections)]
+            result = True
+        elif method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates:
+                self._new_updates.clear()
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout=float(params.get("timeout") or 0))
+                except asyncio.TimeoutError:
+                    pass
+            result = self.updates[:int(params.get("limit") or 100)]
+        elif method == "sendMessage":
+            self.replied[int(params["text"])] = time.perf_counter()
+            result = {
+                "message_id": len(self.replied),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private", "first_name": "u"},
+                "text": params["text"],
+            }
+        else:
+            result = True
+        await asyncio.sleep(self.leg)  # response leg
+        return web.json_response({"ok": True, "result": result})
+
+
+async def run_mode(mode: str, updates: int, rate: float, chats: int, rtt_ms: float, concurrent: int):
+    from aiohttp import web
+    from telegram import Update
+    from telegram.ext import Application, MessageHandler, filters
+    from app.telegram_webhook import WEBHOOK_PATH, TelegramWebhook
+
+    api = FakeBotAPI(rtt_ms, max_connections=int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40")))
+    await api.start()
+    app = (Application.builder().token(TOKEN)
+           .base_url(f"{api.base_url}/bot").base_file_url(f"{api.base_url}/file/bot")
+           .concurrent_updates(concurrent).build())
+
+    async def echo(update: Update, context):
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=update.message.text)
+
+    app.add_handler(MessageHandler(filters.TEXT, echo))
+    await app.initialize()
+    await app.start()
+
+    runner = None
+    if mode == "webhook":
+        hook = TelegramWebhook()
+        hook.secret = "bench-secret"
+        web_app = web.Application()
+        web_app.add_routes([web.post(WEBHOOK_PATH, hook.handle)])
+        runner = web.AppRunner(web_app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        hook.public_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        hook.attach(app)
+        await hook.register(app.bot)
+    else:
+        await app.updater.start_polling(poll_interval=0.0, timeout=10)
+
+    calls_before = api.api_calls
+    started = time.perf_counter()
+    for i in range(updates):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        api.inject(i + 1, 10_000 + i % chats)
+    deadline = time.perf_counter() + 120
+    while len(api.replied) < updates and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    finished = max(api.replied.values(), default=time.perf_counter())
+    latencies = [(api.replied[u] - api.injected[u]) * 1000 for u in api.replied]
+    calls = api.api_calls - calls_before - len(api.replied)  # calls other than sendMessage
+
+    if mode == "polling":
+        await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    if runner is not None:
+        await runner.cleanup()
+    await api.stop()
+    return len(api.replied) / (finished - started), _percentiles(latencies), len(api.replied), calls
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", nargs="?", default="both", choices=["both", "polling", "webhook"])
+    parser.add_argument("--updates", type=int, default=2_000)
+    parser.add_argument("--rate", type=float, default=200.0)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=60.0)
+    parser.add_argument("--concurrent-updates", type=int, default=1)
+    args = parser.parse_args()
+
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+    print(f"load: {args.updates} updates at {args.rate:.0f}/s over {args.chats} chats, rtt {args.rtt_ms} ms, "
+          f"concurrent_updates {args.concurrent_updates}")
+    for mode in modes:
+        throughput, (p50, p99, pmax), done, calls = asyncio.run(run_mode(
+            mode, args.updates, args.rate, args.chats, args.rtt_ms, args.concurrent_updates))
+        print(f"{mode + ':':<9}{throughput:.0f} updates/s ({done}/{args.updates} answered) | "
+              f"update->reply p50 {p50:.0f} ms, p99 {p99:.0f} ms, max {pmax:.0f} ms | {calls} getUpdates calls")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+"""
+Telegram webhook module
+Optional webhook mode: Telegram POSTs updates to the embedded aiohttp server instead of the bot polling getUpdates
+"""
+
+import os
+import hmac
+import secrets
+import logging
+from dataclasses import dataclass
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/telegram/webhook"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+@dataclass
+class TelegramWebhookStats:
+    received: int = 0
+    rejected: int = 0  # wrong/missing secret token
+    invalid: int = 0   # body is not an Update
+    queue_depth: int = 0
+
+
+class TelegramWebhook:
+    """Receives Telegram updates on WEBHOOK_PATH of the payments server ($PORT).
+
+    - Enabled with TELEGRAM_WEBHOOK=1; needs PUBLIC_URL (Telegram only calls https URLs).
+    - Every request must carry the secret token given to setWebhook
+      (TELEGRAM_WEBHOOK_SECRET, or a random one per boot: setWebhook runs on every start).
+    - Updates go into Application.update_queue, the same queue polling feeds, so the
+      handlers and their ordering are unchanged.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("TELEGRAM_WEBHOOK", "0").strip().lower() in ("1", "true", "yes", "on")
+        self.public_url = (os.getenv("PUBLIC_URL") or os.getenv("RAILWAY_PUBLIC_URL") or "").rstrip("/")
+        # Telegram accepts 1-256 chars of A-Z, a-z, 0-9, _ and -.
+        self.secret = os.getenv("TELEGRAM_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+        self.max_connections = max(1, min(100, _env_int("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", 40)))
+        self.stats = TelegramWebhookStats()
+        self._application = None
+
+    @property
+    def url(self) -> str:
+        return self.public_url + WEBHOOK_PATH
+
+    def attach(self, application):
+        """Route incoming updates to this Application."""
+        self._application = application
+
+    async def stop(self):
+        """Stop accepting updates: Telegram gets 503 and redelivers them to the next instance."""
+        self._application = None
+
+    async def handle(self, request):
+        if self._application is None:
+            return web.Response(status=503, text="Not ready")
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.stats.rejected += 1
+            return web.Response(status=403, text="Forbidden")
+        try:
+            update = Update.de_json(await request.json(), self._application.bot)
+        except Exception as e:
+            self.stats.invalid += 1
+            logger.warning(f"Invalid Telegram update: {e}")
+            return web.Response(status=400, text="Invalid update")
+        # Acknowledge as soon as the update is queued; a non-2xx reply makes Telegram redeliver.
+        await self._application.update_queue.put(update)
+        self.stats.received += 1
+        self.stats.queue_depth = self._application.update_queue.qsize()
+        return web.Response(text="OK")
+
+    async def register(self, bot, drop_pending_updates: bool = False, allowed_updates=None):
+        """setWebhook with the secret token (replaces a previous polling session or webhook).
+
+        Pending updates are kept by default: the ones the previous instance answered with
+        503 while shutting down are delivered here.
+        """
+        await bot.set_webhook(
+            url=self.url,
+            secret_token=self.secret,
+            max_connections=self.max_connections,
+            drop_pending_updates=drop_pending_updates,
+            allowed_updates=allowed_updates,
+        )
+        logger.info(f"📬 Telegram webhook set to {self.url}")
+
+
+# Global instance
+telegram_webhook = TelegramWebhook()
@@ -0,0 +1,100 @@
+"""
+TTL cache module
+Async, size-bounded LRU cache with per-entry TTL and single-flight loading
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    """Counters to verify the cache actually saves upstream calls."""
+
+    hits: int = 0
+    misses: int = 0
+    deduplicated: int = 0  # callers that joined an in-flight load
+    loads: int = 0
+    evictions: int = 0
+    load_errors: int = 0
+
+
+class AsyncTTLCache:
+    """Caches the result of async loaders.
+
+    - Entries expire `ttl` seconds after they were stored.
+    - At most `max_entries` are kept; the least recently used one is evicted first.
+    - Concurrent requests for the same missing key share ONE loader call.
+    - Failures (exceptions, or values rejected by `cacheable`) are never stored.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 512, cacheable: Optional[Callable[[Any], bool]] = None):
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self.cacheable = cacheable or (lambda value: value is not None)
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a fresh cached value (or None) without loading."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            self.stats.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats.deduplicated += 1
+        else:
+            self.stats.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        # shield: one caller giving up (cancelled) must not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            self.stats.loads += 1
+            value = await loader()
+            if self.cacheable(value):
+                self.put(key, value)
+            return value
+        except Exception:
+            self.stats.load_errors += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
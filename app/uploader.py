@@ -20,11 +20,19 @@ if TYPE_CHECKING:  # pragma: no cover
 else:
     MediaItem = Any
 from app.config import Config
+from app.rate_limiter import Priority, TelegramRateLimiter
 config = Config()
 
 logger = logging.getLogger(__name__)
 
 
+def _is_invalid_file_error(exc: Exception) -> bool:
+    """Telegram rejected a file_id (expired, or from another bot)."""
+    # PTB capitalizes the message ("Wrong file identifier/HTTP URL specified").
+    msg = str(exc).lower()
+    return "wrong file identifier" in msg or "file_id_invalid" in msg
+
+
 @dataclass
 class UploadStats:
     """Simple counters to understand production behavior without spamming logs."""
@@ -35,6 +43,14 @@ class UploadStats:
     errors: int = 0
     non_retryable_errors: int = 0
     errors_by_type: Dict[str, int] = field(default_factory=dict)
+    # Sends served from the file_id cache (no download, no re-upload)
+    file_id_hits: int = 0
+    file_id_stale: int = 0
+    # Album sends (send_media_group) and albums that had to be resent item by item
+    groups_sent: int = 0
+    group_fallbacks: int = 0
+    # Bot API send attempts (retries included)
+    api_calls: int = 0
 
     def bump_error(self, kind: str):
         self.errors += 1
@@ -44,13 +60,101 @@ class UploadStats:
 class TelegramUploader:
     """Handles uploading media to Telegram channels"""
     
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, file_cache=None, limiter: Optional[TelegramRateLimiter] = None):
         self.bot = bot
         self.vip_message_ids: List[int] = []  # Store VIP message IDs for forwarding
 
+        # Every send waits for a slot here (pass the process-wide telegram_limiter in production).
+        self.limiter = limiter or TelegramRateLimiter()
+
+        # Optional persistent map upstream path -> Telegram file_id (async_user_db in production;
+        # its methods are awaited so the lookups never run on the event loop).
+        self.file_cache = file_cache
+
         # Lightweight counters for production observability.
         self.stats = UploadStats()
 
+    @staticmethod
+    def _source_key(media_item: MediaItem) -> Optional[str]:
+        return getattr(media_item, "source_key", None)
+
+    async def cached_file_id(self, media_item: MediaItem) -> Optional[str]:
+        """Telegram file_id already known for this upstream file, if any."""
+        key = self._source_key(media_item)
+        if not self.file_cache or not key:
+            return None
+        try:
+            entry = await self.file_cache.get_media_file_id(key)
+        except Exception as e:
+            logger.warning(f"file_id cache lookup failed: {e}")
+            return None
+        return entry["file_id"] if entry else None
+
+    async def _remember_file_id(self, media_item: MediaItem, msg):
+        """Store the file_id Telegram assigned to a fresh upload."""
+        key = self._source_key(media_item)
+        if not self.file_cache or not key or msg is None:
+            return
+        # Telegram may turn a short video into an animation; keep the kind it reports.
+        for kind in ("video", "animation", "photo", "document"):
+            media = getattr(msg, kind, None)
+            if kind == "photo" and media:
+                media = media[-1]  # largest size
+            file_id = getattr(media, "file_id", None)
+            if isinstance(file_id, str) and file_id:
+                try:
+                    await self.file_cache.save_media_file_id(key, file_id, kind)
+                except Exception as e:
+                    logger.warning(f"file_id cache write failed: {e}")
+                return
+
+    async def _send_by_file_id(self, channel_id: int, media_item: MediaItem,
+                               caption: str = "", reply_markup=None,
+                               priority: Priority = Priority.VIP) -> Optional[int]:
+        """Send an already-uploaded file by file_id. None means: fall back to a real upload."""
+        key = self._source_key(media_item)
+        if not self.file_cache or not key:
+            return None
+        try:
+            entry = await self.file_cache.get_media_file_id(key)
+        except Exception:
+            return None
+        if not entry:
+            return None
+
+        senders = {
+            "video": lambda: self.bot.send_video(chat_id=channel_id, video=entry["file_id"], caption=caption, reply_markup=reply_markup),
+            "animation": lambda: self.bot.send_animation(chat_id=channel_id, animation=entry["file_id"], caption=caption, reply_markup=reply_markup),
+            "document": lambda: self.bot.send_document(chat_id=channel_id, document=entry["file_id"], caption=caption, reply_markup=reply_markup),
+        }
+        send = senders.get(entry["media_type"]) or (
+            lambda: self.bot.send_photo(chat_id=channel_id, photo=entry["file_id"], caption=caption, reply_markup=reply_markup)
+        )
+        try:
+            msg = await self._send_with_retry(send, chat_id=channel_id, priority=priority, raise_invalid_file=True)
+        except TelegramError as e:
+            if _is_invalid_file_error(e):
+                # Telegram no longer knows this file_id: drop the entry, upload the bytes.
+                self.stats.file_id_stale += 1
+                try:
+                    await self.file_cache.forget_media_file_id(key)
+                except Exception:
+                    pass
+            else:
+                logger.warning(f"Send by file_id failed, falling back to upload: {e}")
+            return None
+        except Exception as e:
+            logger.warning(f"Send by file_id failed, falling back to upload: {e}")
+            return None
+
+        if not msg:
+            # Retries exhausted (flood wait, timeouts): the cached file_id is still valid.
+            return None
+
+        self.stats.sent += 1
+        self.stats.file_id_hits += 1
+        return msg.message_id
+
     @staticmethod
     def _esc_md(text: str) -> str:
         """Escape minimal Markdown characters for ParseMode.MARKDOWN in *text messages*.
@@ -101,9 +205,6 @@ class TelegramUploader:
                 
                 if progress_callback:
                     await progress_callback(i + len(batch), total)
-                
-                # Rate limiting between batches
-                await asyncio.sleep(2)
             
             except Exception as e:
                 logger.error(f"Error uploading batch to VIP: {e}")
@@ -139,6 +240,7 @@ class TelegramUploader:
             # python-telegram-bot will read files when sending; if we close them early,
             # Telegram may receive empty payloads ("File must be non-empty") and the user flow "trava".
             media_group = []
+            grouped_items = []
 
             # Size limits / empty guardrails (same as single)
             try:
@@ -171,6 +273,7 @@ class TelegramUploader:
                     media_group.append(InputMediaVideo(item.local_path))
                 else:
                     media_group.append(InputMediaPhoto(item.local_path))
+                grouped_items.append(item)
             
             if not media_group:
                 return []
@@ -195,13 +298,17 @@ class TelegramUploader:
                 lambda: self.bot.send_media_group(
                     chat_id=channel_id,
                     media=media_group
-                )
+                ),
+                chat_id=channel_id,
+                cost=len(media_group),
             )
             
             # Extract message IDs
             message_ids = [msg.message_id for msg in messages] if messages else []
             if message_ids:
                 self.stats.sent += len(message_ids)
+                for item, msg in zip(grouped_items, messages):
+                    await self._remember_file_id(item, msg)
             return message_ids
         
         except Exception as e:
@@ -209,7 +316,8 @@ class TelegramUploader:
             self.stats.errors += 1
             return []
     async def _upload_single(self, channel_id: int, media_item: MediaItem,
-                            caption: str = "", reply_markup=None) -> Optional[int]:
+                            caption: str = "", reply_markup=None,
+                            priority: Priority = Priority.VIP) -> Optional[int]:
         """Upload a single media item.
 
         Guardrails:
@@ -251,7 +359,9 @@ class TelegramUploader:
                             video=f,
                             caption=caption,
                             reply_markup=reply_markup,
-                        )
+                        ),
+                        chat_id=channel_id,
+                        priority=priority,
                     )
                 else:
                     msg = await self._send_with_retry(
@@ -260,11 +370,14 @@ class TelegramUploader:
                             photo=f,
                             caption=caption,
                             reply_markup=reply_markup,
-                        )
+                        ),
+                        chat_id=channel_id,
+                        priority=priority,
                     )
 
             if msg:
                 self.stats.sent += 1
+                await self._remember_file_id(media_item, msg)
                 return msg.message_id
             return None
 
@@ -315,21 +428,27 @@ class TelegramUploader:
                 # Forward each selected message
                 for msg_id in selected_ids:
                     try:
-                        await self.bot.forward_message(
+                        await self._send_with_retry(
+                            lambda: self.bot.forward_message(
+                                chat_id=channel_id,
+                                from_chat_id=config.VIP_CHANNEL_ID,
+                                message_id=msg_id
+                            ),
                             chat_id=channel_id,
-                            from_chat_id=config.VIP_CHANNEL_ID,
-                            message_id=msg_id
+                            priority=Priority.BULK,
                         )
                         
                         # Send caption as separate text message.
                         # (No reply_markup here; keep forwarding stable.)
-                        await self.bot.send_message(
+                        await self._send_with_retry(
+                            lambda: self.bot.send_message(
+                                chat_id=channel_id,
+                                text=caption,
+                                parse_mode=ParseMode.MARKDOWN,
+                            ),
                             chat_id=channel_id,
-                            text=caption,
-                            parse_mode=ParseMode.MARKDOWN,
+                            priority=Priority.BULK,
                         )
-                        
-                        await asyncio.sleep(1)  # Rate limiting
                     
                     except Exception as e:
                         logger.error(f"Error forwarding message {msg_id} to {lang}: {e}")
@@ -392,23 +511,32 @@ Want to see EVERYTHING uncensored?
         
         return captions.get(lang, captions['pt'])
     
-    async def _send_with_retry(self, send_func, max_retries: int = 3):
+    async def _send_with_retry(self, send_func, max_retries: int = 3, chat_id: Optional[int] = None, cost: int = 1,
+                               priority: Priority = Priority.VIP, raise_invalid_file: bool = False):
         """
         Send message with retry logic for rate limiting
         
         Args:
             send_func: Async function to send message
             max_retries: Maximum number of retries
+            chat_id: Target chat (per-chat rate bucket)
+            cost: Messages this call produces (album size)
+            priority: Scheduling class in the rate limiter
+            raise_invalid_file: re-raise "wrong file identifier" instead of returning None
         """
         for attempt in range(max_retries):
             try:
-                return await send_func()
+                await self.limiter.acquire(chat_id, cost, priority)
+                self.stats.api_calls += 1
+                result = await send_func()
+                self.limiter.on_success(chat_id)
+                return result
             
             except RetryAfter as e:
-                # Telegram rate limit hit
-                wait_time = e.retry_after + 1
-                logger.warning(f"Rate limited. Waiting {wait_time}s...")
-                await asyncio.sleep(wait_time)
+                # Telegram rate limit hit: the limiter pauses this chat and slows down;
+                # the next acquire() waits it out.
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                self.limiter.on_retry_after(chat_id, retry_after + 1)
             
             except TimedOut:
                 # Timeout - retry with exponential backoff
@@ -429,8 +557,10 @@ Want to see EVERYTHING uncensored?
                     "FILE_ID_INVALID",
                     "Can't parse entities",
                 ]
-                if any(m in msg for m in non_retryable_markers):
+                if any(m in msg for m in non_retryable_markers) or _is_invalid_file_error(e):
                     self.stats.non_retryable_errors += 1
+                    if raise_invalid_file and _is_invalid_file_error(e):
+                        raise
                     return None
 
                 if attempt == max_retries - 1:
@@ -439,7 +569,128 @@ Want to see EVERYTHING uncensored?
         
         return None
     
-    async def upload_and_cleanup(self, media_item: MediaItem, channel_id: int, caption: str = "", reply_markup=None) -> bool:
+    def _usable_local_file(self, media_item: MediaItem) -> bool:
+        """Same guardrails as _upload_single: the file exists, is non-empty and fits the limit."""
+        if not media_item.local_path or not os.path.exists(media_item.local_path):
+            logger.warning(f"File not found: {media_item.local_path}")
+            return False
+        try:
+            file_size = os.path.getsize(media_item.local_path)
+        except OSError:
+            file_size = -1
+        if file_size == 0:
+            logger.warning(f"Skipping empty file: {media_item.local_path}")
+            self.stats.skipped_empty += 1
+            return False
+        try:
+            max_mb = float(os.getenv("TELEGRAM_MAX_UPLOAD_MB", "49"))
+        except Exception:
+            max_mb = 49.0
+        if file_size > int(max_mb * 1024 * 1024):
+            logger.warning(f"Skipping oversized file in group ({file_size} bytes): {media_item.local_path}")
+            self.stats.skipped_large += 1
+            return False
+        return True
+
+    async def upload_group_and_cleanup(self, media_items: List[MediaItem], channel_id: int,
+                                       caption: str = "", priority: Priority = Priority.VIP) -> List[Optional[int]]:
+        """
+        Send items as albums of up to 10 and delete local files afterwards
+
+        - Items with a cached file_id join the album by id (no upload).
+        - Missing/empty/oversized files are skipped (same guardrails as single sends).
+        - Only when Telegram rejects an album are its items resent one by one.
+        - The caption goes on the first item of each album (no parse_mode).
+
+        Returns:
+            One entry per item: message id, or None if it was not delivered
+        """
+        results: List[Optional[int]] = [None] * len(media_items)
+        try:
+            for start in range(0, len(media_items), 10):
+                await self._send_album(media_items, start, min(start + 10, len(media_items)), channel_id, caption, results, priority)
+        finally:
+            for media_item in media_items:
+                if media_item.local_path and os.path.exists(media_item.local_path):
+                    try:
+                        os.remove(media_item.local_path)
+                    except Exception as e:
+                        logger.warning(f"Failed to delete {media_item.local_path}: {e}")
+        return results
+
+    async def _send_album(self, media_items: List[MediaItem], start: int, end: int,
+                          channel_id: int, caption: str, results: List[Optional[int]],
+                          priority: Priority = Priority.VIP):
+        group = []    # (index, InputMedia, sent by file_id)
+        singles = []  # indexes that can't go in an album (animation/document file_ids, lone item)
+        for idx in range(start, end):
+            item = media_items[idx]
+            cached = None
+            key = self._source_key(item)
+            if self.file_cache and key:
+                try:
+                    cached = await self.file_cache.get_media_file_id(key)
+                except Exception:
+                    cached = None
+            if cached:
+                if cached["media_type"] == "photo":
+                    group.append((idx, InputMediaPhoto(cached["file_id"]), True))
+                elif cached["media_type"] == "video":
+                    group.append((idx, InputMediaVideo(cached["file_id"]), True))
+                else:
+                    singles.append(idx)
+                continue
+            if not self._usable_local_file(item):
+                continue
+            # Pass file path string so PTB handles the file IO safely.
+            if item.media_type == "video":
+                group.append((idx, InputMediaVideo(item.local_path), False))
+            else:
+                group.append((idx, InputMediaPhoto(item.local_path), False))
+
+        if len(group) == 1:
+            singles.append(group[0][0])
+            group = []
+
+        if group:
+            first_idx, first, by_id = group[0]
+            if caption:
+                media_cls = InputMediaVideo if isinstance(first, InputMediaVideo) else InputMediaPhoto
+                group[0] = (first_idx, media_cls(first.media, caption=caption), by_id)
+            try:
+                messages = await self._send_with_retry(
+                    lambda: self.bot.send_media_group(chat_id=channel_id, media=[m for _, m, _ in group]),
+                    chat_id=channel_id,
+                    cost=len(group),
+                    priority=priority,
+                )
+            except Exception as e:
+                logger.warning(f"Album send failed, falling back to single sends: {e}")
+                messages = None
+
+            if messages and len(messages) == len(group):
+                self.stats.groups_sent += 1
+                self.stats.sent += len(group)
+                for (idx, _, by_id), msg in zip(group, messages):
+                    results[idx] = msg.message_id
+                    if by_id:
+                        self.stats.file_id_hits += 1
+                    else:
+                        await self._remember_file_id(media_items[idx], msg)
+            else:
+                self.stats.group_fallbacks += 1
+                singles.extend(idx for idx, _, _ in group)
+
+        for idx in sorted(singles):
+            item = media_items[idx]
+            item_caption = caption if idx == start else ""
+            msg_id = await self._send_by_file_id(channel_id, item, item_caption, priority=priority)
+            if msg_id is None:
+                msg_id = await self._upload_single(channel_id, item, item_caption, priority=priority)
+            results[idx] = msg_id
+
+    async def upload_and_cleanup(self, media_item: MediaItem, channel_id: int, caption: str = "", reply_markup=None,
+                                 priority: Priority = Priority.VIP) -> bool:
         """
         Upload a single media item and delete it immediately after
         
@@ -447,13 +698,16 @@ Want to see EVERYTHING uncensored?
             media_item: MediaItem object with local_path
             channel_id: Target channel ID
             caption: Optional caption
+            priority: Scheduling class in the rate limiter (UI / VIP / BULK)
         
         Returns:
             True if successful, False otherwise
         """
         try:
-            # Upload
-            msg_id = await self._upload_single(channel_id, media_item, caption, reply_markup=reply_markup)
+            # Known file: resend by file_id (no bytes); otherwise upload the local file.
+            msg_id = await self._send_by_file_id(channel_id, media_item, caption, reply_markup=reply_markup, priority=priority)
+            if msg_id is None:
+                msg_id = await self._upload_single(channel_id, media_item, caption, reply_markup=reply_markup, priority=priority)
             
             if msg_id:
                 # Store message ID if uploading to VIP
@@ -4,9 +4,16 @@ User management module with Database support - v8.2
 Handles user data, licenses, credits, and referral system
 """
 
+import asyncio
+import functools
 import logging
 import os
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 from app.config import Config
@@ -14,8 +21,53 @@ config = Config()
 
 logger = logging.getLogger(__name__)
 
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+DAILY_PREVIEW_LIMIT = 3  # free previews per user per day
+
+
+@dataclass
+class UserCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    size: int = 0
+
+
+@dataclass
+class ActivityStats:
+    touches: int = 0  # activity updates recorded in memory
+    flushes: int = 0  # batched transactions written
+    rows_flushed: int = 0
+    pending: int = 0
+
+
 class UserDB:
-    """Manages user data and licenses using SQLite"""
+    """Manages user data and licenses using SQLite
+
+    User rows are kept in a bounded LRU (USER_CACHE_SIZE rows) with write-through:
+    update_user() changes the cached row after its UPDATE commits, so the helpers that
+    re-read the row (is_license_active, check_preview_limit, use_preview, use_credit...) do not
+    query again. Only this process writes the users table (single bot instance).
+
+    last_seen is activity, not state: touch_user() records it in memory and
+    flush_activity() writes all pending values in one transaction (AsyncUserDB runs
+    it every ACTIVITY_FLUSH_SECONDS and at shutdown). Licenses, credits, previews and
+    payments are still committed immediately.
+    """
     
     def __init__(self, db_path: str = None):
         if db_path is None:
@@ -33,10 +85,57 @@ class UserDB:
             self.db_path = db_path
             
         logger.info(f"Using database at: {self.db_path}")
+        self._local = threading.local()
+        self._user_cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._user_cache_max = max(0, _env_int("USER_CACHE_SIZE", 10_000))
+        self._user_cache_lock = threading.Lock()
+        self.user_cache_stats = UserCacheStats()
+        self._pending_seen: Dict[int, str] = {}
+        self._pending_lock = threading.Lock()
+        self.activity_stats = ActivityStats()
         self._init_db()
     
     def _get_conn(self):
-        return sqlite3.connect(self.db_path)
+        # One long-lived connection per thread (sqlite3 connections are thread-bound);
+        # `with conn:` only commits/rolls back, it never closes it.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=10)
+            self._configure(conn)
+        conn.row_factory = None  # some methods switch to sqlite3.Row for their own query
+        return conn
+
+    @staticmethod
+    def _configure(conn: sqlite3.Connection):
+        """Per-connection pragmas (applied once, the connection is reused).
+
+        - WAL: the DB thread's writes never block readers on other connections (benchmarks,
+          scripts, a second process), and a commit appends to the log instead of rewriting
+          the journal. The event loop itself never opens a connection: it goes through
+          async_user_db.
+        - synchronous=NORMAL: fsync at checkpoints only; safe with WAL (a power loss may drop
+          the last commits, never corrupts the file).
+        - SQLITE_CACHE_MB page cache and SQLITE_MMAP_MB memory-mapped reads.
+        """
+        try:
+            mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            if str(mode).lower() != "wal":
+                logger.warning(f"SQLite WAL not available (journal_mode={mode})")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA cache_size=-{max(1, _env_int('SQLITE_CACHE_MB', 16)) * 1024}")
+            conn.execute(f"PRAGMA mmap_size={max(0, _env_int('SQLITE_MMAP_MB', 64)) * 1024 * 1024}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA busy_timeout=10000")
+        except sqlite3.Error as e:
+            # Non-fatal: keep the defaults (e.g. read-only or network filesystems).
+            logger.warning(f"SQLite pragmas not applied: {e}")
+
+    def close(self):
+        """Close the calling thread's connection (reopened on next use)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
     
     def _init_db(self):
         """Initialize database tables"""
@@ -105,10 +204,121 @@ class UserDB:
                     FOREIGN KEY(user_id) REFERENCES users(user_id)
                 )
             ''')
+            # Pending scan of the payment reconciler
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status, created_at)")
+
+            # Webhook inbox: verified gateway events, acknowledged first and applied by a worker.
+            # UNIQUE(provider, event_id) makes gateway retries no-ops.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS webhook_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    provider TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at DATETIME NOT NULL,
+                    received_at DATETIME NOT NULL,
+                    processed_at DATETIME,
+                    error TEXT,
+                    UNIQUE(provider, event_id)
+                )
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_webhook_events_status ON webhook_events(status, next_attempt_at)")
+
+            # Telegram file_id per upstream file (path = content hash): resend without re-uploading
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS media_file_ids (
+                    source_key TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    media_type TEXT NOT NULL,
+                    created_at DATETIME NOT NULL
+                )
+            ''')
+
+            # Download pages as persistent jobs (resumed after a restart)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS download_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    service TEXT NOT NULL,
+                    creator_id TEXT NOT NULL,
+                    name TEXT,
+                    page_offset INTEGER NOT NULL DEFAULT 0,
+                    next_offset INTEGER,
+                    status TEXT NOT NULL,
+                    chat_id INTEGER,
+                    message_id INTEGER,
+                    sent_count INTEGER NOT NULL DEFAULT 0,
+                    created_at DATETIME NOT NULL,
+                    updated_at DATETIME NOT NULL
+                )
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_download_jobs_user ON download_jobs(user_id, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_download_jobs_status ON download_jobs(status)")
+            # Items of a job already delivered (not resent on resume)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS download_job_items (
+                    job_id INTEGER NOT NULL,
+                    item_key TEXT NOT NULL,
+                    PRIMARY KEY (job_id, item_key)
+                )
+            ''')
             conn.commit()
 
+    def _cached_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._user_cache_lock:
+            row = self._user_cache.get(user_id)
+            if row is None:
+                self.user_cache_stats.misses += 1
+                return None
+            self._user_cache.move_to_end(user_id)
+            self.user_cache_stats.hits += 1
+            return dict(row)
+
+    def _cache_user(self, user_id: int, row: Dict[str, Any], merge: bool = False):
+        """Store a row (merge=True: apply changed fields to a cached row, if any)."""
+        if self._user_cache_max <= 0:
+            return
+        with self._user_cache_lock:
+            if merge:
+                cached = self._user_cache.get(user_id)
+                if cached is None:
+                    return
+                cached.update(row)
+            else:
+                self._user_cache[user_id] = dict(row)
+            self._user_cache.move_to_end(user_id)
+            while len(self._user_cache) > self._user_cache_max:
+                self._user_cache.popitem(last=False)
+                self.user_cache_stats.evictions += 1
+            self.user_cache_stats.size = len(self._user_cache)
+
+    @contextmanager
+    def _cache_rollback(self, *user_ids: int):
+        """Drop these cached rows if the block raises: its write-through never got committed."""
+        try:
+            yield
+        except Exception:
+            for user_id in user_ids:
+                self.invalidate_user(user_id)
+            raise
+
+    def invalidate_user(self, user_id: int = None):
+        """Drop one cached row (or all of them), e.g. after editing the DB by hand."""
+        with self._user_cache_lock:
+            if user_id is None:
+                self._user_cache.clear()
+            else:
+                self._user_cache.pop(user_id, None)
+            self.user_cache_stats.size = len(self._user_cache)
+
     def get_user(self, user_id: int) -> Dict[str, Any]:
         """Get user data, create if doesn't exist"""
+        cached = self._cached_user(user_id)
+        if cached is not None:
+            return cached
+
         with self._get_conn() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
@@ -116,7 +326,11 @@ class UserDB:
             row = cursor.fetchone()
             
             if row:
-                return dict(row)
+                user = dict(row)
+                with self._pending_lock:
+                    user["last_seen"] = self._pending_seen.get(user_id, user["last_seen"])
+                self._cache_user(user_id, user)
+                return user
             
             # Create new user
             now = datetime.now().isoformat()
@@ -147,11 +361,62 @@ class UserDB:
         fields = ", ".join([f"{k} = ?" for k in kwargs.keys()])
         values = list(kwargs.values())
         
-        with self._get_conn() as conn:
-            bindings = values + [datetime.now().isoformat(), user_id]
-            conn.execute(f"UPDATE users SET {fields}, last_seen = ? WHERE user_id = ?", 
+        with self._cache_rollback(user_id), self._get_conn() as conn:
+            bindings = values + [user_id]
+            conn.execute(f"UPDATE users SET {fields} WHERE user_id = ?", 
                         bindings)
+            # Write-through, still holding the write lock: cache updates follow commit order.
+            self._cache_user(user_id, dict(kwargs), merge=True)
             conn.commit()
+        self.touch_user(user_id)
+
+    def touch_user(self, user_id: int):
+        """Record activity (last_seen) in memory; written by the next flush_activity()."""
+        now = datetime.now().isoformat()
+        with self._pending_lock:
+            self._pending_seen[user_id] = now
+            self.activity_stats.touches += 1
+            self.activity_stats.pending = len(self._pending_seen)
+        self._cache_user(user_id, {"last_seen": now}, merge=True)
+
+    def flush_activity(self) -> int:
+        """Write all pending last_seen values in one transaction. Returns the number of rows."""
+        with self._pending_lock:
+            pending, self._pending_seen = self._pending_seen, {}
+            self.activity_stats.pending = 0
+        if not pending:
+            return 0
+        try:
+            with self._get_conn() as conn:
+                conn.executemany(
+                    "UPDATE users SET last_seen = ? WHERE user_id = ?",
+                    [(seen, user_id) for user_id, seen in pending.items()],
+                )
+                conn.commit()
+        except Exception:
+            # Put them back (newer touches win) so the next flush retries.
+            with self._pending_lock:
+                for user_id, seen in pending.items():
+                    self._pending_seen.setdefault(user_id, seen)
+                self.activity_stats.pending = len(self._pending_seen)
+            raise
+        self.activity_stats.flushes += 1
+        self.activity_stats.rows_flushed += len(pending)
+        return len(pending)
+
+    def _update_returning(self, conn, sql: str, params, user_id: int) -> Optional[Dict[str, Any]]:
+        """Run one `UPDATE users ... RETURNING` and write the returned columns through to the cache.
+
+        Returns the returned columns, or None if no row matched. The caller commits, inside
+        _cache_rollback() so a failed commit does not leave the cache ahead of the disk.
+        """
+        cur = conn.execute(sql, params)
+        rows = cur.fetchall()  # fetch everything: the statement must finish before commit
+        if not rows:
+            return None
+        changed = dict(zip([c[0] for c in cur.description], rows[0]))
+        self._cache_user(user_id, changed, merge=True)
+        return changed
 
     def check_preview_limit(self, user_id: int) -> bool:
         """Check if user can still use free previews today"""
@@ -168,42 +433,112 @@ class UserDB:
             self.update_user(user_id, daily_previews_used=0, last_preview_date=today)
             return True
             
-        return used < 3
+        return used < DAILY_PREVIEW_LIMIT
+
+    def use_preview(self, user_id: int) -> bool:
+        """Take one of today's free previews (atomic: never goes past DAILY_PREVIEW_LIMIT).
+
+        The daily reset and the increment are one conditional UPDATE, so concurrent
+        callbacks cannot both pass a check made before either one counted.
+        """
+        self.get_user(user_id)
+        today = datetime.now().date().isoformat()
+        with self._cache_rollback(user_id), self._get_conn() as conn:
+            changed = self._update_returning(
+                conn,
+                """
+                UPDATE users SET
+                    daily_previews_used = CASE WHEN last_preview_date = ?
+                                               THEN COALESCE(daily_previews_used, 0) + 1 ELSE 1 END,
+                    last_preview_date = ?
+                WHERE user_id = ?
+                  AND (last_preview_date IS NOT ? OR COALESCE(daily_previews_used, 0) < ?)
+                RETURNING daily_previews_used, last_preview_date
+                """,
+                (today, today, user_id, today, DAILY_PREVIEW_LIMIT),
+                user_id,
+            )
+            conn.commit()
+        self.touch_user(user_id)
+        return changed is not None
 
     def increment_previews(self, user_id: int):
-        """Increment daily preview count"""
-        user = self.get_user(user_id)
-        used = int(user.get('daily_previews_used', 0))
-        self.update_user(user_id, daily_previews_used=used + 1)
+        """Increment daily preview count (single atomic UPDATE)"""
+        self.get_user(user_id)  # ensure the row exists (cache hit in practice)
+        with self._cache_rollback(user_id), self._get_conn() as conn:
+            self._update_returning(
+                conn,
+                """
+                UPDATE users SET daily_previews_used = COALESCE(daily_previews_used, 0) + 1
+                WHERE user_id = ?
+                RETURNING daily_previews_used
+                """,
+                (user_id,),
+                user_id,
+            )
+            conn.commit()
+        self.touch_user(user_id)
 
     def use_credit(self, user_id: int) -> bool:
-        """Use one credit for full media access"""
-        user = self.get_user(user_id)
-        credits = int(user.get('credits', 0))
-        if credits > 0:
-            self.update_user(user_id, credits=credits - 1)
-            return True
-        return False
+        """Use one credit for full media access (atomic: never goes below zero)"""
+        self.get_user(user_id)
+        with self._cache_rollback(user_id), self._get_conn() as conn:
+            changed = self._update_returning(
+                conn,
+                """
+                UPDATE users SET credits = credits - 1
+                WHERE user_id = ? AND credits > 0
+                RETURNING credits
+                """,
+                (user_id,),
+                user_id,
+            )
+            conn.commit()
+        self.touch_user(user_id)
+        return changed is not None
+
+    def process_referral(self, new_user_id: int, referrer_id: int) -> bool:
+        """Handle new user referred by someone.
 
-    def process_referral(self, new_user_id: int, referrer_id: int):
-        """Handle new user referred by someone"""
+        Linking the new user and rewarding the referrer happen in one transaction, and
+        only if the new user had no referrer yet. Returns True if the reward was granted.
+        """
         if new_user_id == referrer_id:
-            return
-            
-        referrer = self.get_user(referrer_id)
-        if not referrer:
-            return
-            
-        new_user = self.get_user(new_user_id)
-        if not new_user.get('referred_by'):
-            self.update_user(new_user_id, referred_by=referrer_id)
-            
-            current_count = int(referrer.get('referral_count', 0))
-            current_credits = int(referrer.get('credits', 0))
-            self.update_user(referrer_id, 
-                             referral_count=current_count + 1,
-                             credits=current_credits + 3)
-            logger.info(f"User {referrer_id} rewarded for referring {new_user_id}")
+            return False
+
+        # Both rows must exist (get_user creates them, as before).
+        self.get_user(referrer_id)
+        self.get_user(new_user_id)
+
+        with self._cache_rollback(new_user_id, referrer_id), self._get_conn() as conn:
+            linked = self._update_returning(
+                conn,
+                """
+                UPDATE users SET referred_by = ?
+                WHERE user_id = ? AND (referred_by IS NULL OR referred_by = 0)
+                RETURNING referred_by
+                """,
+                (referrer_id, new_user_id),
+                new_user_id,
+            )
+            if linked is None:
+                conn.commit()
+                return False
+            self._update_returning(
+                conn,
+                """
+                UPDATE users SET referral_count = COALESCE(referral_count, 0) + 1,
+                                 credits = COALESCE(credits, 0) + 3
+                WHERE user_id = ?
+                RETURNING referral_count, credits
+                """,
+                (referrer_id,),
+                referrer_id,
+            )
+            conn.commit()
+        self.touch_user(new_user_id)
+        logger.info(f"User {referrer_id} rewarded for referring {new_user_id}")
+        return True
 
 
     # -------------------------
@@ -259,26 +594,261 @@ class UserDB:
             )
             conn.commit()
 
+    def list_pending_payments(self, max_age_hours: float = 48, limit: int = 500) -> List[Dict[str, Any]]:
+        """Pending payments created within the last `max_age_hours`, newest first."""
+        since = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        with self._get_conn() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM payments WHERE status = 'pending' AND created_at >= ? ORDER BY created_at DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+            return [dict(r) for r in rows]
+
+    def settle_pending_payment(self, provider: str, external_id: str,
+                               raw_payload: str = None) -> Optional[Dict[str, Any]]:
+        """Flip a payment from pending to paid and activate its license, in one transaction.
+
+        Returns {"user_id", "plan_type"} only for the caller that made the transition, so
+        webhooks, manual checks and the reconciler never activate/notify twice. If anything
+        fails the payment stays pending, and the next attempt completes it.
+        """
+        payment = self.get_payment_by_external_id(provider, external_id)
+        if not payment or payment.get("status") != "pending":
+            return None
+        user_id = int(payment["user_id"])
+        self.get_user(user_id)  # ensure the row the license goes on exists
+        now = datetime.now().isoformat()
+        with self._cache_rollback(user_id), self._get_conn() as conn:
+            rows = conn.execute(
+                """
+                UPDATE payments
+                SET status = 'paid', paid_at = COALESCE(paid_at, ?), raw_payload = COALESCE(?, raw_payload)
+                WHERE provider = ? AND external_id = ? AND status = 'pending'
+                RETURNING plan_type
+                """,
+                (now, raw_payload, provider, external_id),
+            ).fetchall()
+            if not rows:
+                conn.commit()
+                return None
+            plan_type = rows[0][0]
+            license = {"is_vip": 1, "license_type": plan_type, "license_expiry": self._license_expiry(plan_type)}
+            conn.execute(
+                "UPDATE users SET is_vip = ?, license_type = ?, license_expiry = ? WHERE user_id = ?",
+                (license["is_vip"], license["license_type"], license["license_expiry"], user_id),
+            )
+            self._cache_user(user_id, license, merge=True)
+            conn.commit()
+        logger.info(f"License {plan_type} activated for user {user_id} ({provider} payment {external_id})")
+        return {"user_id": user_id, "plan_type": plan_type}
+
     def is_payment_already_paid(self, provider: str, external_id: str) -> bool:
         p = self.get_payment_by_external_id(provider, external_id)
         return bool(p and p.get('status') == 'paid')
-    def activate_license(self, user_id: int, plan_type: str):
-        """Activate a license for a user"""
+
+    # -------------------------
+    # Webhook inbox
+    # -------------------------
+    def insert_webhook_event(self, provider: str, event_id: str, payload: str) -> bool:
+        """Store a verified webhook event. Returns False if it was already received (duplicate)."""
+        now = datetime.now().isoformat()
+        with self._get_conn() as conn:
+            cur = conn.execute(
+                """
+                INSERT OR IGNORE INTO webhook_events (provider, event_id, payload, next_attempt_at, received_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (provider, event_id, payload, now, now),
+            )
+            conn.commit()
+            return cur.rowcount == 1
+
+    def list_due_webhook_events(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Pending events whose next attempt is due, oldest first."""
+        with self._get_conn() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                """
+                SELECT * FROM webhook_events
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+                """,
+                (datetime.now().isoformat(), limit),
+            ).fetchall()
+            return [dict(r) for r in rows]
+
+    def finish_webhook_event(self, event_row_id: int, status: str, error: str = None):
+        """Mark an event done/failed."""
+        with self._get_conn() as conn:
+            conn.execute(
+                "UPDATE webhook_events SET status = ?, processed_at = ?, error = ? WHERE id = ?",
+                (status, datetime.now().isoformat(), error, event_row_id),
+            )
+            conn.commit()
+
+    def retry_webhook_event(self, event_row_id: int, delay_seconds: float, error: str):
+        with self._get_conn() as conn:
+            conn.execute(
+                """
+                UPDATE webhook_events SET attempts = attempts + 1, next_attempt_at = ?, error = ?
+                WHERE id = ?
+                """,
+                ((datetime.now() + timedelta(seconds=delay_seconds)).isoformat(), error, event_row_id),
+            )
+            conn.commit()
+
+    def prune_webhook_events(self, days: int = 30) -> int:
+        """Drop processed events older than `days` (duplicates are only expected within hours)."""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self._get_conn() as conn:
+            cur = conn.execute(
+                "DELETE FROM webhook_events WHERE status != 'pending' AND received_at < ?", (cutoff,)
+            )
+            conn.commit()
+            return cur.rowcount
+
+    def get_media_file_id(self, source_key: str) -> Optional[Dict[str, Any]]:
+        """Telegram file_id previously returned for this upstream file."""
+        with self._get_conn() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                "SELECT file_id, media_type FROM media_file_ids WHERE source_key = ?",
+                (source_key,),
+            ).fetchone()
+            return dict(row) if row else None
+
+    def save_media_file_id(self, source_key: str, file_id: str, media_type: str):
+        now = datetime.now().isoformat()
+        with self._get_conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO media_file_ids (source_key, file_id, media_type, created_at) VALUES (?, ?, ?, ?)",
+                (source_key, file_id, media_type, now),
+            )
+            conn.commit()
+
+    def forget_media_file_id(self, source_key: str):
+        with self._get_conn() as conn:
+            conn.execute("DELETE FROM media_file_ids WHERE source_key = ?", (source_key,))
+            conn.commit()
+
+    # --- Download jobs ---
+    # status: queued -> running -> done | failed; cancelled when stopped or superseded
+
+    def create_download_job(self, user_id: int, service: str, creator_id: str, name: str, offset: int,
+                            chat_id: int = None, message_id: int = None) -> int:
+        """Create a queued job; any unfinished job of the same user is cancelled (one page at a time)."""
+        now = datetime.now().isoformat()
+        with self._get_conn() as conn:
+            conn.execute(
+                "UPDATE download_jobs SET status = 'cancelled', updated_at = ? WHERE user_id = ? AND status IN ('queued', 'running')",
+                (now, user_id),
+            )
+            cur = conn.execute(
+                """
+                INSERT INTO download_jobs
+                    (user_id, service, creator_id, name, page_offset, status, chat_id, message_id, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?)
+                """,
+                (user_id, service, str(creator_id), name, int(offset), chat_id, message_id, now, now),
+            )
+            conn.commit()
+            return cur.lastrowid
+
+    def get_download_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._get_conn() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM download_jobs WHERE id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+
+    def get_last_download_job(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._get_conn() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                "SELECT * FROM download_jobs WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)
+            ).fetchone()
+            return dict(row) if row else None
+
+    def list_unfinished_download_jobs(self) -> List[Dict[str, Any]]:
+        with self._get_conn() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM download_jobs WHERE status IN ('queued', 'running') ORDER BY id"
+            ).fetchall()
+            return [dict(r) for r in rows]
+
+    def set_download_job_status(self, job_id: int, status: str, next_offset: int = None,
+                                only_if: tuple = None) -> bool:
+        """Update a job's status. With only_if, the change applies only from those states."""
+        now = datetime.now().isoformat()
+        sql = "UPDATE download_jobs SET status = ?, next_offset = COALESCE(?, next_offset), updated_at = ? WHERE id = ?"
+        params = [status, next_offset, now, job_id]
+        if only_if:
+            sql += f" AND status IN ({','.join('?' for _ in only_if)})"
+            params.extend(only_if)
+        with self._get_conn() as conn:
+            cur = conn.execute(sql, params)
+            if status in ("done", "cancelled", "failed"):
+                conn.execute("DELETE FROM download_job_items WHERE job_id = ?", (job_id,))
+            conn.commit()
+            return cur.rowcount > 0
+
+    def cancel_download_jobs(self, user_id: int) -> List[int]:
+        """Cancel the user's unfinished jobs; returns their ids."""
+        now = datetime.now().isoformat()
+        with self._get_conn() as conn:
+            ids = [r[0] for r in conn.execute(
+                "SELECT id FROM download_jobs WHERE user_id = ? AND status IN ('queued', 'running')", (user_id,)
+            ).fetchall()]
+            if ids:
+                conn.execute(
+                    f"UPDATE download_jobs SET status = 'cancelled', updated_at = ? WHERE id IN ({','.join('?' for _ in ids)})",
+                    [now, *ids],
+                )
+                conn.execute(
+                    f"DELETE FROM download_job_items WHERE job_id IN ({','.join('?' for _ in ids)})", ids
+                )
+            conn.commit()
+            return ids
+
+    def mark_download_job_items_sent(self, job_id: int, item_keys: List[str]):
+        if not item_keys:
+            return
+        with self._get_conn() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO download_job_items (job_id, item_key) VALUES (?, ?)",
+                [(job_id, k) for k in item_keys],
+            )
+            added = conn.total_changes - before
+            conn.execute(
+                "UPDATE download_jobs SET sent_count = sent_count + ?, updated_at = ? WHERE id = ?",
+                (added, datetime.now().isoformat(), job_id),
+            )
+            conn.commit()
+
+    def get_download_job_sent_keys(self, job_id: int) -> set:
+        with self._get_conn() as conn:
+            rows = conn.execute("SELECT item_key FROM download_job_items WHERE job_id = ?", (job_id,)).fetchall()
+            return {r[0] for r in rows}
+
+    @staticmethod
+    def _license_expiry(plan_type: str) -> Optional[str]:
+        """Expiry of a license bought now (None: lifetime)."""
         now = datetime.now()
-        expiry = None
-        
         if plan_type == 'weekly':
-            expiry = (now + timedelta(days=7)).isoformat()
-        elif plan_type == 'monthly':
-            expiry = (now + timedelta(days=30)).isoformat()
-        elif plan_type == 'lifetime':
-            expiry = None
-            
+            return (now + timedelta(days=7)).isoformat()
+        if plan_type == 'monthly':
+            return (now + timedelta(days=30)).isoformat()
+        return None
+
+    def activate_license(self, user_id: int, plan_type: str):
+        """Activate a license for a user"""
         self.update_user(
             user_id, 
             is_vip=1, 
             license_type=plan_type, 
-            license_expiry=expiry
+            license_expiry=self._license_expiry(plan_type)
         )
         logger.info(f"License {plan_type} activated for user {user_id}")
 
@@ -335,4 +905,65 @@ class UserDB:
         return pricing.get(lang, pricing['en'])
 
 # Global instance
-user_db = UserDB()
\ No newline at end of file
+user_db = UserDB()
+
+
+class AsyncUserDB:
+    """Awaitable facade over UserDB for the event loop.
+
+    Every call runs on one dedicated DB thread, with that thread's long-lived
+    connection, so a slow disk (e.g. the /data volume) never stalls polling or
+    webhooks. Calls are serialized in submission order.
+
+    Usage: `await async_user_db.get_user(user_id)` (same methods as UserDB).
+    """
+
+    def __init__(self, db: UserDB):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="userdb")
+        self._methods: Dict[str, Any] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def __getattr__(self, name: str):
+        method = getattr(self.db, name)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError(name)
+        wrapper = self._methods.get(name)
+        if wrapper is None:
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+            self._methods[name] = wrapper
+        return wrapper
+
+    def start(self, interval: float = None):
+        """Flush buffered activity (last_seen) every `interval` seconds (ACTIVITY_FLUSH_SECONDS)."""
+        if self._flusher is None or self._flusher.done():
+            interval = max(0.1, interval or _env_float("ACTIVITY_FLUSH_SECONDS", 5.0))
+            self._flusher = asyncio.create_task(self._flush_loop(interval), name="userdb-activity-flush")
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_activity()
+            except Exception as e:
+                logger.warning(f"Activity flush failed (will retry): {e}")
+
+    async def close(self):
+        """Write pending activity, close the DB thread's connection and stop the thread."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self.db.flush_activity)
+        except Exception as e:
+            logger.warning(f"Final activity flush failed: {e}")
+        await loop.run_in_executor(self._executor, self.db.close)
+        self._executor.shutdown(wait=True)
+
+
+async_user_db = AsyncUserDB(user_db)
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Webhook inbox module
+Verified gateway webhooks are stored and acknowledged at once; a background worker applies them
+"""
+
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.users_db import async_user_db
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+@dataclass
+class InboxStats:
+    received: int = 0
+    duplicates: int = 0  # gateway retries of an event already in the inbox
+    applied: int = 0
+    retried: int = 0
+    failed: int = 0  # gave up after WEBHOOK_MAX_ATTEMPTS
+    ack_p50_ms: float = 0.0
+    ack_p99_ms: float = 0.0
+
+    @property
+    def duplicate_rate(self) -> float:
+        return (self.duplicates / self.received) if self.received else 0.0
+
+
+# apply(payload): performs the side effects of one event; raising schedules a retry
+EventApplier = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class WebhookInbox:
+    """Inbox in front of the payment webhooks (webhook_events table).
+
+    - receive() stores the raw, already verified payload under UNIQUE(provider, event_id);
+      the HTTP handler answers 200 right after, so gateways never time out on our side work.
+      A redelivered event hits the unique key and is counted as a duplicate.
+    - One worker applies due events in arrival order. A failing event is retried with
+      exponential backoff (5s, 10s, ... up to 10 min) and marked 'failed' after
+      WEBHOOK_MAX_ATTEMPTS attempts.
+    - Events left pending by the previous process are applied on start().
+    """
+
+    def __init__(self, db=None):
+        self.db = db or async_user_db
+        self.poll_seconds = max(0.5, _env_float("WEBHOOK_POLL_SECONDS", 5.0))
+        self.max_attempts = max(1, _env_int("WEBHOOK_MAX_ATTEMPTS", 8))
+        self.stats = InboxStats()
+        self._appliers: Dict[str, EventApplier] = {}
+        self._ack_ms = deque(maxlen=1000)
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def register(self, provider: str, apply: EventApplier):
+        self._appliers[provider] = apply
+
+    async def receive(self, provider: str, event_id: str, payload: str) -> bool:
+        """Store a verified event. Returns False for a duplicate."""
+        self.stats.received += 1
+        if not await self.db.insert_webhook_event(provider, event_id, payload):
+            self.stats.duplicates += 1
+            return False
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def record_ack(self, elapsed_ms: float):
+        """Response time of one webhook request (window of the last 1000)."""
+        self._ack_ms.append(elapsed_ms)
+        ordered = sorted(self._ack_ms)
+        self.stats.ack_p50_ms = round(ordered[len(ordered) // 2], 2)
+        self.stats.ack_p99_ms = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 2)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop(), name="webhook-inbox")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Apply every due event. Returns how many were applied."""
+        applied = 0
+        while True:
+            # Retried events move to a later next_attempt_at, so this drains.
+            batch = await self.db.list_due_webhook_events()
+            if not batch:
+                return applied
+            applied += await self._apply_batch(batch)
+
+    async def _apply_batch(self, batch) -> int:
+        applied = 0
+        for event in batch:
+            apply = self._appliers.get(event["provider"])
+            try:
+                if apply is None:
+                    raise RuntimeError(f"no handler for provider {event['provider']}")
+                await apply(json.loads(event["payload"]))
+            except asyncio.CancelledError:
+                raise  # shutdown: the event stays pending and is applied on the next start
+            except Exception as e:
+                attempts = int(event["attempts"]) + 1
+                logger.warning(f"Webhook event {event['provider']}/{event['event_id']} failed (attempt {attempts}): {e}")
+                if attempts >= self.max_attempts:
+                    await self.db.finish_webhook_event(event["id"], "failed", error=str(e))
+                    self.stats.failed += 1
+                else:
+                    await self.db.retry_webhook_event(event["id"], min(5.0 * 2 ** (attempts - 1), 600.0), str(e))
+                    self.stats.retried += 1
+                continue
+            await self.db.finish_webhook_event(event["id"], "done")
+            self.stats.applied += 1
+            applied += 1
+        return applied
+
+    async def _loop(self):
+        try:
+            await self.db.prune_webhook_events()
+        except Exception as e:
+            logger.warning(f"Webhook inbox prune failed: {e}")
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning(f"Webhook inbox pass failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Global instance
+webhook_inbox = WebhookInbox()
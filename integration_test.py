@@ -4,13 +4,37 @@ Covers:
 - Telegram UI helper safe_edit_or_send fallback
 - Pagination next offset computation
 - Uploader: no parse_mode for media captions, handles special chars, skips empty/oversize
-- DB: user creation, GOD toggle, VIP flag evaluation
+- DB: user creation, GOD toggle, VIP flag evaluation; reused WAL connection; LRU user-row cache with write-through (dropped when the commit fails);
+  atomic credit/preview/referral updates and daily preview limit under concurrent callers; async facade runs every call on one DB thread;
+  last_seen buffered in memory and flushed in batches (and at shutdown)
+- Catalog: single shared load, stale snapshot served when a refresh fails, warm start from disk, O(1) lookup by (service, id)
+- Name index: identical top-10 results to the legacy linear scan
+- Fuzzy index: identical results to SmartSearch.find_similar
+- HTTP pool: fetchers borrow one session; connection reuse is counted
+- Payment clients: Asaas/NOWPayments on the shared pool with a per-call deadline, Stripe SDK off the loop;
+  one client per provider reused across payments, with per-provider latency/error stats
+- Payment reconciler: pending payments settled in the background once, with age backoff and manual nudges
+  (a nudged payment outside the scan window is looked up directly); flip to paid and activation commit together
+- Webhook inbox: events stored once per event id (duplicates counted), applied off the request, retried with backoff
+- Telegram webhook: updates accepted only with the secret token and fed to the Application's update queue
+- Posts page cache: concurrent identical pages share one upstream call, TTL expiry, LRU bound, failures not cached
+- Prefetch: next page's media is reused by the download loop; cancel removes unused files;
+  idle users are swept and unused files are capped in total
+- file_id cache: first upload stores Telegram's file_id, later sends reuse it, stale ids fall back to upload
+- Albums: one send_media_group per 10 items (cached file_ids included), single sends only after a rejected album
+- Telegram rate limiter: per-chat and global token buckets, RetryAfter pauses the chat and lowers the rate,
+  UI sends overtake queued bulk sends, aging prevents starvation
+- Download pipeline: uploads keep page order, downloads overlap uploads, cancellation deletes pending files;
+  the same file listed twice, or fetched by two users' jobs, downloads to separate paths
+- Download jobs: a page interrupted by a restart resumes and skips items already sent; a new page supersedes the old job;
+  dlstop cancels the running page and reports exactly how many items were sent
 
 Usage:
   python integration_test.py
 """
 
 import asyncio
+import json
 import logging
 import os
 import tempfile
@@ -87,6 +111,11 @@ def _prepare_env(tmp_db: str):
     os.environ.setdefault("TELEGRAM_MAX_UPLOAD_MB", "1")
 
 
+# Importing app.users_db creates the global UserDB: point it at a temp file before any test
+# imports it, also under pytest (where the __main__ block below does not run).
+_prepare_env(os.path.join(tempfile.gettempdir(), "bot_integration_test.db"))
+
+
 class TestTelegramHelpers(unittest.IsolatedAsyncioTestCase):
     async def test_safe_edit_or_send_fallback(self):
         from telegram.error import BadRequest
@@ -168,6 +197,1051 @@ class TestUploader(unittest.IsolatedAsyncioTestCase):
         self.assertGreaterEqual(uploader.stats.skipped_large, 1)
 
 
+class TestCreatorCatalog(unittest.IsolatedAsyncioTestCase):
+    async def test_loads_once_and_serves_stale_on_failure(self):
+        from app.catalog import CreatorCatalog
+
+        catalog = CreatorCatalog(ttl_seconds=3600, snapshot_path=None)
+        calls = []
+
+        async def fake_download():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [{"id": "1", "service": "onlyfans", "name": "Belle Delphine"}]
+
+        catalog._download = fake_download
+        results = await asyncio.gather(*(catalog.get_creators() for _ in range(5)))
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r and r[0]["id"] == "1" for r in results))
+
+        # A failing refresh must keep the previous snapshot.
+        async def failing_download():
+            raise RuntimeError("upstream down")
+
+        catalog._download = failing_download
+        self.assertFalse(await catalog.refresh())
+        creators = await catalog.get_creators()
+        self.assertEqual(creators[0]["name"], "Belle Delphine")
+        self.assertEqual(catalog.stats.refresh_errors, 1)
+
+    async def test_get_creator_by_service_and_id(self):
+        from app.catalog import CreatorCatalog
+
+        catalog = CreatorCatalog(ttl_seconds=3600, snapshot_path=None)
+
+        async def fake_download():
+            return [
+                {"id": 7, "service": "onlyfans", "name": "first"},
+                {"id": "7", "service": "fansly", "name": "other service"},
+                {"id": "7", "service": "onlyfans", "name": "duplicate"},
+            ]
+
+        catalog._download = fake_download
+        self.assertEqual((await catalog.get_creator("onlyfans", "7"))["name"], "first")
+        self.assertEqual((await catalog.get_creator("fansly", 7))["name"], "other service")
+        self.assertIsNone(await catalog.get_creator("onlyfans", "8"))
+
+    async def test_warm_start_from_disk_snapshot(self):
+        from app.catalog import CreatorCatalog
+
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        os.remove(path)
+        creators = [
+            {"id": "1", "service": "onlyfans", "name": "a_b", "favorited": 3},
+            {"id": "2", "service": "fansly", "name": "c"},  # missing key must stay missing
+        ]
+
+        first = CreatorCatalog(ttl_seconds=3600, snapshot_path=path)
+
+        async def fake_download():
+            return creators
+
+        first._download = fake_download
+        self.assertTrue(await first.refresh())
+        self.assertTrue(os.path.exists(path))
+
+        second = CreatorCatalog(ttl_seconds=3600, snapshot_path=path)
+
+        async def must_not_download():
+            raise AssertionError("warm start must not hit upstream")
+
+        second._download = must_not_download
+        self.assertEqual(await second.get_creators(), creators)
+        self.assertEqual(second.stats.ready_source, "disk")
+        os.remove(path)
+
+
+class TestNameIndex(unittest.TestCase):
+    @staticmethod
+    def _legacy_find(model_name, creators):
+        # Reference: the per-query scan MediaFetcher.find_all_matching_creators used to do.
+        import re
+        search_normalized = re.sub(r'[\s_-]+', '', model_name.lower().strip())
+        matches = []
+        for creator in creators:
+            name_normalized = re.sub(r'[\s_-]+', '', creator.get('name', '').lower())
+            if (search_normalized == name_normalized or
+                    search_normalized in name_normalized or
+                    name_normalized in search_normalized):
+                matches.append(creator)
+        matches.sort(key=lambda c: len(c.get('name', '')))
+        return matches[:10]
+
+    def test_same_results_as_linear_scan(self):
+        import random
+        import string
+        from app.catalog import NameIndex
+
+        rnd = random.Random(3)
+        alphabet = "abcde_- "
+        creators = [
+            {"id": str(i), "service": "onlyfans", "name": "".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 9)))}
+            for i in range(3000)
+        ]
+        creators.append({"id": "x", "service": "fansly", "name": "Belle Delphine"})
+        index = NameIndex(creators)
+
+        queries = ["belle delphine", "Belle_Delphine", "", "a", "ab", "abc", "a-b c", "zzz", "bellexyz"]
+        queries += ["".join(rnd.choice(alphabet + string.ascii_lowercase) for _ in range(rnd.randint(1, 12))) for _ in range(200)]
+        for q in queries:
+            self.assertEqual(index.find(q), self._legacy_find(q, creators), q)
+
+        # Results are copies: tagging them does not change the shared catalog.
+        index.find("belle delphine")[0]["source"] = "coomer"
+        self.assertNotIn("source", creators[-1])
+
+
+class TestFuzzyIndex(unittest.IsolatedAsyncioTestCase):
+    async def test_same_results_as_find_similar(self):
+        import random
+        from app.catalog import CatalogSnapshot
+        from app.smart_search import SmartSearch, FuzzyIndex
+
+        rnd = random.Random(5)
+        words = ["belle", "delphine", "sophie", "rain", "hanna", "owo", "x", "ab"]
+        creators = [
+            {"id": str(i), "service": "onlyfans", "name": " ".join(rnd.choice(words) for _ in range(rnd.randint(1, 3)))}
+            for i in range(2000)
+        ]
+        creators.append({"id": "none", "service": "onlyfans", "name": None})
+        index = FuzzyIndex(creators)
+
+        queries = ["beledelphine", "delphine belle", "rain sophie", "x", "", "hannaowo", "ab ab ab ab ab"]
+        for q in queries:
+            for threshold in (0.0, 60.0, 85.0, 100.0):
+                self.assertEqual(
+                    index.search(q, limit=8, threshold=threshold),
+                    SmartSearch.find_similar(q, creators, limit=8, threshold=threshold),
+                    (q, threshold),
+                )
+
+        snapshot = CatalogSnapshot(creators)
+        matches = await SmartSearch.find_similar_async("delphine belle", snapshot)
+        self.assertEqual(matches, SmartSearch.find_similar("delphine belle", creators))
+
+
+class TestHttpPool(unittest.IsolatedAsyncioTestCase):
+    async def test_shared_session_reuses_connections(self):
+        from aiohttp import web
+        from app.http_pool import HttpPool
+        import app.fetcher as fetcher_mod
+
+        async def ok(_request):
+            return web.json_response([])
+
+        web_app = web.Application()
+        web_app.add_routes([web.get("/ping", ok)])
+        runner = web.AppRunner(web_app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        pool = HttpPool()
+        original_pool = fetcher_mod.http_pool
+        fetcher_mod.http_pool = pool
+        try:
+            await pool.start()
+            for _ in range(3):
+                async with fetcher_mod.MediaFetcher() as fetcher:
+                    self.assertIs(fetcher.session, pool.session)
+                    async with fetcher.session.get(f"http://127.0.0.1:{port}/ping") as resp:
+                        await resp.read()
+            # Fetchers must not close the shared session.
+            self.assertTrue(pool.is_open)
+            self.assertEqual(pool.stats.requests, 3)
+            self.assertEqual(pool.stats.connections_created, 1)
+            self.assertEqual(pool.stats.connections_reused, 2)
+        finally:
+            fetcher_mod.http_pool = original_pool
+            await pool.close()
+            await runner.cleanup()
+
+
+class TestPaymentClients(unittest.IsolatedAsyncioTestCase):
+    async def test_gateway_calls_do_not_block_the_loop(self):
+        import threading
+        import time
+        from aiohttp import web
+        import app.payments as payments_mod
+        from app.http_pool import HttpPool
+
+        async def np_create(request):
+            body = await request.json()
+            self.assertEqual(request.headers.get("x-api-key"), "np_x")
+            return web.json_response({"payment_id": "p1", "invoice_url": f"https://pay/{body['order_id']}"})
+
+        async def np_get(_request):
+            return web.json_response({"pay_address": "addr", "pay_amount": "1.5", "pay_currency": "xmr"})
+
+        async def asaas_slow(_request):
+            await asyncio.sleep(3)
+            return web.json_response({"status": "RECEIVED"})
+
+        web_app = web.Application()
+        web_app.add_routes([
+            web.post("/v1/payment", np_create),
+            web.get("/v1/payment/p1", np_get),
+            web.get("/v3/payments/slow", asaas_slow),
+        ])
+        runner = web.AppRunner(web_app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+        env = {
+            "NOWPAYMENTS_API_KEY": "np_x", "NOWPAYMENTS_BASE_URL": base,
+            "ASAAS_ACCESS_TOKEN": "asaas_x", "ASAAS_BASE_URL": base,
+            "PAYMENT_API_TIMEOUT_SECONDS": "1",
+        }
+        saved = {k: os.environ.get(k) for k in env}
+        os.environ.update(env)
+        pool = HttpPool()
+        original_pool = payments_mod.http_pool
+        original_stripe = payments_mod.StripeClient
+        payments_mod.http_pool = pool
+
+        built_on = []
+
+        class BlockingStripe:
+            def __init__(self):
+                built_on.append(threading.current_thread().name)  # the real one imports the SDK
+
+            def create_checkout_session(self, **kwargs):
+                time.sleep(0.3)  # the real SDK blocks on HTTP
+                return payments_mod.PaymentCreateResult("stripe", "cs_1", kwargs["amount"], kwargs["currency"])
+
+        payments_mod.StripeClient = BlockingStripe
+        registry = payments_mod.PaymentProviderRegistry()
+        original_registry = payments_mod.payment_providers
+        payments_mod.payment_providers = registry
+
+        gaps = []
+
+        async def ticker():
+            while True:
+                t = time.monotonic()
+                await asyncio.sleep(0.01)
+                gaps.append(time.monotonic() - t)
+
+        tick = asyncio.create_task(ticker())
+        try:
+            payment = await payments_mod.create_payment_explicit(
+                provider="nowpayments", user_id=1, plan="monthly", lang="en", amount=10.0, currency="USD", base_url="https://bot",
+            )
+            self.assertEqual((payment.external_id, payment.checkout_url), ("p1", "https://pay/tg:1:monthly"))
+            self.assertEqual((payment.crypto_pay_address, payment.crypto_pay_amount), ("addr", 1.5))
+            self.assertIs(pool.session, payments_mod.http_pool.session)
+
+            # Second payment: same client, warm connection.
+            await payments_mod.create_payment_explicit(
+                provider="nowpayments", user_id=2, plan="monthly", lang="en", amount=10.0, currency="USD", base_url="https://bot",
+            )
+            self.assertIs(registry.nowpayments(), registry.nowpayments())
+            self.assertEqual(registry.stats["nowpayments"].clients_built, 1)
+            self.assertEqual(registry.stats["nowpayments"].calls, 4)
+            self.assertGreater(pool.stats.connections_reused, 0)
+
+            t0 = time.monotonic()
+            with self.assertRaises(RuntimeError):
+                await registry.asaas().get_payment_status("slow")
+            self.assertLess(time.monotonic() - t0, 2.5)  # per-call deadline
+            self.assertEqual((registry.stats["asaas"].timeouts, registry.stats["asaas"].consecutive_errors), (1, 1))
+
+            # Stripe not configured: the caller gets the error, the gateway stats stay clean.
+            def unconfigured_stripe():
+                raise ValueError("STRIPE_SECRET_KEY is not set")
+
+            payments_mod.StripeClient = unconfigured_stripe
+            with self.assertRaises(ValueError):
+                await registry.run_stripe(lambda client: client.create_checkout_session())
+            self.assertEqual(registry.stats["stripe"].calls, 0)
+            payments_mod.StripeClient = BlockingStripe
+
+            stripe_payment = await payments_mod.create_payment_explicit(
+                provider="stripe", user_id=1, plan="monthly", lang="en", amount=10.0, currency="USD", base_url="https://bot",
+            )
+            self.assertEqual(stripe_payment.external_id, "cs_1")
+            self.assertEqual(len(built_on), 1)
+            self.assertTrue(built_on[0].startswith("stripe"), built_on)
+            self.assertEqual(registry.stats["stripe"].calls, 1)
+            self.assertTrue(registry.snapshot()["stripe"]["healthy"])
+            self.assertLess(max(gaps), 0.2)  # the loop kept ticking through every call
+        finally:
+            tick.cancel()
+            payments_mod.http_pool = original_pool
+            payments_mod.StripeClient = original_stripe
+            payments_mod.payment_providers = original_registry
+            await registry.close()
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            await pool.close()
+            await runner.cleanup()
+
+
+class TestPaymentReconciler(unittest.IsolatedAsyncioTestCase):
+    async def test_pending_payments_settled_once_with_backoff(self):
+        import sqlite3
+        from app.reconciler import PaymentReconciler
+        from app.users_db import AsyncUserDB, UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "pay.db"))
+            adb = AsyncUserDB(db)
+            for i, provider in enumerate(("nowpayments", "nowpayments", "asaas")):
+                db.create_pending_payment(user_id=10 + i, provider=provider, external_id=f"ext{i}",
+                                          amount=10.0, currency="USD", plan_type="monthly")
+            paid_at_gateway = {"ext0"}
+            calls = []
+            notified = []
+
+            async def check(provider, external_id):
+                calls.append(external_id)
+                await asyncio.sleep(0.01)
+                return external_id in paid_at_gateway, {"payment_status": "finished"}
+
+            async def notify(user_id, plan_type, provider):
+                notified.append((user_id, plan_type, provider))
+
+            reconciler = PaymentReconciler(db=adb, check=check, checkable=lambda p, e: p != "asaas")
+            reconciler._notify = notify
+            self.assertEqual(await reconciler.run_once(), 1)
+            self.assertEqual(sorted(calls), ["ext0", "ext1"])  # asaas link rows are not queryable
+            self.assertEqual(notified, [(10, "monthly", "nowpayments")])
+            self.assertTrue(db.is_payment_already_paid("nowpayments", "ext0"))
+            self.assertTrue(db.is_license_active(10))
+
+            # Backoff: nothing is due again right away...
+            calls.clear()
+            await reconciler.run_once()
+            self.assertEqual(calls, [])
+            # ...unless the user presses "check payment".
+            reconciler._last_checked[("nowpayments", "ext1")] -= 60
+            reconciler.nudge("nowpayments", "ext1")
+            paid_at_gateway.add("ext1")
+            self.assertEqual(await reconciler.run_once(), 1)
+            self.assertEqual(calls, ["ext1"])
+
+            # A webhook that arrives afterwards does not activate/notify again.
+            self.assertIsNone(db.settle_pending_payment("nowpayments", "ext1"))
+            self.assertEqual(len(notified), 2)
+
+            # Too old for the scan: only a nudge gets it checked.
+            db.create_pending_payment(user_id=20, provider="nowpayments", external_id="old",
+                                      amount=10.0, currency="USD", plan_type="weekly")
+            with db._get_conn() as conn:
+                conn.execute("UPDATE payments SET created_at = '2000-01-01T00:00:00' WHERE external_id = 'old'")
+                conn.commit()
+            paid_at_gateway.add("old")
+            calls.clear()
+            self.assertEqual(await reconciler.run_once(), 0)
+            reconciler.nudge("nowpayments", "old")
+            self.assertEqual(await reconciler.run_once(), 1)
+            self.assertEqual(calls, ["old"])
+            self.assertTrue(db.is_license_active(20))
+
+            # The activation fails after the flip: both roll back, and the retry completes it.
+            db.create_pending_payment(user_id=21, provider="nowpayments", external_id="retry",
+                                      amount=10.0, currency="USD", plan_type="monthly")
+
+            def broken_expiry(plan_type):
+                raise sqlite3.OperationalError("disk I/O error")
+
+            db._license_expiry = broken_expiry
+            with self.assertRaises(sqlite3.OperationalError):
+                db.settle_pending_payment("nowpayments", "retry")
+            del db._license_expiry
+            self.assertEqual(db.get_payment_by_external_id("nowpayments", "retry")["status"], "pending")
+            self.assertFalse(db.is_license_active(21))
+            self.assertEqual(db.settle_pending_payment("nowpayments", "retry"), {"user_id": 21, "plan_type": "monthly"})
+            self.assertTrue(db.is_license_active(21))
+            await adb.close()
+
+
+class TestWebhookInbox(unittest.IsolatedAsyncioTestCase):
+    async def test_dedup_apply_and_retry(self):
+        from app.users_db import AsyncUserDB, UserDB
+        from app.webhook_inbox import WebhookInbox
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "inbox.db"))
+            adb = AsyncUserDB(db)
+            inbox = WebhookInbox(db=adb)
+            applied = []
+            failures = {"boom": 1}
+
+            async def apply(payload):
+                if failures.get(payload["id"]):
+                    failures[payload["id"]] -= 1
+                    raise RuntimeError("telegram down")
+                applied.append(payload["id"])
+
+            inbox.register("nowpayments", apply)
+            self.assertTrue(await inbox.receive("nowpayments", "p1:finished", json.dumps({"id": "p1"})))
+            # Gateway redelivery of the same event: acknowledged, not stored again.
+            self.assertFalse(await inbox.receive("nowpayments", "p1:finished", json.dumps({"id": "p1"})))
+            self.assertTrue(await inbox.receive("nowpayments", "boom:finished", json.dumps({"id": "boom"})))
+            self.assertTrue(await inbox.receive("stripe", "evt_1", json.dumps({"id": "evt_1"})))
+            self.assertEqual(inbox.stats.duplicates, 1)
+            self.assertAlmostEqual(inbox.stats.duplicate_rate, 0.25)
+
+            # Nothing is applied until the worker runs (the request only stores the event).
+            self.assertEqual(applied, [])
+            inbox.max_attempts = 2
+            self.assertEqual(await inbox.run_once(), 1)
+            self.assertEqual(applied, ["p1"])
+            self.assertEqual(inbox.stats.retried, 2)  # "boom" failed once, "stripe" has no handler
+
+            # Retries are scheduled in the future; once due, "boom" succeeds and "stripe" gives up.
+            with db._get_conn() as conn:
+                conn.execute("UPDATE webhook_events SET next_attempt_at = '2000-01-01'")
+            self.assertEqual(await inbox.run_once(), 1)
+            self.assertEqual(applied, ["p1", "boom"])
+            self.assertEqual(inbox.stats.failed, 1)
+            self.assertEqual(await inbox.run_once(), 0)
+
+            inbox.record_ack(1.0)
+            inbox.record_ack(3.0)
+            self.assertEqual(inbox.stats.ack_p99_ms, 3.0)
+            await adb.close()
+
+
+class TestTelegramWebhook(unittest.IsolatedAsyncioTestCase):
+    async def test_secret_token_and_update_queue(self):
+        import aiohttp
+        from aiohttp import web
+        from app.telegram_webhook import SECRET_HEADER, WEBHOOK_PATH, TelegramWebhook
+        from types import SimpleNamespace
+
+        hook = TelegramWebhook()
+        hook.secret = "s3cret"
+        application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+        web_app = web.Application()
+        web_app.add_routes([web.post(WEBHOOK_PATH, hook.handle)])
+        runner = web.AppRunner(web_app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{WEBHOOK_PATH}"
+        update = {"update_id": 7, "message": {"message_id": 1, "date": 0, "text": "hi",
+                                              "chat": {"id": 5, "type": "private"}}}
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json=update, headers={SECRET_HEADER: "s3cret"}) as r:
+                    self.assertEqual(r.status, 503)  # not attached yet: Telegram redelivers later
+                hook.attach(application)
+                async with session.post(url, json=update, headers={SECRET_HEADER: "wrong"}) as r:
+                    self.assertEqual(r.status, 403)
+                async with session.post(url, json=update) as r:
+                    self.assertEqual(r.status, 403)
+                async with session.post(url, json=update, headers={SECRET_HEADER: "s3cret"}) as r:
+                    self.assertEqual(r.status, 200)
+                async with session.post(url, data=b"nope", headers={SECRET_HEADER: "s3cret"}) as r:
+                    self.assertEqual(r.status, 400)
+            queued = application.update_queue.get_nowait()
+            self.assertEqual((queued.update_id, queued.message.text), (7, "hi"))
+            self.assertTrue(application.update_queue.empty())
+            self.assertEqual((hook.stats.received, hook.stats.rejected, hook.stats.invalid), (1, 2, 1))
+
+            # Re-registering on a redeploy keeps what Telegram is still holding.
+            bot = AsyncMock()
+            await hook.register(bot)
+            self.assertFalse(bot.set_webhook.await_args.kwargs["drop_pending_updates"])
+        finally:
+            await runner.cleanup()
+
+
+class TestPostsPageCache(unittest.IsolatedAsyncioTestCase):
+    async def test_single_flight_ttl_and_lru(self):
+        from app.ttl_cache import AsyncTTLCache
+
+        cache = AsyncTTLCache(ttl=60, max_entries=2, cacheable=lambda v: isinstance(v, list))
+        calls = []
+
+        async def loader(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return [{"id": key}]
+
+        results = await asyncio.gather(*(cache.get_or_load("a", lambda: loader("a")) for _ in range(5)))
+        self.assertEqual(calls, ["a"])
+        self.assertTrue(all(r == [{"id": "a"}] for r in results))
+        self.assertEqual(cache.stats.deduplicated, 4)
+
+        await cache.get_or_load("a", lambda: loader("a"))
+        self.assertEqual(cache.stats.hits, 1)
+
+        # LRU: "a" was used last, so adding "c" evicts "b"
+        await cache.get_or_load("b", lambda: loader("b"))
+        await cache.get_or_load("a", lambda: loader("a"))
+        await cache.get_or_load("c", lambda: loader("c"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats.evictions, 1)
+
+        # TTL expiry triggers a new load
+        cache.ttl = 0
+        cache.put("a", [{"id": "old"}])
+        await cache.get_or_load("a", lambda: loader("a"))
+        self.assertEqual(calls, ["a", "b", "c", "a"])
+
+    async def test_failed_pages_are_not_cached(self):
+        from app.ttl_cache import AsyncTTLCache
+
+        cache = AsyncTTLCache(ttl=60, cacheable=lambda v: isinstance(v, list))
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            return None
+
+        self.assertIsNone(await cache.get_or_load("k", failing))
+        self.assertIsNone(await cache.get_or_load("k", failing))
+        self.assertEqual(calls, 2)
+        self.assertEqual(len(cache), 0)
+
+    async def test_fetcher_builds_fresh_items_from_cached_page(self):
+        import app.fetcher as fetcher_mod
+        from app.ttl_cache import AsyncTTLCache
+
+        original_cache = fetcher_mod.posts_page_cache
+        fetcher_mod.posts_page_cache = AsyncTTLCache(ttl=60, cacheable=lambda v: isinstance(v, list))
+        try:
+            fetcher = fetcher_mod.MediaFetcher()
+            page = [{"id": 1, "file": {"path": "/a/b.jpg", "name": "b.jpg"}, "attachments": [{"path": "/c.mp4"}]}]
+            fetcher._download_posts_page = AsyncMock(return_value=page)
+            creator = {"service": "onlyfans", "id": "99"}
+
+            first = await fetcher.fetch_posts_page(creator, offset=0)
+            second = await fetcher.fetch_posts_page(creator, offset=0)
+            fetcher._download_posts_page.assert_awaited_once()
+            self.assertEqual([m.media_type for m in first["media_items"]], ["photo", "video"])
+            self.assertIsNot(first["media_items"][0], second["media_items"][0])
+        finally:
+            fetcher_mod.posts_page_cache = original_cache
+
+
+class TestPrefetch(unittest.IsolatedAsyncioTestCase):
+    def _fake_fetcher(self, tmpdir, downloads):
+        from app.fetcher import MediaItem
+
+        class FakeFetcher:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return None
+
+            async def fetch_posts_page(self, creator, offset=0):
+                items = [MediaItem(f"https://x/{offset}_{i}.jpg", f"{i}.jpg", "photo", str(offset)) for i in range(4)]
+                return {"posts": [{"id": offset}], "media_items": items}
+
+            async def download_media(self, item):
+                downloads.append(item.url)
+                item.local_path = os.path.join(tmpdir, f"{item.post_id}_{item.filename}")
+                with open(item.local_path, "wb") as f:
+                    f.write(b"x" * 10)
+                return True
+
+        return FakeFetcher
+
+    async def test_prefetched_media_is_used_then_cancel_cleans_up(self):
+        import app.prefetch as prefetch_mod
+        from app.fetcher import MediaItem
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            downloads = []
+            original = (prefetch_mod.MediaFetcher, prefetch_mod.DOWNLOAD_DIR)
+            prefetch_mod.MediaFetcher = self._fake_fetcher(tmpdir, downloads)
+            prefetch_mod.DOWNLOAD_DIR = tmpdir
+            try:
+                p = prefetch_mod.Prefetcher()
+                p.enabled, p.media_count, p.max_bytes = True, 2, 1024
+                creator = {"service": "onlyfans", "id": "1"}
+                p.schedule(7, creator, 50)
+
+                item = MediaItem("https://x/50_0.jpg", "0.jpg", "photo", "50")
+                self.assertTrue(await p.take(7, item, 50))
+                self.assertTrue(os.path.exists(item.local_path))
+                await asyncio.gather(*p._users[7].tasks)
+                self.assertEqual(len(downloads), 2)
+                self.assertFalse(await p.take(7, MediaItem("https://x/50_3.jpg", "3.jpg")))
+
+                # One prefetched file left unused: cancel deletes it.
+                p.cancel(7)
+                self.assertEqual(p.stats.media_discarded, 1)
+                self.assertEqual(sorted(os.listdir(tmpdir)), [os.path.basename(item.local_path)])
+            finally:
+                prefetch_mod.MediaFetcher, prefetch_mod.DOWNLOAD_DIR = original
+
+    async def test_idle_users_expire_and_total_cap(self):
+        import app.prefetch as prefetch_mod
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            downloads = []
+            original = (prefetch_mod.MediaFetcher, prefetch_mod.DOWNLOAD_DIR)
+            prefetch_mod.MediaFetcher = self._fake_fetcher(tmpdir, downloads)
+            prefetch_mod.DOWNLOAD_DIR = tmpdir
+            try:
+                p = prefetch_mod.Prefetcher()
+                p.enabled, p.media_count, p.max_bytes = True, 2, 1024
+                p.total_max_bytes = 15  # room for one 10-byte file across all users
+                p.schedule(1, {"service": "onlyfans", "id": "1"}, 50)
+                await asyncio.gather(*p._users[1].tasks)
+                p.schedule(2, {"service": "onlyfans", "id": "2"}, 50)
+                await asyncio.gather(*p._users[2].tasks)
+                self.assertEqual(len(downloads), 2)  # user 1 filled the cap, user 2 got nothing
+                self.assertEqual(p.stats.skipped_over_cap, 2)
+                self.assertEqual(p.stats.bytes_held, 20)
+
+                # User 1 goes idle: the sweep deletes their files and frees the cap.
+                p._users[1].last_touch -= p.idle_seconds + 1
+                self.assertEqual(p.sweep(), 1)
+                self.assertEqual((p.stats.expired, p.stats.bytes_held), (1, 0))
+                self.assertEqual(os.listdir(tmpdir), [])
+                self.assertIn(2, p._users)
+            finally:
+                prefetch_mod.MediaFetcher, prefetch_mod.DOWNLOAD_DIR = original
+
+
+class TestFileIdCache(unittest.IsolatedAsyncioTestCase):
+    async def test_upload_once_then_resend_by_file_id(self):
+        from unittest.mock import MagicMock
+        from app.fetcher import MediaItem
+        from app.uploader import TelegramUploader
+        from app.users_db import AsyncUserDB, UserDB
+
+        os.environ["TELEGRAM_MAX_UPLOAD_MB"] = "49"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "cache.db"))
+            bot = AsyncMock()
+            sent_msg = MagicMock(message_id=1, video=None, animation=None)
+            sent_msg.photo = [MagicMock(file_id="small"), MagicMock(file_id="AgACFILEID")]
+            bot.send_photo.return_value = sent_msg
+            uploader = TelegramUploader(bot, file_cache=AsyncUserDB(db))
+
+            def make_item():
+                item = MediaItem("https://coomer.st/data/ab/cd/abcd1234.jpg", "a.jpg", "photo", "p1")
+                self.assertEqual(item.source_key, "/ab/cd/abcd1234.jpg")
+                return item
+
+            first = make_item()
+            self.assertIsNone(await uploader.cached_file_id(first))
+            first.local_path = os.path.join(tmpdir, "a.jpg")
+            with open(first.local_path, "wb") as f:
+                f.write(b"123")
+            self.assertTrue(await uploader.upload_and_cleanup(first, 10, caption="x"))
+            self.assertEqual(await uploader.cached_file_id(first), "AgACFILEID")
+
+            # Another user, same upstream file: no local file needed.
+            second = make_item()
+            self.assertTrue(await uploader.upload_and_cleanup(second, 20, caption="y"))
+            _, kwargs = bot.send_photo.await_args
+            self.assertEqual(kwargs["photo"], "AgACFILEID")
+            self.assertEqual(uploader.stats.file_id_hits, 1)
+
+            # Flood wait outlasting the retries: the id is still valid and is kept.
+            from telegram.error import BadRequest, RetryAfter
+            uploader.limiter = MagicMock(acquire=AsyncMock())
+            bot.send_photo.side_effect = RetryAfter(1)
+            self.assertFalse(await uploader.upload_and_cleanup(make_item(), 30, caption="z"))
+            self.assertEqual(uploader.stats.file_id_stale, 0)
+            self.assertEqual(await uploader.cached_file_id(make_item()), "AgACFILEID")
+
+            # Telegram rejects the id: it is forgotten and the caller can upload again.
+            bot.send_photo.side_effect = BadRequest("Wrong file identifier/HTTP URL specified")
+            self.assertFalse(await uploader.upload_and_cleanup(make_item(), 30, caption="z"))
+            self.assertEqual(uploader.stats.file_id_stale, 1)
+            self.assertIsNone(await uploader.cached_file_id(make_item()))
+
+
+class TestAlbums(unittest.IsolatedAsyncioTestCase):
+    def _items(self, tmpdir, n):
+        from app.fetcher import MediaItem
+
+        items = []
+        for i in range(n):
+            item = MediaItem(f"https://coomer.st/data/aa/bb/h{i}.jpg", f"{i}.jpg", "photo", "p")
+            item.local_path = os.path.join(tmpdir, f"{i}.jpg")
+            with open(item.local_path, "wb") as f:
+                f.write(b"x")
+            items.append(item)
+        return items
+
+    async def test_albums_of_ten_with_guardrails(self):
+        from unittest.mock import MagicMock
+        from app.uploader import TelegramUploader
+
+        os.environ["TELEGRAM_MAX_UPLOAD_MB"] = "49"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bot = AsyncMock()
+            bot.send_media_group.side_effect = lambda chat_id, media: [MagicMock(message_id=i, photo=[]) for i in range(len(media))]
+            uploader = TelegramUploader(bot)
+            items = self._items(tmpdir, 13)
+            open(items[4].local_path, "wb").close()  # empty -> skipped, album still sent
+
+            results = await uploader.upload_group_and_cleanup(items, 5, caption="name_[x]")
+            self.assertEqual(bot.send_media_group.await_count, 2)
+            first_album = bot.send_media_group.await_args_list[0].kwargs["media"]
+            self.assertEqual(len(first_album), 9)
+            self.assertEqual(first_album[0].caption, "name_[x]")
+            self.assertFalse(first_album[0].parse_mode)  # DEFAULT_NONE, never Markdown
+            self.assertIsNone(results[4])
+            self.assertEqual(sum(r is not None for r in results), 12)
+            self.assertEqual(uploader.stats.skipped_empty, 1)
+            self.assertEqual(os.listdir(tmpdir), [])
+
+    async def test_rejected_album_falls_back_to_single_sends(self):
+        from app.uploader import TelegramUploader
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bot = AsyncMock()
+            bot.send_media_group.return_value = None
+            uploader = TelegramUploader(bot)
+            results = await uploader.upload_group_and_cleanup(self._items(tmpdir, 3), 5, caption="c")
+            self.assertEqual(bot.send_photo.await_count, 3)
+            self.assertEqual(uploader.stats.group_fallbacks, 1)
+            self.assertTrue(all(r is not None for r in results))
+            captions = [c.kwargs["caption"] for c in bot.send_photo.await_args_list]
+            self.assertEqual(captions, ["c", "", ""])
+
+    async def test_pipeline_batches_in_order(self):
+        from app.pipeline import run_ordered_pipeline
+
+        groups = []
+
+        async def download(i):
+            await asyncio.sleep(0.001 * (7 - i % 7))
+            return i != 2
+
+        async def upload(group):
+            groups.append(group)
+            return len(group)
+
+        result = await run_ordered_pipeline(list(range(23)), download, upload, concurrency=4, batch_size=10)
+        self.assertEqual(groups[0], [0, 1] + list(range(3, 11)))
+        self.assertEqual([len(g) for g in groups], [10, 10, 2])
+        self.assertEqual((result.uploaded, result.download_failed), (22, 1))
+
+
+class TestTelegramRateLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_per_chat_bucket_paces_and_global_allows_other_chats(self):
+        import time
+        from app.rate_limiter import TelegramRateLimiter
+
+        limiter = TelegramRateLimiter()
+        limiter.chat_rate, limiter.chat_burst = 20.0, 2.0
+
+        t0 = time.monotonic()
+        for _ in range(4):
+            await limiter.acquire(111)
+        self.assertGreaterEqual(time.monotonic() - t0, 0.09)  # 2 burst + 2 at 20/s
+
+        t0 = time.monotonic()
+        await asyncio.gather(*(limiter.acquire(chat) for chat in range(1000, 1010)))
+        self.assertLess(time.monotonic() - t0, 0.05)  # other chats are not held back
+        self.assertEqual(limiter.stats.acquired, 14)
+
+        # Senders queued on an empty chat bucket show up as queue depth.
+        await asyncio.gather(*(limiter.acquire(111) for _ in range(3)))
+        self.assertEqual(limiter.stats.queue_depth, 0)
+        self.assertGreaterEqual(limiter.stats.max_queue_depth, 3)
+        self.assertGreater(limiter.stats.max_wait_seconds, 0)
+
+    async def test_retry_after_pauses_chat_and_uploader_retries(self):
+        import time
+        from telegram.error import RetryAfter
+        from app.rate_limiter import TelegramRateLimiter
+        from app.uploader import TelegramUploader
+
+        limiter = TelegramRateLimiter()
+        calls = []
+
+        async def flaky():
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise RetryAfter(0)
+            return "ok"
+
+        uploader = TelegramUploader(AsyncMock(), limiter=limiter)
+        self.assertEqual(await uploader._send_with_retry(flaky, chat_id=222), "ok")
+        self.assertGreaterEqual(calls[1] - calls[0], 0.9)  # retry_after + 1s margin
+        self.assertEqual(limiter.stats.retry_after_events, 1)
+        self.assertLess(limiter._chats[222].rate, limiter.chat_rate)
+        self.assertLess(limiter.stats.global_rate, 30.0)
+
+
+    async def _grant_order(self, limiter, requests):
+        order = []
+
+        async def one(tag, chat, priority):
+            await limiter.acquire(chat, 1, priority)
+            order.append(tag)
+
+        tasks = []
+        for tag, chat, priority, delay in requests:
+            if delay:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(tag, chat, priority)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    async def test_ui_overtakes_bulk_and_aging_prevents_starvation(self):
+        from app.rate_limiter import Priority, TelegramRateLimiter
+
+        limiter = TelegramRateLimiter()
+        limiter.global_bucket = type(limiter.global_bucket)(50.0, 1.0)
+        limiter.aging_seconds = 60.0
+        order = await self._grant_order(limiter, [
+            ("bulk0", 1, Priority.BULK, 0),
+            ("bulk1", 2, Priority.BULK, 0),
+            ("bulk2", 3, Priority.BULK, 0),
+            ("vip", 4, Priority.VIP, 0),
+            ("ui", 5, Priority.UI, 0),
+        ])
+        self.assertEqual(order, ["bulk0", "ui", "vip", "bulk1", "bulk2"])
+        self.assertLess(limiter.stats.max_wait_by_priority["UI"], 0.05)
+
+        # With fast aging a bulk send that waited long enough goes before a fresh VIP one.
+        limiter = TelegramRateLimiter()
+        limiter.global_bucket = type(limiter.global_bucket)(5.0, 1.0)
+        limiter.aging_seconds = 0.05
+        order = await self._grant_order(limiter, [
+            ("first", 1, Priority.VIP, 0),
+            ("bulk", 2, Priority.BULK, 0),
+            ("vip", 3, Priority.VIP, 0.15),
+        ])
+        self.assertEqual(order, ["first", "bulk", "vip"])
+
+
+class TestDownloadPipeline(unittest.IsolatedAsyncioTestCase):
+    async def test_duplicate_items_download_to_separate_files(self):
+        from aiohttp import web
+        import app.fetcher as fetcher_mod
+        from app.fetcher import MediaItem
+
+        async def media(_request):
+            response = web.StreamResponse()
+            await response.prepare(_request)
+            for _ in range(4):
+                await response.write(b"x" * 1024)
+                await asyncio.sleep(0.01)
+            return response
+
+        web_app = web.Application()
+        web_app.add_routes([web.get("/data/aa/bb/main.jpg", media)])
+        runner = web.AppRunner(web_app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/data/aa/bb/main.jpg"
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            original = fetcher_mod.DOWNLOAD_DIR
+            fetcher_mod.DOWNLOAD_DIR = tmpdir
+            try:
+                # The post's main file listed again as an attachment, downloaded at the same time.
+                items = [MediaItem(url, "main.jpg", "photo", "p1") for _ in range(2)]
+                async with fetcher_mod.MediaFetcher() as fetcher:
+                    self.assertEqual(await asyncio.gather(*(fetcher.download_media(i) for i in items)), [True, True])
+                self.assertNotEqual(items[0].local_path, items[1].local_path)
+                os.remove(items[0].local_path)  # the first upload's cleanup
+                self.assertEqual(os.path.getsize(items[1].local_path), 4096)
+
+                # Two users' jobs on the same creator page: one job's cleanup spares the other's file.
+                jobs = [MediaItem(url, "main.jpg", "photo", "p1") for _ in range(2)]
+
+                async def job(item):
+                    async with fetcher_mod.MediaFetcher() as fetcher:
+                        return await fetcher.download_media(item)
+
+                self.assertEqual(await asyncio.gather(*(job(i) for i in jobs)), [True, True])
+                os.remove(jobs[0].local_path)
+                self.assertEqual(os.path.getsize(jobs[1].local_path), 4096)
+            finally:
+                fetcher_mod.DOWNLOAD_DIR = original
+                await runner.cleanup()
+
+    async def test_order_preserved_and_overlapped(self):
+        import time
+        from app.pipeline import run_ordered_pipeline
+
+        delays = [0.08, 0.01, 0.05, 0.01, 0.03, 0.01]
+        uploaded = []
+
+        async def download(i):
+            await asyncio.sleep(delays[i])
+            return i != 3  # one failed download is skipped, not fatal
+
+        async def upload(i):
+            await asyncio.sleep(0.04)
+            uploaded.append(i)
+            return True
+
+        t0 = time.monotonic()
+        result = await run_ordered_pipeline(list(range(6)), download, upload, concurrency=3, lookahead=4)
+        elapsed = time.monotonic() - t0
+
+        self.assertEqual(uploaded, [0, 1, 2, 4, 5])
+        self.assertEqual((result.uploaded, result.download_failed), (5, 1))
+        sequential = sum(delays) + 0.04 * 5
+        self.assertLess(elapsed, sequential * 0.8)
+
+    async def test_cancel_removes_downloaded_but_unsent_files(self):
+        from app.fetcher import MediaItem
+        from app.pipeline import run_ordered_pipeline
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            items = [MediaItem(f"https://x/{i}.jpg", f"{i}.jpg") for i in range(5)]
+
+            async def download(item):
+                item.local_path = os.path.join(tmpdir, item.filename)
+                with open(item.local_path, "wb") as f:
+                    f.write(b"x")
+                return True
+
+            async def upload(item):
+                os.remove(item.local_path)
+                await asyncio.sleep(10)
+                return True
+
+            task = asyncio.create_task(run_ordered_pipeline(items, download, upload, concurrency=2, lookahead=3))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(os.listdir(tmpdir), [])
+
+
+class TestDownloadJobs(unittest.IsolatedAsyncioTestCase):
+    async def test_job_resumes_after_restart_and_skips_sent_items(self):
+        from app.download_jobs import DownloadJobQueue
+        from app.users_db import AsyncUserDB, UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "jobs.db"))
+            adb = AsyncUserDB(db)
+            release = asyncio.Event()
+            seen = []
+
+            async def slow_runner(job):
+                # Delivers two items, then gets interrupted by the redeploy.
+                db.mark_download_job_items_sent(job["id"], ["/a.jpg", "/b.jpg"])
+                await release.wait()
+                return 50
+
+            queue = DownloadJobQueue(db=adb)
+            await queue.start(slow_runner, workers=2)
+            job_id = await queue.submit(7, "onlyfans", "c1", "Name", 0, chat_id=7, message_id=99)
+            await asyncio.sleep(0.05)
+            await queue.stop()
+            self.assertEqual(db.get_download_job(job_id)["status"], "running")
+
+            async def runner(job):
+                seen.append((job["id"], job["resumed"], job["sent_keys"], job["message_id"]))
+                return 50
+
+            queue = DownloadJobQueue(db=adb)
+            await queue.start(runner, workers=2)
+            await asyncio.sleep(0.05)
+            self.assertEqual(seen, [(job_id, True, {"/a.jpg", "/b.jpg"}, 99)])
+            job = db.get_download_job(job_id)
+            self.assertEqual((job["status"], job["next_offset"], job["sent_count"]), ("done", 50, 2))
+            self.assertEqual(db.get_last_download_job(7)["next_offset"], 50)
+            self.assertEqual(queue.stats.resumed, 1)
+            await queue.stop()
+
+    async def test_new_page_supersedes_running_job(self):
+        from app.download_jobs import DownloadJobQueue
+        from app.users_db import AsyncUserDB, UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "jobs.db"))
+            adb = AsyncUserDB(db)
+            started = []
+
+            async def runner(job):
+                started.append(job["id"])
+                if job["page_offset"] == 0:
+                    await asyncio.sleep(10)
+                return job["page_offset"] + 50
+
+            queue = DownloadJobQueue(db=adb)
+            await queue.start(runner, workers=2)
+            first = await queue.submit(7, "onlyfans", "c1", "Name", 0)
+            await asyncio.sleep(0.05)
+            second = await queue.submit(7, "onlyfans", "c1", "Name", 50)
+            await asyncio.sleep(0.05)
+            self.assertEqual(started, [first, second])
+            self.assertEqual(db.get_download_job(first)["status"], "cancelled")
+            self.assertEqual(db.get_download_job(second)["status"], "done")
+            self.assertEqual(queue.stats.cancelled, 1)
+
+            self.assertFalse(await queue.cancel_user(7))  # nothing left to stop
+            await queue.stop()
+
+    async def test_stop_cancels_running_page_and_reports_sent(self):
+        from app.download_jobs import DownloadJobQueue
+        from app.users_db import AsyncUserDB, UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "jobs.db"))
+            adb = AsyncUserDB(db)
+            progress = []
+
+            async def runner(job):
+                for i in range(100):
+                    db.mark_download_job_items_sent(job["id"], [f"/{i}.jpg"])
+                    progress.append(i)
+                    await asyncio.sleep(0.01)
+                return 50
+
+            reported = []
+
+            async def on_stopped(job, sent):
+                reported.append((job["id"], sent))
+
+            queue = DownloadJobQueue(db=adb)
+            await queue.start(runner, workers=1, on_stopped=on_stopped)
+            job_id = await queue.submit(7, "onlyfans", "c1", "Name", 0)
+            await asyncio.sleep(0.055)
+            self.assertTrue(await queue.cancel_user(7))  # returns without waiting for the page
+            self.assertEqual(reported, [])
+            await asyncio.sleep(0.03)
+            self.assertEqual(reported, [(job_id, len(progress))])
+            self.assertLess(len(progress), 100)
+            self.assertEqual(db.get_download_job(job_id)["status"], "cancelled")
+            self.assertEqual(db.get_download_job_sent_keys(job_id), set())
+            await queue.stop()
+
+
 class TestUserDB(unittest.TestCase):
     def test_user_creation_and_toggles(self):
         fd, tmp_db = tempfile.mkstemp(prefix="bot_it_db_", suffix=".sqlite")
@@ -194,9 +1268,187 @@ class TestUserDB(unittest.TestCase):
         db.update_user(42, is_god_mode=0, is_vip=1)
         self.assertTrue(db.is_license_active(42))
 
+    def test_connection_is_reused_with_wal_pragmas(self):
+        from app.users_db import UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "wal.db"))
+            conn = db._get_conn()
+            self.assertIs(db._get_conn(), conn)
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertLess(conn.execute("PRAGMA cache_size").fetchone()[0], 0)  # sized in KiB
+            db.get_user(1)
+            self.assertIsNone(db._get_conn().row_factory)  # get_user's sqlite3.Row does not leak
+            db.close()
+
+    def test_user_rows_cached_with_write_through(self):
+        import sqlite3
+        from app.users_db import UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ["USER_CACHE_SIZE"] = "2"
+            try:
+                db = UserDB(db_path=os.path.join(tmpdir, "cache.db"))
+            finally:
+                os.environ.pop("USER_CACHE_SIZE", None)
+            selects = []
+            db._get_conn().set_trace_callback(
+                lambda sql: selects.append(sql) if sql.lstrip().upper().startswith("SELECT * FROM USERS") else None
+            )
+
+            # A typical callback: one SELECT, then everything comes from the cache.
+            db.get_user(7)
+            selects.clear()
+            db.get_user(7)
+            db.is_license_active(7)
+            self.assertTrue(db.check_preview_limit(7))
+            db.increment_previews(7)
+            self.assertEqual(selects, [])
+            self.assertEqual(db.get_user(7)["daily_previews_used"], 1)
+
+            # Write-through matches what is on disk.
+            db.update_user(7, credits=2)
+            cached = db.get_user(7)
+            db.invalidate_user(7)
+            self.assertEqual(db.get_user(7), cached)
+
+            # Callers cannot corrupt the cached row.
+            cached["credits"] = 99
+            self.assertEqual(db.get_user(7)["credits"], 2)
+
+            # Bounded LRU.
+            db.get_user(8)
+            db.get_user(9)
+            self.assertEqual(db.user_cache_stats.size, 2)
+            self.assertGreaterEqual(db.user_cache_stats.evictions, 1)
+            self.assertGreater(db.user_cache_stats.hits, 0)
+
+            # A failed commit rolls back, and the row written through ahead of it is dropped.
+            real_conn = db._get_conn()
+
+            class FailingCommit:
+                def __getattr__(self, name):
+                    return getattr(real_conn, name)
+
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *exc):
+                    return real_conn.__exit__(*exc)
+
+                def commit(self):
+                    raise sqlite3.OperationalError("database is locked")
+
+            db.get_user(9)
+            db._get_conn = lambda: FailingCommit()
+            with self.assertRaises(sqlite3.OperationalError):
+                db.update_user(9, credits=5)
+            del db._get_conn
+            self.assertEqual(db.get_user(9)["credits"], 0)
+            db.close()
+
+    def test_credit_preview_and_referral_updates_are_atomic(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from app.users_db import UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "atomic.db"))
+            db.update_user(1, credits=10)
+            db.get_user(2)
+            db.get_user(4)
+
+            # Eight threads = eight connections racing on the same rows.
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                used = list(pool.map(lambda _: db.use_credit(1), range(40)))
+                list(pool.map(lambda _: db.increment_previews(2), range(40)))
+                previews = list(pool.map(lambda _: db.use_preview(4), range(20)))
+                rewarded = list(pool.map(lambda _: db.process_referral(3, 1), range(20)))
+
+            self.assertEqual(used.count(True), 10)
+            self.assertEqual(rewarded.count(True), 1)
+            db.invalidate_user()  # read back what is on disk
+            referrer = db.get_user(1)
+            self.assertEqual((referrer["credits"], referrer["referral_count"]), (3, 1))
+            self.assertEqual(db.get_user(2)["daily_previews_used"], 40)
+            self.assertEqual(db.get_user(3)["referred_by"], 1)
+            self.assertFalse(db.use_credit(2))
+
+            # Free previews: exactly the daily limit, however many taps race; a new day resets.
+            self.assertEqual(previews.count(True), 3)
+            self.assertEqual(db.get_user(4)["daily_previews_used"], 3)
+            db.update_user(4, last_preview_date="2000-01-01")
+            self.assertTrue(db.use_preview(4))
+            self.assertEqual(db.get_user(4)["daily_previews_used"], 1)
+
+
+class TestActivityFlush(unittest.IsolatedAsyncioTestCase):
+    async def test_last_seen_is_batched_and_flushed_on_close(self):
+        import sqlite3
+        from app.users_db import AsyncUserDB, UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "activity.db")
+            db = UserDB(db_path=path)
+            for uid in (1, 2, 3):
+                db.get_user(uid)
+
+            def on_disk(uid, column="last_seen"):
+                with sqlite3.connect(path) as conn:
+                    return conn.execute(f"SELECT {column} FROM users WHERE user_id = ?", (uid,)).fetchone()[0]
+
+            before = on_disk(1)
+            writes = []
+            db._get_conn().set_trace_callback(lambda sql: writes.append(sql) if sql.lstrip().upper().startswith("UPDATE") else None)
+
+            for _ in range(50):
+                db.touch_user(1)
+                db.touch_user(2)
+            db.activate_license(3, "lifetime")  # state change: committed right away
+            self.assertEqual(on_disk(3, "license_type"), "lifetime")
+            self.assertEqual(len(writes), 1)
+            self.assertEqual(on_disk(1), before)
+            self.assertNotEqual(db.get_user(1)["last_seen"], before)  # readers see the pending value
+
+            self.assertEqual(db.flush_activity(), 3)
+            self.assertEqual(db.get_user(1)["last_seen"], on_disk(1))
+            self.assertEqual(db.activity_stats.flushes, 1)
+            self.assertEqual(db.flush_activity(), 0)
+
+            adb = AsyncUserDB(db)
+            adb.start(interval=60)
+            db.touch_user(2)
+            pending = db.get_user(2)["last_seen"]
+            await adb.close()  # shutdown writes the last batch
+            self.assertEqual(on_disk(2), pending)
+
+
+class TestAsyncUserDB(unittest.IsolatedAsyncioTestCase):
+    async def test_calls_run_on_one_db_thread(self):
+        import threading
+        from app.users_db import AsyncUserDB, UserDB
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = UserDB(db_path=os.path.join(tmpdir, "async.db"))
+            threads = set()
+            original = db.get_user
+
+            def get_user(user_id):
+                threads.add(threading.get_ident())
+                return original(user_id)
+
+            db.get_user = get_user
+            adb = AsyncUserDB(db)
+            users = await asyncio.gather(*(adb.get_user(uid) for uid in range(10)))
+            self.assertEqual([u["user_id"] for u in users], list(range(10)))
+            self.assertEqual(len(threads), 1)
+            self.assertNotIn(threading.get_ident(), threads)
+
+            await adb.update_user(3, language="en")
+            self.assertEqual((await adb.get_user(3))["language"], "en")
+            self.assertEqual(db.get_user(3)["language"], "en")  # same file, loop-thread connection
+            await adb.close()
+
 
 if __name__ == "__main__":
-    # Ensure env prepared for imports that read at module import time.
-    tmp_db = os.path.join(tempfile.gettempdir(), "bot_integration_test.db")
-    _prepare_env(tmp_db)
     unittest.main(verbosity=2)